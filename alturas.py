@@ -0,0 +1,69 @@
+import os
+import math
+import bisect
+
+
+ALTURA_PALLET = float(os.environ.get('ALTURA_PALLET', '0.15'))
+ALTURA_CAMADAS_PRECALCULADAS = int(os.environ.get('ALTURA_CAMADAS_PRECALCULADAS', '30'))
+
+# Faixas "altura_maxima=ZONA,ZONA;...;*=ZONA": zonas em ordem de prioridade para
+# alturas até o limite da faixa; '*' vale para qualquer altura acima das demais
+ZONAS_POR_ALTURA_PADRAO = "1.0=PEQ,MED,RUA;1.35=MED,GRA,RUA;2.0=GRA,RUA;*=RUA"
+
+
+def _ler_faixas(texto):
+    faixas = []
+    for trecho in filter(None, (t.strip() for t in texto.split(";"))):
+        limite, _, zonas = trecho.partition("=")
+        zonas = [z.strip().upper() for z in zonas.split(",") if z.strip()]
+        if not zonas:
+            raise ValueError(f"ZONAS_POR_ALTURA: faixa '{trecho}' sem zonas.")
+        faixas.append((math.inf if limite.strip() == "*" else float(limite), zonas))
+    faixas.sort(key=lambda f: f[0])
+    if not faixas or faixas[-1][0] != math.inf:
+        raise ValueError("ZONAS_POR_ALTURA: inclua a faixa '*' para alturas acima do último limite.")
+    return faixas
+
+
+FAIXAS_ZONAS = _ler_faixas(os.environ.get('ZONAS_POR_ALTURA', ZONAS_POR_ALTURA_PADRAO))
+_LIMITES = [limite for limite, _ in FAIXAS_ZONAS]
+
+
+def calcular_altura(volume, cx_lastro, altura_caixa):
+    """Altura necessária: camadas (volume / Cx_Lastro, arredondado para cima) x altura da caixa + pallet."""
+    return round(math.ceil(volume / cx_lastro) * altura_caixa + ALTURA_PALLET, 2)
+
+
+def zonas_por_altura(altura_necessaria):
+    """
+    Retorna a lista de zonas prioritárias baseadas na altura necessária.
+    """
+    return list(FAIXAS_ZONAS[bisect.bisect_left(_LIMITES, altura_necessaria)][1])
+
+
+class PerfilAltura:
+    """
+    Altura e zonas de um item já calculadas para 1..ALTURA_CAMADAS_PRECALCULADAS
+    camadas; volumes maiores são calculados na hora com a mesma fórmula.
+    """
+
+    __slots__ = ("cx_lastro", "altura_caixa", "_tabela")
+
+    def __init__(self, cx_lastro, altura_caixa, camadas=ALTURA_CAMADAS_PRECALCULADAS):
+        if cx_lastro <= 0 or altura_caixa <= 0:
+            raise ValueError("Cx_Lastro e Altura devem ser maiores que zero.")
+        self.cx_lastro = cx_lastro
+        self.altura_caixa = altura_caixa
+        self._tabela = [None]
+        for n in range(1, camadas + 1):
+            altura = round(n * altura_caixa + ALTURA_PALLET, 2)
+            self._tabela.append((altura, zonas_por_altura(altura)))
+
+    def calcular(self, volume):
+        """Retorna (altura_necessaria, zonas) para o volume."""
+        camadas = math.ceil(volume / self.cx_lastro)
+        if 0 < camadas < len(self._tabela):
+            altura, zonas = self._tabela[camadas]
+            return altura, list(zonas)
+        altura = calcular_altura(volume, self.cx_lastro, self.altura_caixa)
+        return altura, zonas_por_altura(altura)
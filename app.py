@@ -1,14 +1,26 @@
 import os
+import io
+import csv
+import time
+import tempfile
 import secrets
 import logging
 from functools import wraps
-from flask import Flask, render_template, request, send_file, session, redirect, url_for, jsonify
+from flask import Flask, render_template, request, send_file, session, redirect, url_for, jsonify, g, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
-from database import fetch_data, get_usuario_by_id, create_usuario, update_usuario_senha, fetch_data_locação, get_item_cubagem, salvar_ou_atualizar_item_cubagem
-from etiquetaszpl import imprimir_etiqueta
-from tabulate import tabulate
-from waitress import serve
+from database import fetch_data, get_usuario_by_id, create_usuario, update_usuario_senha, buscar_locacoes_candidatas, candidatas_cache_stats, fetch_locacao_zonas, get_item_cubagem, salvar_ou_atualizar_item_cubagem, cubagem_cache_stats, odbc_pool_stats, indice_locacoes_stats, reservas_stats, liberar_reserva_locacao, liberar_reserva_provisoria, confirmar_reserva_locacao, encerrar_reservas_gravadas, validar_manifesto, disjuntor_bpcs_stats, carregar_locacoes_livres, reservar_locacao, calcular_altura_item, autenticar_usuario, verificar_chave_senhas, migrar_senhas_cifradas, credenciais_stats, cofre_credenciais, sqlite_stats, credenciais_usuario, BPCS_SERVICO_UID
+from credenciais import exigir_chave, ChaveCredenciaisInvalida
+from sessao_servidor import InterfaceSessaoServidor
+from fila_impressao import enfileirar_etiqueta, enfileirar_lote_etiquetas, fila_impressao, IMPRESSAO_PRAZO
+from gravador_macro import gravar_macros
+from diario_recebimento import diario_recebimento, DIARIO_CONSULTA_MAX
+from ocupacao import analise_ocupacao, OCUPACAO_JANELA_HORAS
+from importador_cubagem import importacoes_cubagem, EXTENSOES_ACEITAS
+from planejador import calcular_alturas, planejar
+from alturas import zonas_por_altura
+from resiliencia import LimitadorTaxa
+from telemetria import configurar_logs, definir_correlacao, registrar_requisicao, exportar_metricas
 
 
 
@@ -25,12 +37,374 @@ app.config.update(
     SESSION_COOKIE_SECURE=os.environ.get('FLASK_ENV') == 'production', 
     SESSION_PERMANENT=True
 )
+# Conteúdo da sessão e buffers ficam no servidor; o cookie leva só o ID assinado
+app.session_interface = InterfaceSessaoServidor()
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-logging.basicConfig(level=logging.INFO)
+MACRO_PATH = os.environ.get('MACRO_PATH', r"C:\Users\a9ww9zz\Desktop\Recebimento 2.0\output")
+PREFETCH_TTL = float(os.environ.get('PREFETCH_TTL', '120'))
+# /fetch_locacao: consultas por segundo e rajada permitidas a cada usuário (coletor)
+FETCH_LOCACAO_TAXA = float(os.environ.get('FETCH_LOCACAO_TAXA', '1'))
+FETCH_LOCACAO_RAJADA = float(os.environ.get('FETCH_LOCACAO_RAJADA', '5'))
+MENSAGEM_CHAVE_INVALIDA = "Chave das credenciais do servidor não confere; avise o suporte."
+# Token do coletor de métricas (Authorization: Bearer ...) para /status e /metrics sem login
+MONITORAMENTO_TOKEN = os.environ.get('MONITORAMENTO_TOKEN', '')
+LOCACAO_LIMITE_MAXIMO = int(os.environ.get('LOCACAO_LIMITE_MAXIMO', '50'))
+limitador_fetch_locacao = LimitadorTaxa(FETCH_LOCACAO_TAXA, FETCH_LOCACAO_RAJADA)
+# Etiquetas acompanhadas pela sessão: sem notícia do job (outro processo) depois de
+# IMPRESSAO_CONFIRMACAO s ela é dada como impressa, mas uma falha no diário ainda é vista por
+# IMPRESSOES_PENDENTES_MAX_IDADE s
+IMPRESSAO_CONFIRMACAO = 2 * IMPRESSAO_PRAZO + 5
+IMPRESSOES_PENDENTES_MAX_IDADE = 600
+configurar_logs()
+# Sem a chave certa das senhas do BPCS o servidor não sobe (em vez de recusar todos os logins)
+exigir_chave()
+verificar_chave_senhas()
+migrar_senhas_cifradas()
+
+
+# ---------- Rastreamento por requisição ----------
+@app.before_request
+def iniciar_rastreamento():
+    # Reaproveita o X-Request-ID do proxy/cliente, se houver, para ligar os logs ponta a ponta
+    g.id_correlacao = definir_correlacao(request.headers.get('X-Request-ID'))
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def finalizar_rastreamento(response):
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None:
+        rota = request.url_rule.rule if request.url_rule else 'desconhecida'
+        registrar_requisicao(rota, request.method, response.status_code, time.perf_counter() - inicio)
+    response.headers['X-Request-ID'] = g.get('id_correlacao', '')
+    return response
+
+
+
+
+def normalizar_mov(mov):
+    mov = str(mov).strip().upper()
+    if mov.startswith('W'):
+        mov = mov[1:]
+    return mov[-6:]
+
+def classificar_tipo_item(classe):
+    classe = str(classe or "").strip()
+    if classe in ("1", "7"):
+        return "STD"
+    elif classe == "2":
+        return "NSTD"
+    return "STD"  # valor padrão seguro
+
+def formatar_diagnostico(registro):
+    # tabulate só é importado quando o log de DEBUG está ativo
+    if registro is None:
+        return "Nenhum dado retornado pelo fetch_data."
+    from tabulate import tabulate
+    return tabulate([registro.as_dict()], headers='keys', tablefmt='fancy_grid')
+
+def _chaves_consulta(dados):
+    """
+    Chaves que ligam o prefetch à consulta final: a da locação (armazém, item, volume)
+    e a da validação no BPCS (também lote, movimentação e quantidade; None se incompleta).
+    Listas, para comparar com o que volta da sessão (JSON).
+    """
+    item = str(dados.get('item') or '').strip()
+    armazem = str(dados.get('Armazem') or '').strip()
+    try:
+        volume = float(dados.get('Volume'))
+    except (TypeError, ValueError):
+        return None, None
+    if not item or not armazem:
+        return None, None
+    chave_locacao = [armazem, item, volume]
+
+    lote = str(dados.get('lote') or '').strip()
+    mov = normalizar_mov(dados.get('Mov') or '')
+    try:
+        quantidade = float(dados.get('QUD')) * volume
+    except (TypeError, ValueError):
+        quantidade = None
+    chave_bpcs = [item, lote, mov, quantidade, armazem] if lote and mov and quantidade is not None else None
+    return chave_locacao, chave_bpcs
 
+def prefetch_consulta(dados, usuario_id, anterior=None, planejada=None):
+    """
+    Adianta a consulta enquanto o operador ainda digita: busca a locação com uma reserva
+    provisória de PREFETCH_TTL segundos e, se lote/mov/QUD já vieram, valida no BPCS.
+    Com uma locação planejada para o pallet (ver locacao_planejada) só a validação é feita.
+    Retorna o prefetch a guardar na sessão (ou None); a reserva de um prefetch anterior
+    para outros dados é liberada.
+    """
+    chave_locacao, chave_bpcs = _chaves_consulta(dados)
+    agora = time.time()
+    valido = anterior is not None and anterior.get("expira_em", 0) > agora
+
+    if anterior and anterior.get("locacao") and (not valido or anterior["chave_locacao"] != chave_locacao):
+        liberar_reserva_provisoria(anterior["chave_locacao"][0], anterior["locacao"], usuario_id, PREFETCH_TTL)
+        anterior, valido = None, False
+    if chave_locacao is None:
+        return None
 
+    info = get_item_cubagem(chave_locacao[1])
+    if not info or any(info.get(c) in (None, '', 0) for c in ["Altura", "Cx_Lastro"]):
+        return None
 
+    prefetch = dict(anterior) if valido else {"chave_locacao": chave_locacao, "locacao": None, "zona": None,
+                                              "chave_bpcs": None, "classe": None}
+    if not prefetch["locacao"] and planejada is None:
+        resultado = buscar_locacao_com_fallback(chave_locacao[0], chave_locacao[1], chave_locacao[2],
+                                                dono=usuario_id, usuario_id=usuario_id, ttl=PREFETCH_TTL)
+        if resultado and resultado[0]:
+            prefetch["locacao"], prefetch["zona"] = resultado
+            prefetch["expira_em"] = agora + PREFETCH_TTL
+
+    if chave_bpcs is not None and prefetch["chave_bpcs"] != chave_bpcs:
+        item, lote, mov, quantidade, armazem = chave_bpcs
+        data = fetch_data(item, lote, mov, quantidade, armazem, usuario_id=usuario_id)
+        prefetch["chave_bpcs"] = chave_bpcs if data is not None else None
+        prefetch["classe"] = data.classe if data is not None else None
+
+    prefetch.setdefault("expira_em", agora + PREFETCH_TTL)
+    return prefetch
+
+def prefetch_da_sessao(sessao):
+    """
+    Tira o prefetch da sessão para a requisição atual. Um prefetch cuja locação já está no
+    buffer da macro (gravado por um prefetch simultâneo ao "Consultar" que a usou) é descartado
+    sem liberar a reserva: a locação é de uma consulta já feita.
+    """
+    prefetch = sessao.pop('prefetch', None)
+    if prefetch and prefetch.get("locacao") and sessao.contem_no_buffer(
+            'locacoes_buffer', f"{prefetch['chave_locacao'][0]}\t{prefetch['locacao']}"):
+        logging.info(f"[PREFETCH] Locação {prefetch['locacao']} já está na macro; prefetch descartado.")
+        return None
+    return prefetch
+
+def consultar_locacoes_livres(dados, usuario_id):
+    """
+    Consulta 'onde posso guardar isto?' do coletor: as menores locações livres da zona
+    com altura >= altura_min, sem reservar nada. Usada pelo /fetch_locacao do Flask e do
+    modo assíncrono; retorna (corpo, status, cabeçalhos).
+    """
+    if not usuario_id:
+        return {"success": False, "mensagem": "Sessão expirada. Faça login novamente."}, 401, {}
+
+    permitido, espera = limitador_fetch_locacao.permitir(str(usuario_id))
+    if not permitido:
+        return ({"success": False, "mensagem": "Muitas consultas seguidas; aguarde e tente novamente."},
+                429, {"Retry-After": str(max(1, int(espera + 0.999)))})
+
+    zona = str(dados.get("zona") or dados.get("tipo") or "").strip().upper()
+    armazem = str(dados.get("armazem") or "").strip()
+    if not zona or not armazem:
+        return {"success": False, "mensagem": "Zona ou armazém não informado."}, 400, {}
+    try:
+        altura_min = float(dados.get("altura_min") or 0)
+        limite = int(dados.get("limite") or 10)
+    except (TypeError, ValueError):
+        return {"success": False, "mensagem": "Altura mínima ou limite inválido."}, 400, {}
+    if altura_min < 0 or not 1 <= limite <= LOCACAO_LIMITE_MAXIMO:
+        return {"success": False, "mensagem": f"Altura mínima deve ser >= 0 e limite entre 1 e {LOCACAO_LIMITE_MAXIMO}."}, 400, {}
+
+    try:
+        candidatas, do_cache = buscar_locacoes_candidatas(armazem, zona, altura_min, limite, usuario_id=usuario_id)
+    except (ValueError, ConnectionError) as e:
+        return {"success": False, "mensagem": str(e)}, 503, {}
+
+    locacoes = [{"locacao": loc, "zona": z, "altura": altura} for loc, z, altura in candidatas]
+    if not locacoes:
+        return {"success": False, "mensagem": "Nenhum endereço disponível para essa combinação.",
+                "locacoes": [], "cache": do_cache}, 200, {}
+    return {"success": True, "armazem": armazem, "zona": zona, "locacoes": locacoes,
+            "endereco": locacoes[0]["locacao"], "cache": do_cache}, 200, {}
+
+def processar_consulta(form, usuario_id, prefetch=None, planejada=None):
+    """
+    Parte bloqueante do fluxo 'consultar' (cubagem, BPCS e locação), sem impressão
+    e sem tocar na sessão; usada pelo index() e pelo modo assíncrono (app_asgi.py).
+    A locação planejada para o pallet (/planejar_recebimento) é usada primeiro; um prefetch
+    com os mesmos dados evita repetir a validação e a busca da locação.
+    Retorna {'erro': mensagem} ou os dados da conferência:
+    {'armazem', 'mov', 'locacao', 'zona', 'macro'}.
+    """
+    item = form['item']
+    lote = form['lote']
+    Mov = normalizar_mov(form['Mov'].strip().upper())
+    Armazem = form['Armazem']
+    Volume = form['Volume']
+    QUD = form['QUD']
+
+    # Validação de cubagem
+    info_cubagem = get_item_cubagem(item)
+    campos_obrigatorios = ["Comprimento", "Largura", "Altura", "Cubagem", "Cx_Lastro"]
+
+    if not info_cubagem or any(info_cubagem.get(c) in (None, '', 0) for c in campos_obrigatorios):
+        return {"erro": "O item não possui todas as informações de cubagem preenchidas. Complete antes de continuar."}
+    try:
+        Quantidade = float(QUD) * float(Volume)
+    except ValueError:
+        return {"erro": "Erro ao calcular a quantidade. Verifique os valores de QUD e Volume."}
+
+    chave_locacao, chave_bpcs = _chaves_consulta(form)
+    if prefetch and prefetch.get("expira_em", 0) <= time.time():
+        prefetch = dict(prefetch, chave_bpcs=None)
+
+    try:
+        if prefetch and chave_bpcs is not None and prefetch.get("chave_bpcs") == chave_bpcs:
+            classe = prefetch["classe"]
+            logging.info(f"[PREFETCH] Validação do BPCS reaproveitada para a movimentação {Mov}.")
+        else:
+            data = fetch_data(item, lote, Mov, Quantidade, Armazem, usuario_id=usuario_id)
+
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"[DEBUG] Resultado da consulta ao BPCS:\n{formatar_diagnostico(data)}")
+
+            if data is None:
+                if prefetch and prefetch.get("locacao"):
+                    liberar_reserva_provisoria(prefetch["chave_locacao"][0], prefetch["locacao"], usuario_id,
+                                               PREFETCH_TTL)
+                return {"erro": "Dados informados não coincidem com o BPCS. Verifique e tente novamente."}
+            classe = data.classe
+
+        locacao_resultado = zona_utilizada = None
+        if planejada and planejada["chave_locacao"] == chave_locacao and \
+                confirmar_reserva_locacao(Armazem, planejada["locacao"], usuario_id):
+            locacao_resultado, zona_utilizada = planejada["locacao"], planejada["zona"]
+            logging.info(f"[PLANEJAMENTO] Locação planejada {locacao_resultado} confirmada.")
+        if prefetch and prefetch.get("locacao"):
+            if locacao_resultado is None and prefetch["chave_locacao"] == chave_locacao and \
+                    confirmar_reserva_locacao(Armazem, prefetch["locacao"], usuario_id):
+                locacao_resultado, zona_utilizada = prefetch["locacao"], prefetch["zona"]
+                logging.info(f"[PREFETCH] Reserva provisória de {locacao_resultado} confirmada.")
+            else:
+                liberar_reserva_provisoria(prefetch["chave_locacao"][0], prefetch["locacao"], usuario_id, PREFETCH_TTL)
+
+        if locacao_resultado is None:
+            locacao_resultado, zona_utilizada = buscar_locacao_com_fallback(
+                armazem=Armazem,
+                item=item,
+                volume=Volume,
+                dono=usuario_id,
+                usuario_id=usuario_id
+            )
+        if not (locacao_resultado and zona_utilizada):
+            return {"erro": "Nenhuma locação disponível."}
+    except (ValueError, ConnectionError) as e:
+        return {"erro": str(e)}
+    except Exception as e:
+        logging.error(f"Erro inesperado durante consulta: {e}")
+        return {"erro": "Erro inesperado durante a consulta ao sistema BPCS."}
+
+    # Monta a macro corretamente
+    tipo_item_deducido = classificar_tipo_item(classe)
+    macro = (
+        f"{Armazem}[tab]W{Mov}[tab][enter]{locacao_resultado}[enter][pf6]"
+        if tipo_item_deducido == "STD"
+        else f"{Armazem}[tab]W{Mov}[tab][enter]{locacao_resultado}{Volume}[enter][pf6]"
+    )
+    return {"armazem": Armazem, "mov": Mov, "locacao": locacao_resultado, "zona": zona_utilizada, "macro": macro}
+
+def registrar_recebimento(form, resultado, usuario_id, upin, impressora, job_impressao, evento="recebimento"):
+    """Conferência concluída vai para o diário (gravação em segundo plano); usada pelo index() e pelo modo assíncrono."""
+    diario_recebimento.registrar(
+        evento, usuario_id=str(usuario_id), upin=upin, armazem=resultado["armazem"], item=form.get("item"),
+        lote=form.get("lote"), mov=resultado["mov"], volume=form.get("Volume"), qud=form.get("QUD"),
+        locacao=resultado["locacao"], zona=resultado["zona"], impressora=impressora,
+        job_impressao=job_impressao, macro=resultado["macro"],
+    )
+
+def desfazer_sem_etiqueta(form, resultado, usuario_id, upin, impressora):
+    """
+    ao_falhar do job da etiqueta: se ela não imprimir de vez, a reserva da locação é liberada
+    e a falha vai para o diário (evento falha_impressao), onde conferir_impressoes() a encontra
+    em qualquer processo. Roda na thread da impressora, sem request nem sessão.
+    """
+    form = form.to_dict() if hasattr(form, "to_dict") else dict(form)
+
+    def ao_falhar(job_id, erro):
+        logging.warning(f"[IMPRESSÃO] Etiqueta de {resultado['locacao']} (mov {resultado['mov']}) não impressa; "
+                        f"reserva liberada.")
+        liberar_reserva_locacao(resultado["armazem"], resultado["locacao"], usuario_id)
+        registrar_recebimento(form, resultado, usuario_id, upin, impressora, job_id, evento="falha_impressao")
+    return ao_falhar
+
+def acompanhar_impressao(sessao, job_id, resultado):
+    if not job_id:
+        return
+    sessao['impressoes_pendentes'] = (sessao.get('impressoes_pendentes') or []) + [{
+        "job": job_id, "armazem": resultado["armazem"], "locacao": resultado["locacao"], "mov": resultado["mov"],
+        "macro": resultado["macro"], "criado_em": time.time(),
+    }]
+
+def locacao_planejada(sessao, dados):
+    """Locação do plano da sessão (/planejar_recebimento) para o pallet informado, ou None."""
+    plano = sessao.get('plano_recebimento')
+    chave_locacao, _ = _chaves_consulta(dados)
+    if not plano or chave_locacao is None:
+        return None
+    if plano["expira_em"] <= time.time():
+        sessao.pop('plano_recebimento', None)
+        return None
+    return next((p for p in plano["locacoes"] if p["chave_locacao"] == chave_locacao), None)
+
+def consumir_planejada(sessao, planejada):
+    # Pallet consultado: a entrada sai do plano (mesmo que a locação planejada tenha expirado)
+    plano = sessao.get('plano_recebimento')
+    if not planejada or not plano or planejada not in plano["locacoes"]:
+        return
+    locacoes = list(plano["locacoes"])
+    locacoes.remove(planejada)
+    if locacoes:
+        sessao['plano_recebimento'] = dict(plano, locacoes=locacoes)
+    else:
+        sessao.pop('plano_recebimento', None)
+
+def liberar_plano(sessao, usuario_id):
+    """Libera as reservas das locações planejadas que ainda não foram consultadas. Retorna quantas."""
+    plano = sessao.pop('plano_recebimento', None)
+    if not plano:
+        return 0
+    for p in plano["locacoes"]:
+        liberar_reserva_locacao(p["chave_locacao"][0], p["locacao"], usuario_id)
+    logging.info(f"[PLANEJAMENTO] {len(plano['locacoes'])} locações planejadas liberadas.")
+    return len(plano["locacoes"])
+
+def conferir_impressoes(sessao):
+    """
+    Confere as etiquetas pendentes da sessão. A consulta cuja etiqueta falhou sai do buffer da
+    macro e vira um aviso que fica na tela até o operador dispensar, sem depender da tela estar
+    acompanhando o job. Retorna (avisos, etiquetas ainda em andamento).
+    """
+    pendentes = sessao.get('impressoes_pendentes') or []
+    avisos = sessao.get('falhas_impressao') or []
+    if not pendentes:
+        return avisos, 0
+
+    falhas = diario_recebimento.falhas_impressao([p["job"] for p in pendentes])
+    agora = time.time()
+    restantes, novos_avisos, em_andamento = [], [], 0
+    for p in pendentes:
+        job = fila_impressao.status_job(p["job"])
+        status = job["status"] if job else None
+        if status == "erro" or p["job"] in falhas:
+            sessao.remover_do_buffer('macro_buffer', p["macro"])
+            sessao.remover_do_buffer('locacoes_buffer', f"{p['armazem']}\t{p['locacao']}")
+            novos_avisos.append(f"A etiqueta da movimentação {p['mov']} (locação {p['locacao']}) não foi impressa. "
+                                f"A consulta foi desfeita: verifique a impressora e consulte de novo.")
+            continue
+        if status == "concluido" or agora - p["criado_em"] > IMPRESSOES_PENDENTES_MAX_IDADE:
+            continue
+        if status in ("na_fila", "imprimindo") or (status is None and agora - p["criado_em"] < IMPRESSAO_CONFIRMACAO):
+            em_andamento += 1
+        restantes.append(p)
+
+    if len(restantes) != len(pendentes):
+        sessao['impressoes_pendentes'] = restantes
+    if novos_avisos:
+        avisos = avisos + novos_avisos
+        sessao['falhas_impressao'] = avisos
+    return avisos, em_andamento
 
 # Decorador de login
 def login_required(f):
@@ -41,177 +415,108 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def monitoramento_required(f):
+    """Estado interno (pools, disjuntor, filas): usuário logado ou o token do coletor de métricas."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        autorizacao = request.headers.get('Authorization', '')
+        token_ok = bool(MONITORAMENTO_TOKEN) and autorizacao.startswith('Bearer ') and \
+            secrets.compare_digest(autorizacao[len('Bearer '):].strip(), MONITORAMENTO_TOKEN)
+        if 'usuario_id' not in session and not token_ok:
+            return jsonify({"success": False, "mensagem": "Não autorizado."}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     error = None
     success = None
+    job_impressao = None
 
     if request.method == 'POST' and 'usuario_id' not in session:
         error = "Sessão expirada. Faça login novamente."
-        macro_count = len(session.get('macro_buffer', []))
+        macro_count = session.contar_buffer('macro_buffer')
         return render_template('index.html', error=error, macro_count=macro_count)
 
-    if 'macro_buffer' not in session:
-        session['macro_buffer'] = []
+    avisos_impressao, impressoes_em_andamento = conferir_impressoes(session)
 
     if request.method == 'POST':
-        action = request.form.get('action')
-        item = request.form['item']
-        lote = request.form['lote']
-        Mov = request.form['Mov'].strip().upper()
-        Armazem = request.form['Armazem']
-        Volume = request.form['Volume']
-        QUD = request.form['QUD']
-        
-
-        if Mov.startswith('W'):
-            Mov = Mov[1:]
-        Mov = Mov[-6:]
-
-        
         action = request.form.get("action")
-        if action == "consultar":
-            # Validação de cubagem
-            info_cubagem = get_item_cubagem(item)
-            campos_obrigatorios = ["Comprimento", "Largura", "Altura", "Cubagem", "Cx_Lastro"]
-
-            if not info_cubagem or any(info_cubagem.get(c) in (None, '', 0) for c in campos_obrigatorios):
-                error = "O item não possui todas as informações de cubagem preenchidas. Complete antes de continuar."
-                macro_count = len(session.get('macro_buffer', []))
-                return render_template('index.html', error=error, macro_count=macro_count)
-            try:
-                Quantidade = float(QUD) * float(Volume)
-            except ValueError:
-                error = "Erro ao calcular a quantidade. Verifique os valores de QUD e Volume."
-                macro_count = len(session.get('macro_buffer', []))
-                return render_template('index.html', error=error, macro_count=macro_count)
-
-            try:
-                data = fetch_data(item, lote, Mov, Quantidade, Armazem )
-
-                if data is not None:
-                    print("[DEBUG] Resultado da consulta ao BPCS:")
-                    print(tabulate(data, headers='keys', tablefmt='fancy_grid'))
-                else:
-                    print("[DEBUG] Nenhum dado retornado pelo fetch_data.")
-
-                if data is not None:
-                    if 'locacoes_usadas' not in session:
-                        session['locacoes_usadas'] = []
-
-                    locacao_resultado, zona_utilizada = buscar_locacao_com_fallback(
-                    armazem=Armazem,
-                    locacoes_usadas=session['locacoes_usadas'],
-                    item=item,
-                    volume=Volume
-                )
+        if action == "dispensar_falhas":
+            session.pop('falhas_impressao', None)
+            avisos_impressao = []
 
-                    if locacao_resultado and zona_utilizada:
-                        session['locacoes_usadas'].append(locacao_resultado)
-
-                        # Imprimir etiqueta com base na zona usada
-
-                        upin = session.get("upin", "")
-                        impressora = request.form.get("Impressora")
-                        logging.info(f"[DEBUG] Impressora selecionada: >>{impressora}<<")
-
-                        try:
-                            imprimir_etiqueta([locacao_resultado], zona=zona_utilizada, movimentacao=Mov, upin=upin, impressora=impressora)
-                        except ValueError as e:
-                            error = str(e)
-                        except ConnectionError as ce:
-                            error = str(ce)
-                            macro_count = len(session.get('macro_buffer', []))
-                            return render_template('index.html', error=error, macro_count=macro_count)
-                        logging.debug(f"[FORM DATA] {request.form}")
-                        # Monta a macro corretamente e adiciona ao buffer
-                        data.columns = [col.strip().lower() for col in data.columns]
-
-                        
-                        # Acesso com nome normalizado
-                        classe = str(data.iloc[0]["classe"]).strip()
-                        if classe in ("1", "7"):
-                            tipo_item_deducido = "STD"
-                        elif classe == "2":
-                            tipo_item_deducido = "NSTD"
-                        else:
-                            tipo_item_deducido = "STD"  # valor padrão seguro
-
-                        macro = (
-                            f"{Armazem}[tab]W{Mov}[tab][enter]{locacao_resultado}[enter][pf6]"
-                            if tipo_item_deducido == "STD"
-                            else f"{Armazem}[tab]W{Mov}[tab][enter]{locacao_resultado}{Volume}[enter][pf6]"
-                        )
-                        macro_buffer = session.get('macro_buffer', [])
-                        macro_buffer.append(macro)
-                        session['macro_buffer'] = macro_buffer
-
-                        success = "Consulta adicionada com sucesso."
-                    else:
-                        error = "Nenhuma locação disponível."
-                else:
-                    error = "Dados informados não coincidem com o BPCS. Verifique e tente novamente."
-                
-
-            except ValueError as ve:
-                error = str(ve)
-            except ValueError as ve:
-                error = str(ve)
-            except ConnectionError as ce:
-                error = str(ce)  
-            except Exception as e:
-                logging.error(f"Erro inesperado durante consulta: {e}")
-                error = "Erro inesperado durante a consulta ao sistema BPCS."
-                 
+        elif action == "consultar":
+            planejada = locacao_planejada(session, request.form)
+            resultado = processar_consulta(request.form, session['usuario_id'], prefetch_da_sessao(session),
+                                           planejada)
+
+            if "erro" in resultado:
+                error = resultado["erro"]
+            else:
+                # Imprimir etiqueta com base na zona usada
+                upin = session.get("upin", "")
+                impressora = request.form.get("Impressora")
+                logging.info(f"[DEBUG] Impressora selecionada: >>{impressora}<<")
+
+                try:
+                    job_impressao = enfileirar_etiqueta(
+                        [resultado["locacao"]], zona=resultado["zona"], movimentacao=resultado["mov"], upin=upin,
+                        impressora=impressora,
+                        ao_falhar=desfazer_sem_etiqueta(request.form, resultado, session['usuario_id'], upin, impressora))
+                except ValueError as e:
+                    error = str(e)
+                except ConnectionError as ce:
+                    error = str(ce)
+                    liberar_reserva_locacao(resultado["armazem"], resultado["locacao"], session['usuario_id'])
+                    macro_count = session.contar_buffer('macro_buffer')
+                    return render_template('index.html', error=error, macro_count=macro_count,
+                                           falhas_impressao=avisos_impressao)
+                logging.debug(f"[FORM DATA] {request.form}")
+
+                session.anexar_buffer('macro_buffer', resultado["macro"])
+                session.anexar_buffer('locacoes_buffer', f"{resultado['armazem']}\t{resultado['locacao']}")
+                consumir_planejada(session, planejada)
+                registrar_recebimento(request.form, resultado, session['usuario_id'], upin, impressora, job_impressao)
+                acompanhar_impressao(session, job_impressao, resultado)
+                success = "Consulta adicionada com sucesso."
 
         elif action == "gravar":
-            macro_buffer = session.get('macro_buffer', [])
-            if not macro_buffer:
+            if not session.contar_buffer('macro_buffer'):
                 error = "Nenhuma macro em buffer para gravar."
+            elif impressoes_em_andamento:
+                # Uma etiqueta que ainda pode falhar tiraria a consulta de uma macro já gravada
+                error = f"Aguarde a impressão de {impressoes_em_andamento} etiqueta(s) terminar antes de gravar a macro."
             else:
-                full_macro = (
-                    '<HAScript name="Macro">'
-                    '<screen name="MainScreen" entryscreen="true">'
-                    '<description></description>'
-                    '<actions><input value="' + "".join(macro_buffer) + '"/></actions>'
-                    '<nextscreens timeout="0" ><nextscreen name="EndScreen" /></nextscreens>'
-                    '</screen>'
-                    '<screen name="EndScreen" exitscreen="true">'
-                    '<description></description><actions></actions>'
-                    '<nextscreens timeout="0" ></nextscreens>'
-                    '</screen>'
-                    '</HAScript>'
-                )
-
                 try:
-                    network_path = os.environ.get(
-                        'MACRO_PATH',
-                        r"C:\Users\a9ww9zz\Desktop\Recebimento 2.0\output"
-                    )
-                    os.makedirs(network_path, exist_ok=True)
-                    filename = "macro_final.mac"
-                    full_path = os.path.join(network_path, filename)
-
-                    with open(full_path, 'w') as f:
-                        f.write(full_macro)
-
-                    session['file_path'] = full_path
-                    session['macro_buffer'] = []
-                    session['locacoes_usadas'] = []
-
-                    return redirect(url_for('index', download=filename))
+                    # Entradas vão do buffer direto para o arquivo, sem montar a macro em memória
+                    arquivos = gravar_macros(session.buffer('macro_buffer'), MACRO_PATH,
+                                             usuario=session.get('upin', ''))
+
+                    session['file_path'] = os.path.join(MACRO_PATH, arquivos[-1])
+                    session.limpar_buffer('macro_buffer')
+                    # Locações já estão na macro: a reserva longa deixa de ser necessária
+                    encerrar_reservas_gravadas([tuple(l.split("\t", 1)) for l in session.buffer('locacoes_buffer')],
+                                               session['usuario_id'])
+                    session.limpar_buffer('locacoes_buffer')
+                    session.pop('impressoes_pendentes', None)
+
+                    return redirect(url_for('index', download=",".join(arquivos)))
                 except Exception as e:
                     error = f"Erro ao salvar a macro: {str(e)}"
                     logging.error(error)
 
-    macro_count = len(session.get('macro_buffer', []))
-    return render_template('index.html', error=error, success=success, macro_count=macro_count)
+    macro_count = session.contar_buffer('macro_buffer')
+    return render_template('index.html', error=error, success=success, macro_count=macro_count, job_impressao=job_impressao,
+                           falhas_impressao=avisos_impressao)
 
 @app.route('/static_download/<filename>')
 def static_download(filename):
-    path = os.path.join(BASE_DIR, 'output', filename)
-    if os.path.exists(path):
-        return send_file(path, as_attachment=True)
+    filename = os.path.basename(filename)
+    for pasta in (MACRO_PATH, os.path.join(BASE_DIR, 'output')):
+        path = os.path.join(pasta, filename)
+        if os.path.exists(path):
+            return send_file(path, as_attachment=True)
     return redirect(url_for('index'))
 
 @app.route('/verificar_usuario', methods=['POST'])
@@ -241,6 +546,9 @@ def salvar_usuario():
 @app.route('/logout', methods=['POST'])
 def logout():
     try:
+        if 'usuario_id' in session:
+            cofre_credenciais.invalidar(session['usuario_id'])
+            liberar_plano(session, session['usuario_id'])
         session.clear()
         return jsonify({'success': True}), 200
     except Exception as e:
@@ -254,81 +562,251 @@ def verificar_status_login():
 @app.route('/login', methods=['POST'])
 def login():
     user_id = request.json.get('id')
-    usuario = get_usuario_by_id(user_id)
+    try:
+        usuario = autenticar_usuario(user_id)
+    except ChaveCredenciaisInvalida:
+        return jsonify({'success': False, 'message': MENSAGEM_CHAVE_INVALIDA}), 500
 
     if usuario:
+        # A senha do BPCS fica só no cofre de credenciais (memória do servidor), nunca na sessão
+        session.regenerar()
         session['usuario_id'] = usuario['id']
         session['upin'] = usuario['upin']
-        session['senha'] = usuario['senha']
         return jsonify({'success': True})
     else:
         return jsonify({'success': False}), 401
 
 @app.route("/fetch_locacao", methods=["POST"])
 def fetch_locacao():
-    data = request.get_json()
-    zona = data.get("tipo")
-    armazem = data.get("armazem")
-
-    if not zona or not armazem:
-        return jsonify({"success": False, "mensagem": "Zona ou armazém não informado."}), 400
+    corpo, codigo, cabecalhos = consultar_locacoes_livres(request.get_json(silent=True) or {}, session.get('usuario_id'))
+    return jsonify(corpo), codigo, cabecalhos
 
-    endereco = fetch_data_locação(zona, armazem)
-    if endereco:
-        return jsonify({"success": True, "endereco": endereco})
-    else:
-        return jsonify({"success": False, "mensagem": "Nenhum endereço disponível para essa combinação."})
 
+@app.route('/prefetch_consulta', methods=['POST'])
+def prefetch_consulta_endpoint():
+    if 'usuario_id' not in session:
+        return jsonify({"success": False, "mensagem": "Sessão expirada. Faça login novamente."}), 401
 
-def zonas_por_altura(altura_necessaria):
-    """
-    Retorna a lista de zonas prioritárias baseadas na altura necessária.
-    """
-    if altura_necessaria <= 1.0:
-        return ["PEQ", "MED", "RUA"]
-    elif altura_necessaria <= 1.35:
-        return ["MED", "GRA", "RUA"]
-    elif altura_necessaria <= 2:
-        return ["GRA", "RUA"]
+    try:
+        dados = request.get_json(silent=True) or {}
+        prefetch = prefetch_consulta(dados, session['usuario_id'], prefetch_da_sessao(session),
+                                     locacao_planejada(session, dados))
+    except (ValueError, ConnectionError) as e:
+        return jsonify({"success": False, "mensagem": str(e)})
+
+    if prefetch is None:
+        return jsonify({"success": False})
+    session['prefetch'] = prefetch
+    return jsonify({"success": True, "locacao": prefetch["locacao"], "zona": prefetch["zona"],
+                    "validado": prefetch["chave_bpcs"] is not None})
+
+
+MANIFESTO_MAX_LINHAS = int(os.environ.get('MANIFESTO_MAX_LINHAS', '2000'))
+
+def _ler_linhas_manifesto():
+    # Aceita JSON {"linhas": [...]} / lista, ou CSV (upload 'arquivo' ou corpo text/csv)
+    if request.is_json:
+        dados = request.get_json()
+        linhas = dados.get("linhas", []) if isinstance(dados, dict) else dados
+        armazem_padrao = dados.get("armazem") if isinstance(dados, dict) else None
     else:
-        return ["RUA"]
+        arquivo = request.files.get("arquivo")
+        conteudo = arquivo.read().decode("utf-8-sig") if arquivo else request.get_data(as_text=True)
+        delimitador = ";" if conteudo.split("\n", 1)[0].count(";") > conteudo.split("\n", 1)[0].count(",") else ","
+        linhas = list(csv.DictReader(io.StringIO(conteudo), delimiter=delimitador))
+        armazem_padrao = request.form.get("armazem") or request.args.get("armazem")
+
+    normalizadas = []
+    for linha in linhas:
+        linha = {str(k).strip().lower(): (v.strip() if isinstance(v, str) else v) for k, v in linha.items() if k}
+        if armazem_padrao and not linha.get("armazem"):
+            linha["armazem"] = armazem_padrao
+        normalizadas.append(linha)
+    return normalizadas
+
+@app.route('/validar_manifesto', methods=['POST'])
+def validar_manifesto_endpoint():
+    if 'usuario_id' not in session:
+        return jsonify({"success": False, "mensagem": "Sessão expirada. Faça login novamente."}), 401
+
+    linhas = _ler_linhas_manifesto()
+    if not linhas:
+        return jsonify({"success": False, "mensagem": "Manifesto vazio."}), 400
+    if len(linhas) > MANIFESTO_MAX_LINHAS:
+        return jsonify({"success": False, "mensagem": f"Manifesto excede {MANIFESTO_MAX_LINHAS} linhas."}), 400
+
+    resultados = []
+    validas = []
+    for numero, linha in enumerate(linhas, start=1):
+        resultado = {"linha": numero, "item": linha.get("item"), "lote": linha.get("lote"),
+                     "mov": normalizar_mov(linha.get("mov", "")), "armazem": linha.get("armazem")}
+        resultados.append(resultado)
+
+        faltando = [c for c in ("item", "lote", "mov", "armazem") if not linha.get(c)]
+        if faltando:
+            resultado.update(valido=False, erro=f"Campos obrigatórios ausentes: {', '.join(faltando)}.")
+            continue
+        try:
+            if linha.get("quantidade") not in (None, ""):
+                quantidade = float(linha["quantidade"])
+            else:
+                quantidade = float(linha["qud"]) * float(linha["volume"])
+        except (KeyError, TypeError, ValueError):
+            resultado.update(valido=False, erro="Erro ao calcular a quantidade. Verifique os valores de QUD e Volume.")
+            continue
+
+        resultado["quantidade"] = quantidade
+        validas.append((resultado, {"item": resultado["item"], "lote": resultado["lote"], "mov": resultado["mov"],
+                                    "quantidade": quantidade, "armazem": resultado["armazem"]}))
+
+    if validas:
+        try:
+            conferencias = validar_manifesto([consulta for _, consulta in validas])
+        except ValueError as ve:
+            return jsonify({"success": False, "mensagem": str(ve)}), 401
+        except ConnectionError as ce:
+            return jsonify({"success": False, "mensagem": str(ce)}), 502
+
+        for (resultado, _), conferencia in zip(validas, conferencias):
+            if conferencia["encontrado"]:
+                resultado.update(valido=True, classe=conferencia["classe"],
+                                 tipo_item=classificar_tipo_item(conferencia["classe"]))
+            else:
+                resultado.update(valido=False, erro="Dados informados não coincidem com o BPCS.")
 
-def buscar_locacao_com_fallback(armazem, locacoes_usadas, item, volume):
-    info = get_item_cubagem(item)
-    if not info:
-        logging.warning("Item não encontrado na cubagem.")
-        return None
+    return jsonify({
+        "success": True,
+        "total": len(resultados),
+        "validas": sum(1 for r in resultados if r.get("valido")),
+        "resultados": resultados,
+    })
 
+def buscar_locacao_com_fallback(armazem, item, volume, dono=None, usuario_id=None, ttl=None):
     try:
-        volume = float(volume)
-        cx_lastro = float(info['Cx_Lastro'])
-        altura_item = float(info['Altura'])
+        calculo = calcular_altura_item(item, float(volume))
+    except (TypeError, ValueError):
+        calculo = None
+    if calculo is None:
+        logging.warning("Item sem cubagem completa ou volume inválido.")
+        return None, None
 
-        ALTURA_PALLET = 0.15
-        altura_necessaria = ((volume / cx_lastro) * altura_item) + ALTURA_PALLET
-        altura_necessaria = round(altura_necessaria, 2)
-    except Exception as e:
-        logging.warning(f"[ERRO ALTURA] Erro ao calcular altura necessária: {e}")
-        return None
-
-    zonas_tentativas = zonas_por_altura(altura_necessaria)
+    altura_necessaria, zonas_tentativas = calculo
 
     logging.info(f"[FALLBACK] Altura necessária: {altura_necessaria} → zonas tentativas: {zonas_tentativas}")
 
-    for zona in zonas_tentativas:
-        endereco = fetch_data_locação(
-            zona=zona,
-            armazem=armazem,
-            excluir_locs=locacoes_usadas,
-            volume=volume,
-            item=item
-        )
-        if endereco:
-            return endereco, zona
+    endereco, zona = fetch_locacao_zonas(
+        zonas=zonas_tentativas,
+        armazem=armazem,
+        volume=volume,
+        item=item,
+        dono=dono,
+        usuario_id=usuario_id,
+        ttl=ttl
+    )
+    if endereco:
+        return endereco, zona
 
     logging.warning("[FALLBACK] Nenhuma locação encontrada em nenhuma zona.")
     return None, None
 
+PLANEJAMENTO_MAX_PALETES = int(os.environ.get('PLANEJAMENTO_MAX_PALETES', '1000'))
+PLANEJAMENTO_RESERVA_TTL = float(os.environ.get('PLANEJAMENTO_RESERVA_TTL', '1800'))
+
+@app.route('/planejar_recebimento', methods=['POST'])
+def planejar_recebimento():
+    """
+    Planeja as locações de todos os pallets de um recebimento de uma vez.
+    JSON: {"armazem": "01", "paletes": [{"item", "volume"}, ...], "reservar": false}
+    Com "reservar": true as locações escolhidas ficam reservadas para o usuário por
+    PLANEJAMENTO_RESERVA_TTL segundos e o plano vai para a sessão: o "Consultar" de cada pallet
+    usa a locação planejada. Um novo plano reservado substitui (e libera) o anterior.
+    """
+    if 'usuario_id' not in session:
+        return jsonify({"success": False, "mensagem": "Sessão expirada. Faça login novamente."}), 401
+
+    dados = request.get_json(silent=True) or {}
+    armazem = str(dados.get("armazem") or "").strip()
+    paletes = dados.get("paletes")
+    if not armazem or not isinstance(paletes, list) or not paletes:
+        return jsonify({"success": False, "mensagem": "Informe o armazém e a lista de pallets."}), 400
+    if len(paletes) > PLANEJAMENTO_MAX_PALETES:
+        return jsonify({"success": False, "mensagem": f"Máximo de {PLANEJAMENTO_MAX_PALETES} pallets por planejamento."}), 400
+
+    resultados = []
+    validos, volumes, cx_lastro, altura_caixa = [], [], [], []
+    for indice, palete in enumerate(paletes):
+        palete = palete if isinstance(palete, dict) else {}
+        item = str(palete.get("item") or "").strip()
+        resultado = {"indice": indice, "item": item, "volume": palete.get("volume")}
+        resultados.append(resultado)
+
+        info = get_item_cubagem(item) if item else None
+        try:
+            volume = float(palete.get("volume"))
+            cx, altura = float(info['Cx_Lastro']), float(info['Altura'])
+            if volume <= 0 or cx <= 0 or altura <= 0:
+                raise ValueError
+        except (TypeError, ValueError, KeyError):
+            resultado["erro"] = "Item sem cubagem completa ou volume inválido."
+            continue
+        validos.append(resultado)
+        volumes.append(volume)
+        cx_lastro.append(cx)
+        altura_caixa.append(altura)
+
+    alocados = 0
+    sobra_total = 0.0
+    if validos:
+        alturas = calcular_alturas(volumes, cx_lastro, altura_caixa)
+        zonas = [zonas_por_altura(h) for h in alturas.tolist()]
+        todas_zonas = sorted({z for lista in zonas for z in lista})
+        usuario_id = session['usuario_id']
+        if dados.get("reservar"):
+            liberar_plano(session, usuario_id)
+
+        try:
+            locacoes = carregar_locacoes_livres(armazem, todas_zonas, float(alturas.min()), usuario_id)
+        except ValueError as ve:
+            return jsonify({"success": False, "mensagem": str(ve)}), 401
+        except ConnectionError as ce:
+            return jsonify({"success": False, "mensagem": str(ce)}), 502
+
+        tomar = None
+        if dados.get("reservar"):
+            tomar = lambda loc: reservar_locacao(armazem, loc, usuario_id, PLANEJAMENTO_RESERVA_TTL)
+        plano = planejar(alturas, zonas, locacoes, tomar)
+
+        planejadas = []
+        for resultado, volume, altura_necessaria, escolha in zip(validos, volumes, alturas.tolist(), plano):
+            resultado["altura_necessaria"] = altura_necessaria
+            if escolha is None:
+                resultado["erro"] = "Nenhuma locação disponível."
+                continue
+            loc, zona, altura_loc = escolha
+            sobra = round(altura_loc - altura_necessaria, 2)
+            resultado.update(locacao=loc, zona=zona, altura_locacao=altura_loc, sobra=sobra)
+            planejadas.append({"chave_locacao": [armazem, resultado["item"], volume], "locacao": loc, "zona": zona})
+            alocados += 1
+            sobra_total += sobra
+        if tomar is not None and planejadas:
+            session['plano_recebimento'] = {"expira_em": time.time() + PLANEJAMENTO_RESERVA_TTL,
+                                            "locacoes": planejadas}
+
+    return jsonify({
+        "success": True,
+        "total": len(resultados),
+        "alocados": alocados,
+        "sobra_total": round(sobra_total, 2),
+        "paletes": resultados,
+    })
+
+@app.route('/liberar_planejamento', methods=['POST'])
+def liberar_planejamento():
+    """Desiste do plano reservado da sessão: as locações ainda não consultadas são liberadas."""
+    if 'usuario_id' not in session:
+        return jsonify({"success": False, "mensagem": "Sessão expirada. Faça login novamente."}), 401
+    return jsonify({"success": True, "liberadas": liberar_plano(session, session['usuario_id'])})
+
 @app.route('/verificar_item_cubagem', methods=['POST'])
 def verificar_item_cubagem():
     item = request.json.get('item')
@@ -357,6 +835,177 @@ def salvar_item_cubagem():
         return jsonify({"success": True})
     return jsonify({"success": False, "message": "Erro ao salvar no banco de dados."})
 
+@app.route('/importar_cubagem', methods=['POST'])
+@login_required
+def importar_cubagem():
+    # Cadastro mestre em CSV/XLSX: o upload vai para um arquivo temporário e a carga roda em segundo plano
+    arquivo = request.files.get('arquivo')
+    if not arquivo or not arquivo.filename:
+        return jsonify({"success": False, "mensagem": "Envie o arquivo no campo 'arquivo'."}), 400
+    extensao = os.path.splitext(arquivo.filename)[1].lower()
+    if extensao not in EXTENSOES_ACEITAS:
+        return jsonify({"success": False, "mensagem": "Formato não suportado (use CSV ou XLSX)."}), 400
+
+    fd, caminho = tempfile.mkstemp(prefix="cubagem_", suffix=extensao)
+    with os.fdopen(fd, 'wb') as destino:
+        arquivo.save(destino)
+    job_id = importacoes_cubagem.iniciar(caminho, os.path.basename(arquivo.filename))
+    logging.info(f"[CUBAGEM] Importação {job_id} de {arquivo.filename} iniciada por {session['usuario_id']}.")
+    return jsonify({"success": True, "job_id": job_id}), 202
+
+@app.route('/importar_cubagem/<job_id>')
+@login_required
+def status_importacao_cubagem(job_id):
+    job = importacoes_cubagem.status(job_id)
+    if not job:
+        return jsonify({"success": False, "mensagem": "Importação não encontrada."}), 404
+    return jsonify({"success": True, **job})
+
+@app.route('/importar_cubagem/<job_id>/relatorio')
+@login_required
+def relatorio_importacao_cubagem(job_id):
+    job = importacoes_cubagem.status(job_id)
+    if not job or job.get("status") != "concluido" or not os.path.exists(job.get("relatorio") or ""):
+        return jsonify({"success": False, "mensagem": "Relatório não disponível."}), 404
+    return send_file(job["relatorio"], as_attachment=True, download_name=os.path.basename(job["relatorio"]))
+
+@app.route('/impressao/<job_id>')
+@login_required
+def status_impressao(job_id):
+    job = fila_impressao.status_job(job_id)
+    if job:
+        return jsonify({"success": True, **job})
+    # A fila é do processo que enfileirou: em outro worker, a falha definitiva aparece no diário
+    if job_id in diario_recebimento.falhas_impressao([job_id]):
+        return jsonify({"success": True, "id": job_id, "status": "erro",
+                        "erro": "A etiqueta não foi impressa."})
+    if any(p["job"] == job_id for p in session.get('impressoes_pendentes') or []):
+        return jsonify({"success": True, "id": job_id, "status": "desconhecido"})
+    return jsonify({"success": False, "mensagem": "Job de impressão não encontrado."}), 404
+
+def _registros_diario(dados):
+    # Registros de recebimento pelos IDs do diário ou por movimentação (reimpressão e macro)
+    if dados.get("ids"):
+        registros = diario_recebimento.obter(dados["ids"])
+    elif dados.get("mov"):
+        registros = diario_recebimento.consultar(mov=normalizar_mov(dados["mov"]), armazem=dados.get("armazem"),
+                                                 limite=DIARIO_CONSULTA_MAX)[::-1]
+    else:
+        raise ValueError("Informe os IDs do diário ou a movimentação.")
+    return [r for r in registros if r["evento"] == "recebimento"]
+
+@app.route('/recebimentos')
+@login_required
+def consultar_recebimentos():
+    try:
+        registros = diario_recebimento.consultar(
+            mov=normalizar_mov(request.args['mov']) if request.args.get('mov') else None,
+            armazem=request.args.get('armazem'), locacao=request.args.get('locacao'),
+            usuario_id=request.args.get('usuario'), desde=request.args.get('desde', type=float),
+            ate=request.args.get('ate', type=float), limite=request.args.get('limite', 100, type=int),
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "mensagem": str(e)}), 400
+    return jsonify({"success": True, "recebimentos": registros})
+
+@app.route('/recebimentos/reimprimir', methods=['POST'])
+@login_required
+def reimprimir_recebimentos():
+    dados = request.get_json(silent=True) or {}
+    try:
+        registros = _registros_diario(dados)
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "mensagem": str(e)}), 400
+    if not registros:
+        return jsonify({"success": False, "mensagem": "Nenhum recebimento encontrado no diário."}), 404
+
+    # Etiquetas refeitas a partir do diário, sem BPCS nem busca de locação; uma impressão por impressora
+    por_impressora = {}
+    for r in registros:
+        por_impressora.setdefault(dados.get("impressora") or r["impressora"], []).append(r)
+    jobs = {}
+    try:
+        for impressora, itens in por_impressora.items():
+            etiquetas = [{"endereco": r["locacao"], "zona": r["zona"], "movimentacao": r["mov"], "upin": r["upin"]}
+                         for r in itens]
+            jobs[impressora] = job_id = enfileirar_lote_etiquetas(etiquetas, impressora=impressora)
+            for r in itens:
+                diario_recebimento.registrar(
+                    "reimpressao", origem_id=r["id"], usuario_id=str(session['usuario_id']), upin=session.get('upin', ''),
+                    armazem=r["armazem"], item=r["item"], lote=r["lote"], mov=r["mov"], volume=r["volume"],
+                    qud=r["qud"], locacao=r["locacao"], zona=r["zona"], impressora=impressora, job_impressao=job_id,
+                )
+    except (ValueError, ConnectionError) as e:
+        return jsonify({"success": False, "mensagem": str(e), "jobs": jobs}), 400
+    return jsonify({"success": True, "etiquetas": len(registros), "jobs": jobs})
+
+@app.route('/recebimentos/macro', methods=['POST'])
+@login_required
+def regerar_macro_recebimentos():
+    dados = request.get_json(silent=True) or {}
+    try:
+        registros = _registros_diario(dados)
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "mensagem": str(e)}), 400
+    entradas = [r["macro"] for r in registros if r["macro"]]
+    if not entradas:
+        return jsonify({"success": False, "mensagem": "Nenhum recebimento encontrado no diário."}), 404
+
+    arquivos = gravar_macros(entradas, MACRO_PATH, usuario=session.get('upin', ''))
+    return jsonify({"success": True, "entradas": len(entradas), "arquivos": arquivos,
+                    "downloads": [url_for('static_download', filename=nome) for nome in arquivos]})
+
+@app.route('/ocupacao')
+@login_required
+def painel_ocupacao():
+    try:
+        painel = analise_ocupacao.painel(request.args.get('armazem', ''),
+                                         request.args.get('janela', OCUPACAO_JANELA_HORAS, type=float))
+    except ValueError as e:
+        return jsonify({"success": False, "mensagem": str(e)}), 400
+    if painel is None:
+        return jsonify({"success": False, "mensagem": "Nenhuma captura de ocupação para o armazém. "
+                                                      "Use POST /ocupacao/capturar."}), 404
+    return jsonify({"success": True, **painel})
+
+@app.route('/ocupacao/capturar', methods=['POST'])
+@login_required
+def capturar_ocupacao():
+    dados = request.get_json(silent=True) or {}
+    # Sem usuário de serviço, a leitura da ILE/IULM usa as credenciais de quem pediu
+    credenciais = None if BPCS_SERVICO_UID else credenciais_usuario(session['usuario_id'])
+    if not BPCS_SERVICO_UID and not credenciais:
+        return jsonify({"success": False, "mensagem": "Sessão expirada. Faça login novamente."}), 401
+    try:
+        analise_ocupacao.capturar(dados.get('armazem', ''), credenciais)
+        painel = analise_ocupacao.painel(dados.get('armazem', ''), float(dados.get('janela') or OCUPACAO_JANELA_HORAS))
+    except (ValueError, ConnectionError) as e:
+        return jsonify({"success": False, "mensagem": str(e)}), 400
+    return jsonify({"success": True, **painel})
+
+@app.route('/status')
+@monitoramento_required
+def status():
+    return jsonify({
+        "cache_cubagem": cubagem_cache_stats(),
+        "pool_odbc": odbc_pool_stats(),
+        "indice_locacoes": indice_locacoes_stats(),
+        "reservas": reservas_stats(),
+        "bpcs": disjuntor_bpcs_stats(),
+        "credenciais": credenciais_stats(),
+        "sqlite": sqlite_stats(),
+        "diario_recebimento": diario_recebimento.status(),
+        "ocupacao": analise_ocupacao.status(),
+        "fetch_locacao": {"cache": candidatas_cache_stats(), "limitador": limitador_fetch_locacao.status()},
+        "impressoras": fila_impressao.status(),
+    })
+
+@app.route('/metrics')
+@monitoramento_required
+def metrics():
+    # Métricas deste processo no formato texto do Prometheus
+    return Response(exportar_metricas(), mimetype='text/plain; version=0.0.4')
+
 @app.errorhandler(500)
 def internal_server_error(e):
     return render_template('500.html'), 500 
@@ -368,9 +1017,10 @@ def handle_exception(e):
 
 
 
-# Rodar com Waitress para produção (use Gunicorn no Linux)
+# Servidor de desenvolvimento; em produção use servidor.py (Gunicorn no Linux, Waitress no Windows)
 if __name__ == '__main__':
     logging.info("Servidor iniciado em modo desenvolvimento.")
+    analise_ocupacao.iniciar()
     app.run(host='0.0.0.0', port=5000)
 
 
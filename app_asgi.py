@@ -0,0 +1,366 @@
+"""
+Modo assíncrono (ASGI) do sistema de recebimento.
+
+O fluxo 'consultar' do index() e os endpoints JSON do scanner (/login,
+/fetch_locacao, /verificar_item_cubagem, /prefetch_consulta) rodam no event
+loop: o trabalho bloqueante (ODBC/BPCS e SQLite) vai para um executor com
+número fixo de threads e a etiqueta é enviada à impressora com asyncio streams. As demais rotas são
+repassadas ao app Flask (WSGI) num executor próprio.
+
+Execução: uvicorn app_asgi:aplicacao --host 0.0.0.0 --port 5000
+"""
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.wrappers import Request, Response
+
+from app import app, processar_consulta, prefetch_consulta, consultar_locacoes_livres, registrar_recebimento, \
+    desfazer_sem_etiqueta, acompanhar_impressao, conferir_impressoes, locacao_planejada, consumir_planejada, \
+    prefetch_da_sessao, \
+    MENSAGEM_CHAVE_INVALIDA
+from credenciais import ChaveCredenciaisInvalida
+from ocupacao import analise_ocupacao
+from database import autenticar_usuario, get_item_cubagem, salvar_ou_atualizar_item_cubagem, liberar_reserva_locacao
+from fila_impressao import FilaImpressaoAsync
+from telemetria import definir_correlacao, registrar_requisicao
+
+
+ASGI_THREADS_BPCS = int(os.environ.get('ASGI_THREADS_BPCS', '16'))
+ASGI_THREADS_WSGI = int(os.environ.get('ASGI_THREADS_WSGI', '8'))
+ASGI_PENDENTES_MAX = int(os.environ.get('ASGI_PENDENTES_MAX', '200'))
+ASGI_ESPERA_MAXIMA = float(os.environ.get('ASGI_ESPERA_MAXIMA', '10'))
+
+CAMPOS_CUBAGEM = ["Comprimento", "Largura", "Altura", "Cubagem", "Cx_Lastro"]
+
+
+class ExecutorLimitado:
+    """
+    ThreadPoolExecutor com limite de trabalhos pendentes: acima dele a requisição
+    espera no event loop (sem ocupar thread) e desiste após ASGI_ESPERA_MAXIMA.
+    """
+
+    def __init__(self, threads, pendentes_max, nome):
+        self.threads = threads
+        self.pendentes_max = pendentes_max
+        self.nome = nome
+        self._executor = None
+        self._vagas = None
+
+    def _iniciar(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix=self.nome)
+            self._vagas = asyncio.Semaphore(self.pendentes_max)
+
+    async def executar(self, funcao, *args, **kwargs):
+        self._iniciar()
+        try:
+            await asyncio.wait_for(self._vagas.acquire(), ASGI_ESPERA_MAXIMA)
+        except asyncio.TimeoutError:
+            raise ConnectionError("Servidor ocupado no momento. Tente novamente.")
+        try:
+            loop = asyncio.get_running_loop()
+            # run_in_executor não leva os contextvars: copia o contexto (ID de correlação) para a thread
+            contexto = contextvars.copy_context()
+            return await loop.run_in_executor(self._executor, contexto.run, functools.partial(funcao, *args, **kwargs))
+        finally:
+            self._vagas.release()
+
+    def encerrar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+executor_bpcs = ExecutorLimitado(ASGI_THREADS_BPCS, ASGI_PENDENTES_MAX, "bpcs")
+executor_wsgi = ExecutorLimitado(ASGI_THREADS_WSGI, ASGI_PENDENTES_MAX, "wsgi")
+impressao = None   # FilaImpressaoAsync, criada no startup (precisa do event loop)
+
+
+# ---------- Conversão ASGI <-> WSGI ----------
+def _montar_environ(scope, corpo):
+    servidor = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": servidor[0],
+        "SERVER_PORT": str(servidor[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(corpo)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(corpo),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+
+    for nome, valor in scope.get("headers", []):
+        nome = nome.decode("latin-1").upper().replace("-", "_")
+        valor = valor.decode("latin-1")
+        if nome == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = valor
+            continue
+        if nome == "CONTENT_LENGTH":
+            continue
+        chave = f"HTTP_{nome}"
+        environ[chave] = f"{environ[chave]},{valor}" if chave in environ else valor
+    return environ
+
+
+def _chamar_wsgi(environ):
+    # Respostas do Flask são pequenas (HTML/JSON/.mac): o corpo é montado inteiro
+    resposta = {}
+
+    def start_response(status, cabecalhos, exc_info=None):
+        resposta["status"] = int(status.split(" ", 1)[0])
+        resposta["cabecalhos"] = cabecalhos
+
+    iteravel = app(environ, start_response)
+    try:
+        corpo = b"".join(iteravel)
+    finally:
+        if hasattr(iteravel, "close"):
+            iteravel.close()
+    return resposta["status"], resposta["cabecalhos"], corpo
+
+
+async def _ler_corpo(receive):
+    partes = []
+    while True:
+        mensagem = await receive()
+        if mensagem["type"] == "http.disconnect":
+            break
+        partes.append(mensagem.get("body", b""))
+        if not mensagem.get("more_body"):
+            break
+    return b"".join(partes)
+
+
+async def _enviar(send, status, cabecalhos, corpo):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(nome.lower().encode("latin-1"), valor.encode("latin-1")) for nome, valor in cabecalhos],
+    })
+    await send({"type": "http.response.body", "body": corpo})
+
+
+def _json(dados, status=200):
+    return Response(json.dumps(dados, ensure_ascii=False), status=status, mimetype="application/json")
+
+
+# ---------- Sessão ----------
+async def _abrir_sessao(req):
+    return await executor_bpcs.executar(app.session_interface.open_session, app, req)
+
+
+async def _finalizar(req, sessao, resposta):
+    # Grava a sessão (SQLite) no executor e devolve a resposta pronta para envio
+    await executor_bpcs.executar(app.session_interface.save_session, app, sessao, resposta)
+    return resposta
+
+
+# ---------- Rotas nativas ----------
+async def _login(req):
+    sessao = await _abrir_sessao(req)
+    dados = req.get_json(silent=True) or {}
+    try:
+        usuario = await executor_bpcs.executar(autenticar_usuario, dados.get('id'))
+    except ChaveCredenciaisInvalida:
+        return await _finalizar(req, sessao, _json({'success': False, 'message': MENSAGEM_CHAVE_INVALIDA}, 500))
+    if not usuario:
+        return await _finalizar(req, sessao, _json({'success': False}, 401))
+
+    await executor_bpcs.executar(sessao.regenerar)
+    sessao['usuario_id'] = usuario['id']
+    sessao['upin'] = usuario['upin']
+    return await _finalizar(req, sessao, _json({'success': True}))
+
+
+async def _verificar_item_cubagem(req):
+    dados = req.get_json(silent=True) or {}
+    item = dados.get('item')
+    info = await executor_bpcs.executar(get_item_cubagem, item)
+
+    if not info:
+        novo_item = {campo: None for campo in CAMPOS_CUBAGEM}
+        novo_item["Item"] = item
+        await executor_bpcs.executar(salvar_ou_atualizar_item_cubagem, novo_item)
+        return _json({"necessitaPreenchimento": True, "dados": novo_item})
+
+    if any(info.get(campo) in (None, '', 0) for campo in CAMPOS_CUBAGEM):
+        return _json({"necessitaPreenchimento": True, "dados": info})
+    return _json({"necessitaPreenchimento": False, "dados": info})
+
+
+async def _fetch_locacao(req):
+    sessao = await _abrir_sessao(req)
+    corpo, codigo, cabecalhos = await executor_bpcs.executar(consultar_locacoes_livres, req.get_json(silent=True) or {},
+                                                              sessao.get('usuario_id'))
+    resposta = _json(corpo, codigo)
+    resposta.headers.update(cabecalhos)
+    return resposta
+
+
+async def _prefetch(req):
+    sessao = await _abrir_sessao(req)
+    if 'usuario_id' not in sessao:
+        return _json({"success": False, "mensagem": "Sessão expirada. Faça login novamente."}, 401)
+
+    try:
+        dados = req.get_json(silent=True) or {}
+        anterior = await executor_bpcs.executar(prefetch_da_sessao, sessao)
+        prefetch = await executor_bpcs.executar(prefetch_consulta, dados, sessao['usuario_id'],
+                                                anterior, locacao_planejada(sessao, dados))
+    except (ValueError, ConnectionError) as e:
+        return await _finalizar(req, sessao, _json({"success": False, "mensagem": str(e)}))
+
+    if prefetch is None:
+        return await _finalizar(req, sessao, _json({"success": False}))
+    sessao['prefetch'] = prefetch
+    return await _finalizar(req, sessao, _json({"success": True, "locacao": prefetch["locacao"],
+                                                "zona": prefetch["zona"],
+                                                "validado": prefetch["chave_bpcs"] is not None}))
+
+
+async def _consultar(req):
+    sessao = await _abrir_sessao(req)
+    error = None
+    success = None
+    job_impressao = None
+
+    avisos_impressao = []
+    if 'usuario_id' not in sessao:
+        error = "Sessão expirada. Faça login novamente."
+    else:
+        avisos_impressao, _ = await executor_bpcs.executar(conferir_impressoes, sessao)
+        planejada = locacao_planejada(sessao, req.form)
+        prefetch = await executor_bpcs.executar(prefetch_da_sessao, sessao)
+        try:
+            resultado = await executor_bpcs.executar(processar_consulta, req.form, sessao['usuario_id'],
+                                                     prefetch, planejada)
+        except ConnectionError as ce:
+            resultado = {"erro": str(ce)}
+
+        if "erro" in resultado:
+            error = resultado["erro"]
+        else:
+            impressora = req.form.get("Impressora")
+            logging.info(f"[DEBUG] Impressora selecionada: >>{impressora}<<")
+            fila_cheia = False
+            try:
+                job_impressao = impressao.enfileirar(
+                    [resultado["locacao"]], zona=resultado["zona"], movimentacao=resultado["mov"],
+                    upin=sessao.get("upin", ""), impressora=impressora,
+                    ao_falhar=desfazer_sem_etiqueta(req.form, resultado, sessao['usuario_id'], sessao.get("upin", ""),
+                                                    impressora))
+            except ValueError as e:
+                error = str(e)
+            except ConnectionError as ce:
+                error = str(ce)
+                fila_cheia = True
+                await executor_bpcs.executar(liberar_reserva_locacao, resultado["armazem"],
+                                             resultado["locacao"], sessao['usuario_id'])
+
+            if not fila_cheia:
+                await executor_bpcs.executar(sessao.anexar_buffer, 'macro_buffer', resultado["macro"])
+                await executor_bpcs.executar(sessao.anexar_buffer, 'locacoes_buffer',
+                                             f"{resultado['armazem']}\t{resultado['locacao']}")
+                consumir_planejada(sessao, planejada)
+                registrar_recebimento(req.form, resultado, sessao['usuario_id'], sessao.get("upin", ""),
+                                      impressora, job_impressao)
+                acompanhar_impressao(sessao, job_impressao, resultado)
+                success = "Consulta adicionada com sucesso."
+
+    macro_count = await executor_bpcs.executar(sessao.contar_buffer, 'macro_buffer')
+    with app.app_context():
+        html = app.jinja_env.get_template('index.html').render(
+            error=error, success=success, macro_count=macro_count,
+            job_impressao=job_impressao, falhas_impressao=avisos_impressao, session=sessao,
+        )
+    return await _finalizar(req, sessao, Response(html, mimetype="text/html"))
+
+
+ROTAS_NATIVAS = {
+    ("POST", "/login"): _login,
+    ("POST", "/fetch_locacao"): _fetch_locacao,
+    ("POST", "/verificar_item_cubagem"): _verificar_item_cubagem,
+    ("POST", "/prefetch_consulta"): _prefetch,
+}
+
+
+def _rota_nativa(req):
+    if req.method == "POST" and req.path == "/" and req.form.get("action") == "consultar":
+        return _consultar
+    return ROTAS_NATIVAS.get((req.method, req.path))
+
+
+# ---------- Aplicação ASGI ----------
+async def _lifespan(receive, send):
+    global impressao
+    while True:
+        mensagem = await receive()
+        if mensagem["type"] == "lifespan.startup":
+            impressao = FilaImpressaoAsync()
+            analise_ocupacao.iniciar()
+            logging.info("[ASGI] Servidor assíncrono iniciado.")
+            await send({"type": "lifespan.startup.complete"})
+        elif mensagem["type"] == "lifespan.shutdown":
+            if impressao is not None:
+                await impressao.fechar()
+            executor_bpcs.encerrar()
+            executor_wsgi.encerrar()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def aplicacao(scope, receive, send):
+    global impressao
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    corpo = await _ler_corpo(receive)
+    environ = _montar_environ(scope, corpo)
+    # Mesmo ID nas rotas nativas e nas delegadas ao Flask (before_request reaproveita o cabeçalho)
+    id_correlacao = definir_correlacao(environ.get("HTTP_X_REQUEST_ID"))
+    environ["HTTP_X_REQUEST_ID"] = id_correlacao
+    req = Request(environ)
+
+    handler = _rota_nativa(req)
+    if handler is None:
+        # Demais rotas: app Flask original
+        environ["wsgi.input"] = io.BytesIO(corpo)
+        try:
+            status, cabecalhos, resposta = await executor_wsgi.executar(_chamar_wsgi, environ)
+        except ConnectionError as ce:
+            status, cabecalhos, resposta = 503, [("Content-Type", "text/plain; charset=utf-8")], str(ce).encode()
+        return await _enviar(send, status, cabecalhos, resposta)
+
+    if impressao is None:
+        impressao = FilaImpressaoAsync()   # servidor sem suporte a lifespan
+    inicio = time.perf_counter()
+    try:
+        resposta = await handler(req)
+    except ConnectionError as ce:
+        resposta = _json({"success": False, "mensagem": str(ce)}, 503)
+    except Exception as e:
+        logging.error(f"Erro inesperado: {e}")
+        resposta = _json({"success": False, "mensagem": "Erro inesperado no servidor."}, 500)
+    registrar_requisicao(req.path, req.method, resposta.status_code, time.perf_counter() - inicio)
+    resposta.headers["X-Request-ID"] = id_correlacao
+    await _enviar(send, resposta.status_code, resposta.headers.to_wsgi_list(), resposta.get_data())
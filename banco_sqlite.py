@@ -0,0 +1,167 @@
+import os
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+# Ajustes das bases locais (usuarios.db, Itens.db)
+SQLITE_CACHE_KB = int(os.environ.get('SQLITE_CACHE_KB', '8192'))
+SQLITE_CACHE_STATEMENTS = int(os.environ.get('SQLITE_CACHE_STATEMENTS', '128'))
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', '5'))
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+
+
+class BancoSQLite:
+    """
+    Acesso a uma base SQLite local: cada thread reaproveita a própria conexão (WAL deixa
+    leituras e a escrita em paralelo, sem lock global), com os PRAGMAs aplicados uma vez
+    por conexão e o cache de statements do sqlite3 no lugar de recompilar o SQL.
+
+    migracoes: lista de (versao, funcao(conn)) aplicadas em ordem na primeira conexão
+    do processo, para as versões acima do PRAGMA user_version da base.
+    """
+
+    def __init__(self, caminho, migracoes=(), nome=None):
+        self.caminho = caminho
+        self.nome = nome or os.path.basename(caminho)
+        self.migracoes = sorted(migracoes, key=lambda m: m[0])
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid_migrado = None
+        self.stats = {"conexoes": 0, "migracoes": 0}
+
+    def _abrir(self):
+        conn = sqlite3.connect(self.caminho, timeout=SQLITE_BUSY_TIMEOUT,
+                               cached_statements=SQLITE_CACHE_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA foreign_keys=ON")
+        with self._lock:
+            self.stats["conexoes"] += 1
+        return conn
+
+    def conexao(self):
+        """Conexão da thread atual (recriada após fork)."""
+        local = self._local
+        if getattr(local, "conn", None) is None or local.pid != os.getpid():
+            local.conn = self._abrir()
+            local.pid = os.getpid()
+            local.data_version = None
+            local.versoes = {}
+            if self._pid_migrado != local.pid:
+                self._migrar(local.conn)
+        return local.conn
+
+    def _migrar(self, conn):
+        with self._lock:
+            if self._pid_migrado == os.getpid():
+                return
+            versao = conn.execute("PRAGMA user_version").fetchone()[0]
+            pendentes = [m for m in self.migracoes if m[0] > versao]
+            if pendentes:
+                # BEGIN IMMEDIATE: outro processo subindo junto espera e relê a versão
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    versao = conn.execute("PRAGMA user_version").fetchone()[0]
+                    for numero, migracao in pendentes:
+                        if numero <= versao:
+                            continue
+                        migracao(conn)
+                        conn.execute(f"PRAGMA user_version={int(numero)}")
+                        self.stats["migracoes"] += 1
+                        logging.info(f"[SQLITE] {self.nome}: migração {numero} aplicada.")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            self._pid_migrado = os.getpid()
+
+    def versao(self, tabela):
+        """
+        Contador de alterações da tabela (ver criar_contador_versao), o mesmo para todas as threads
+        e processos. Só é relido quando o PRAGMA data_version indica gravação de outra conexão.
+        """
+        conn = self.conexao()
+        local = self._local
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != local.data_version:
+            local.data_version = data_version
+            local.versoes = {}
+        if tabela not in local.versoes:
+            local.versoes[tabela] = conn.execute(f"SELECT versao FROM versao_{tabela}").fetchone()[0]
+        return local.versoes[tabela]
+
+    @contextmanager
+    def transacao(self):
+        """Commit ao sair do bloco, rollback em exceção; a conexão continua aberta para a thread."""
+        conn = self.conexao()
+        try:
+            with conn:
+                yield conn
+        finally:
+            # Gravação desta conexão não muda o data_version dela: as versões são relidas
+            self._local.versoes = {}
+
+    def consultar_um(self, sql, params=()):
+        return self.conexao().execute(sql, params).fetchone()
+
+    def consultar(self, sql, params=()):
+        return self.conexao().execute(sql, params).fetchall()
+
+    def fechar(self):
+        """Fecha a conexão da thread atual (ex.: ao encerrar uma thread de trabalho)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    def status(self):
+        with self._lock:
+            return {**self.stats, "versao_esquema": max((m[0] for m in self.migracoes), default=0)}
+
+
+def criar_contador_versao(conn, tabela):
+    """
+    Tabela versao_<tabela> com um contador que triggers incrementam a cada INSERT, UPDATE e
+    DELETE em tabela; lido por BancoSQLite.versao() para descartar caches de outros processos.
+    """
+    conn.execute(f"CREATE TABLE IF NOT EXISTS versao_{tabela} (versao INTEGER NOT NULL)")
+    if conn.execute(f"SELECT COUNT(*) FROM versao_{tabela}").fetchone()[0] == 0:
+        conn.execute(f"INSERT INTO versao_{tabela} (versao) VALUES (0)")
+    for operacao in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS versao_{tabela}_{operacao.lower()} AFTER {operacao} ON {tabela}
+            BEGIN UPDATE versao_{tabela} SET versao = versao + 1; END
+        """)
+
+
+def criar_indice(conn, tabela, coluna, nome, unico=False, deduplicar=False):
+    """
+    Índice em tabela.coluna, a menos que a coluna já seja a chave primária (o SQLite já a
+    indexa). Se o índice único esbarrar em duplicatas antigas, com deduplicar=True fica só a
+    linha mais recente (maior rowid) de cada valor; sem isso a migração falha com o erro.
+    """
+    colunas = conn.execute(f"PRAGMA table_info({tabela})").fetchall()
+    chave = [c["name"] for c in colunas if c["pk"]]
+    if chave == [coluna]:
+        return
+    if not unico:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({coluna})")
+        return
+    try:
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {nome} ON {tabela} ({coluna})")
+        return
+    except sqlite3.IntegrityError:
+        if not deduplicar:
+            raise sqlite3.IntegrityError(
+                f"{tabela}.{coluna} tem valores repetidos; corrija a base antes de subir o servidor.")
+    removidas = conn.execute(
+        f"DELETE FROM {tabela} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {tabela} GROUP BY {coluna})"
+    ).rowcount
+    logging.warning(f"[SQLITE] {tabela}.{coluna}: {removidas} linha(s) repetida(s) removida(s), "
+                    f"mantida a mais recente de cada valor.")
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {nome} ON {tabela} ({coluna})")
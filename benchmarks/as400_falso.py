@@ -0,0 +1,236 @@
+"""
+AS400 de mentira para os benchmarks: as bibliotecas V60BPCSF (ILE, ITH) e V60ARQ3M
+(IULM, IW1) viram dois arquivos SQLite com dados sintéticos em volume realista, e um
+módulo no lugar do pyodbc abre esses arquivos com latência configurável por conexão
+e por consulta (simulando a rede até o US400BR).
+
+Uso só fora de produção: instalar_pyodbc_falso() precisa ser chamado antes de importar o app.
+"""
+import os
+import re
+import sys
+import time
+import types
+import random
+import sqlite3
+
+
+# Zonas do armazém: (zona, fração das locações, alturas possíveis em metros)
+PERFIL_ZONAS = (
+    ("PEQ", 0.35, (1.0, 1.1, 1.2)),
+    ("MED", 0.25, (1.35, 1.4, 1.5)),
+    ("GRA", 0.20, (2.0, 2.1, 2.2)),
+    ("RUA", 0.20, (3.0,)),
+)
+
+
+# ---------- Bases sintéticas ----------
+def _criar_bpcsf(caminho, armazens, locacoes, recebimentos, rnd):
+    conn = sqlite3.connect(caminho)
+    conn.execute("CREATE TABLE ILE (LEWHS TEXT, LEID TEXT, LELOCT TEXT, LELCDE TEXT, LEHGHT NUMERIC, LELOC TEXT, LEZONE TEXT)")
+    conn.execute("CREATE TABLE ITH (TREF TEXT, TTDTE NUMERIC, TCLAS TEXT)")
+    linhas = []
+    for armazem in armazens:
+        for zona, fracao, alturas in PERFIL_ZONAS:
+            for i in range(int(locacoes * fracao)):
+                linhas.append((armazem, "LE", "0", "E", rnd.choice(alturas), f"{zona}{i:05d}", zona))
+    # Um pouco de ruído: locações inativas/bloqueadas que a consulta precisa filtrar
+    for armazem in armazens:
+        for i in range(max(1, locacoes // 50)):
+            linhas.append((armazem, "LE", "1", "B", 1.2, f"BLQ{i:05d}", "PEQ"))
+    conn.executemany("INSERT INTO ILE VALUES (?, ?, ?, ?, ?, ?, ?)", linhas)
+    conn.executemany("INSERT INTO ITH VALUES (?, ?, ?)",
+                     [(r["mov"], r["data"], rnd.choice(("1A", "2B", "7C"))) for r in recebimentos])
+    conn.execute("CREATE INDEX idx_ile_armazem_zona ON ILE (LEWHS, LEZONE, LEHGHT)")
+    conn.execute("CREATE INDEX idx_ith_ref ON ITH (TREF, TTDTE)")
+    conn.commit()
+    conn.close()
+    return len(linhas)
+
+
+def _criar_arq3m(caminho, armazens, locacoes, ocupacao, recebimentos, rnd):
+    conn = sqlite3.connect(caminho)
+    conn.execute("CREATE TABLE IULM (ULWHSE TEXT, ULLOCA TEXT)")
+    conn.execute("CREATE TABLE IW1 (W1TWHS TEXT, W1PROD TEXT, W1LOT TEXT, W1PQTY NUMERIC, W1MOVN TEXT, W1DATE NUMERIC)")
+    ocupadas = []
+    for armazem in armazens:
+        for zona, fracao, _ in PERFIL_ZONAS:
+            total = int(locacoes * fracao)
+            for i in rnd.sample(range(total), int(total * ocupacao)):
+                ocupadas.append((armazem, f"{zona}{i:05d}"))
+    conn.executemany("INSERT INTO IULM VALUES (?, ?)", ocupadas)
+    conn.executemany("INSERT INTO IW1 VALUES (?, ?, ?, ?, ?, ?)",
+                     [(r["armazem"], r["item"], r["lote"], r["quantidade"], r["mov"], r["data"]) for r in recebimentos])
+    conn.execute("CREATE INDEX idx_iulm ON IULM (ULWHSE, ULLOCA)")
+    conn.execute("CREATE INDEX idx_iw1 ON IW1 (W1PROD, W1MOVN)")
+    conn.commit()
+    conn.close()
+    return len(ocupadas)
+
+
+def _criar_itens(caminho, itens):
+    conn = sqlite3.connect(caminho)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Itens_cubagem (
+            Item TEXT PRIMARY KEY, Comprimento REAL, Largura REAL, Altura REAL, Cubagem REAL, Cx_Lastro REAL
+        )
+    """)
+    conn.executemany("INSERT OR REPLACE INTO Itens_cubagem VALUES (?, ?, ?, ?, ?, ?)", [
+        (i["item"], i["comprimento"], i["largura"], i["altura"],
+         round(i["comprimento"] * i["largura"] * i["altura"], 4), i["cx_lastro"])
+        for i in itens
+    ])
+    conn.commit()
+    conn.close()
+
+
+def _criar_usuarios(caminho, usuarios):
+    conn = sqlite3.connect(caminho)
+    conn.execute("CREATE TABLE IF NOT EXISTS usuarios (id TEXT PRIMARY KEY, upin TEXT, senha TEXT, nome TEXT)")
+    conn.executemany("INSERT OR REPLACE INTO usuarios VALUES (?, ?, ?, ?)",
+                     [(u, f"UP{u[-3:]}", "bench", f"Operador {u}") for u in usuarios])
+    conn.commit()
+    conn.close()
+
+
+def gerar_bases(diretorio, armazens=("01",), locacoes=20000, ocupacao=0.6, recebimentos=2000,
+                itens=300, usuarios=8, semente=42):
+    """
+    Cria em `diretorio` bpcsf.db, arq3m.db, Itens.db e usuarios.db.
+    Retorna {"recebimentos": [...], "usuarios": [...], "resumo": {...}} para montar a carga.
+    """
+    rnd = random.Random(semente)
+    os.makedirs(diretorio, exist_ok=True)
+    for nome in ("bpcsf.db", "arq3m.db", "Itens.db", "usuarios.db"):
+        caminho = os.path.join(diretorio, nome)
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+    lista_itens = [{
+        "item": f"IT{n:05d}",
+        "comprimento": round(rnd.uniform(0.2, 0.6), 2),
+        "largura": round(rnd.uniform(0.2, 0.4), 2),
+        "altura": round(rnd.uniform(0.1, 0.35), 2),
+        "cx_lastro": rnd.randint(4, 20),
+    } for n in range(itens)]
+
+    lista_recebimentos = []
+    for n in range(recebimentos):
+        item = rnd.choice(lista_itens)
+        volume = rnd.randint(1, 6) * item["cx_lastro"] - rnd.randint(0, item["cx_lastro"] - 1)
+        qud = rnd.choice((1, 2, 6, 12))
+        lista_recebimentos.append({
+            "armazem": rnd.choice(armazens),
+            "item": item["item"],
+            "lote": f"2{n:05d}",
+            "mov": f"{100000 + n:06d}",
+            "data": 20250101 + n % 28,
+            "volume": volume,
+            "qud": qud,
+            "quantidade": float(volume * qud),
+        })
+    lista_usuarios = [f"bench{n:03d}" for n in range(usuarios)]
+
+    linhas_ile = _criar_bpcsf(os.path.join(diretorio, "bpcsf.db"), armazens, locacoes, lista_recebimentos, rnd)
+    linhas_iulm = _criar_arq3m(os.path.join(diretorio, "arq3m.db"), armazens, locacoes, ocupacao, lista_recebimentos, rnd)
+    _criar_itens(os.path.join(diretorio, "Itens.db"), lista_itens)
+    _criar_usuarios(os.path.join(diretorio, "usuarios.db"), lista_usuarios)
+
+    return {
+        "recebimentos": lista_recebimentos,
+        "usuarios": lista_usuarios,
+        "resumo": {"ILE": linhas_ile, "IULM": linhas_iulm, "IW1": recebimentos, "ITH": recebimentos,
+                   "itens": itens, "armazens": list(armazens)},
+    }
+
+
+# ---------- pyodbc falso ----------
+_OFFSET_FETCH = re.compile(r"OFFSET\s+(\d+)\s+ROWS\s+FETCH\s+FIRST\s+(\d+)\s+ROWS\s+ONLY", re.IGNORECASE)
+_FETCH_FIRST = re.compile(r"FETCH\s+FIRST\s+(\d+)\s+ROWS\s+ONLY", re.IGNORECASE)
+
+
+def traduzir_sql(query):
+    """Converte os trechos de SQL do DB2 for i usados pelo sistema para o dialeto do SQLite."""
+    query = _OFFSET_FETCH.sub(lambda m: f"LIMIT {m.group(2)} OFFSET {m.group(1)}", query)
+    query = _FETCH_FIRST.sub(r"LIMIT \1", query)
+    return query.replace("SYSIBM.SYSDUMMY1", "(SELECT 1)")
+
+
+class _Error(Exception):
+    pass
+
+
+class _Cursor:
+    def __init__(self, conexao):
+        self._conexao = conexao
+        self._cursor = conexao._sqlite.cursor()
+
+    def execute(self, query, params=()):
+        if self._conexao._fechada:
+            raise _Error("08003", "[08003] Conexão fechada")
+        if self._conexao._latencia_consulta:
+            time.sleep(self._conexao._latencia_consulta)
+        self._cursor.execute(traduzir_sql(query), list(params))
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class _Conexao:
+    def __init__(self, bpcsf, arq3m, latencia_consulta):
+        # Conexão em modo URI para o ATTACH aceitar "?mode=ro" (somente leitura, como no AS400)
+        self._sqlite = sqlite3.connect("file::memory:", uri=True, check_same_thread=False)
+        self._sqlite.execute("ATTACH DATABASE ? AS V60BPCSF", (f"file:{bpcsf}?mode=ro",))
+        self._sqlite.execute("ATTACH DATABASE ? AS V60ARQ3M", (f"file:{arq3m}?mode=ro",))
+        self._latencia_consulta = latencia_consulta
+        self._fechada = False
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self._fechada = True
+        self._sqlite.close()
+
+
+def criar_pyodbc_falso(diretorio, latencia_conexao=0.0, latencia_consulta=0.0):
+    """Módulo com a parte da API do pyodbc usada pelo sistema (connect, Error), lendo as bases de `diretorio`."""
+    bpcsf = os.path.join(diretorio, "bpcsf.db")
+    arq3m = os.path.join(diretorio, "arq3m.db")
+    modulo = types.ModuleType("pyodbc")
+    modulo.Error = _Error
+    modulo.estatisticas = {"conexoes": 0}
+
+    def connect(texto_conexao, *args, **kwargs):
+        if latencia_conexao:
+            time.sleep(latencia_conexao)
+        modulo.estatisticas["conexoes"] += 1
+        return _Conexao(bpcsf, arq3m, latencia_consulta)
+
+    modulo.connect = connect
+    return modulo
+
+
+def instalar_pyodbc_falso(diretorio, latencia_conexao=0.0, latencia_consulta=0.0):
+    if "pool_odbc" in sys.modules:
+        raise RuntimeError("instalar_pyodbc_falso() precisa ser chamado antes de importar o app.")
+    modulo = criar_pyodbc_falso(diretorio, latencia_conexao, latencia_consulta)
+    sys.modules["pyodbc"] = modulo
+    return modulo
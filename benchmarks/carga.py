@@ -0,0 +1,259 @@
+"""
+Benchmark de carga do recebimento sem AS400 e sem Zebra: gera as bases sintéticas,
+troca o pyodbc pelo AS400 falso, sobe uma impressora falsa e dispara o fluxo real do
+Flask (consultar no index(), /fetch_locacao e buscar_locacao_com_fallback) com a
+concorrência pedida. Mostra p50/p90/p99, máximo e vazão de cada cenário.
+
+    python benchmarks/carga.py --concorrencia 8 --requisicoes 500 --latencia-consulta-ms 15
+
+Tudo é criado num diretório temporário (ou em --diretorio); nenhuma base do sistema é tocada.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import argparse
+import tempfile
+import threading
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from as400_falso import gerar_bases, instalar_pyodbc_falso
+from impressora_falsa import ImpressoraFalsa
+
+CENARIOS = ("consultar", "fetch_locacao", "fallback")
+IMPRESSORA_BENCH = "BENCH"
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description="Benchmark offline do fluxo de recebimento.")
+    parser.add_argument("--cenarios", default=",".join(CENARIOS),
+                        help=f"lista separada por vírgula entre {', '.join(CENARIOS)}")
+    parser.add_argument("--concorrencia", type=int, default=8, help="terminais simultâneos (threads)")
+    parser.add_argument("--requisicoes", type=int, default=500, help="requisições medidas por cenário")
+    parser.add_argument("--aquecimento", type=int, default=20, help="requisições descartadas no início de cada cenário")
+    parser.add_argument("--armazens", default="01")
+    parser.add_argument("--locacoes", type=int, default=20000, help="locações por armazém na ILE")
+    parser.add_argument("--ocupacao", type=float, default=0.6, help="fração das locações ocupadas na IULM")
+    parser.add_argument("--recebimentos", type=int, default=2000, help="linhas da IW1/ITH")
+    parser.add_argument("--itens", type=int, default=300, help="itens com cubagem")
+    parser.add_argument("--latencia-conexao-ms", type=float, default=50.0, help="abertura de conexão ODBC")
+    parser.add_argument("--latencia-consulta-ms", type=float, default=15.0, help="ida e volta de cada consulta ODBC")
+    parser.add_argument("--latencia-etiqueta-ms", type=float, default=0.0, help="tempo de impressão por etiqueta")
+    parser.add_argument("--indice", action="store_true", help="ativa o índice de locações (usuário de serviço)")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--diretorio", help="onde criar as bases (padrão: diretório temporário)")
+    parser.add_argument("--json", dest="saida_json", help="grava o resultado em JSON para comparar execuções")
+    parser.add_argument("--verboso", action="store_true", help="mantém os logs INFO do sistema no console")
+    return parser.parse_args()
+
+
+def _preparar_ambiente(args, diretorio):
+    # Tudo que o app lê do ambiente na importação precisa estar definido antes do import
+    os.environ.update({
+        "SQLITE_PATH": os.path.join(diretorio, "usuarios.db"),
+        "ITENS_DB_PATH": os.path.join(diretorio, "Itens.db"),
+        "RESERVAS_DB_PATH": os.path.join(diretorio, "reservas.db"),
+        "SESSAO_DB_PATH": os.path.join(diretorio, "sessoes.db"),
+        "DIARIO_DB_PATH": os.path.join(diretorio, "diario_recebimento.db"),
+        "OCUPACAO_DIR": os.path.join(diretorio, "ocupacao"),
+        "CUBAGEM_RELATORIO_DIR": os.path.join(diretorio, "relatorios"),
+        "CREDENCIAIS_CHAVE_PATH": os.path.join(os.path.abspath(diretorio), "credenciais.key"),
+        "CREDENCIAIS_CRIAR_CHAVE": "1",
+        "MACRO_PATH": os.path.join(diretorio, "macros"),
+        "LOG_PATH": os.path.join(diretorio, "logs", "benchmark.log"),
+        "LOG_NIVEL": "INFO" if args.verboso else "WARNING",
+        "TELEMETRIA_LOG_SPANS": "1" if args.verboso else "0",
+    })
+    # Mede o caminho da consulta, não o limitador por usuário (pode ser sobrescrito no ambiente)
+    os.environ.setdefault("FETCH_LOCACAO_TAXA", "1000000")
+    os.environ.setdefault("FETCH_LOCACAO_RAJADA", "1000000")
+    if args.indice:
+        os.environ.update({"BPCS_SERVICO_UID": "BENCH", "BPCS_SERVICO_PWD": "bench",
+                           "INDICE_ARMAZENS": args.armazens})
+    os.makedirs(os.environ["MACRO_PATH"], exist_ok=True)
+
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+def _executar(nome, concorrencia, total, aquecimento, preparar_terminal, chamada):
+    """
+    Roda `total + aquecimento` chamadas divididas entre `concorrencia` threads.
+    preparar_terminal(indice) devolve o estado do terminal; chamada(terminal, n) -> bool (sucesso).
+    """
+    tarefas = queue.SimpleQueue()
+    for n in range(total + aquecimento):
+        tarefas.put(n)
+    latencias, falhas, erros = [], [0], []
+    lock = threading.Lock()
+    pronto = threading.Barrier(concorrencia + 1)
+
+    def terminal(indice):
+        estado = preparar_terminal(indice)
+        pronto.wait()
+        while True:
+            try:
+                n = tarefas.get_nowait()
+            except queue.Empty:
+                return
+            inicio = time.perf_counter()
+            try:
+                ok = chamada(estado, n)
+            except Exception as e:
+                ok = False
+                with lock:
+                    erros.append(repr(e))
+            duracao = time.perf_counter() - inicio
+            if n < aquecimento:
+                continue
+            with lock:
+                latencias.append(duracao)
+                if not ok:
+                    falhas[0] += 1
+
+    threads = [threading.Thread(target=terminal, args=(i,), name=f"terminal-{i}") for i in range(concorrencia)]
+    for t in threads:
+        t.start()
+    pronto.wait()
+    inicio = time.perf_counter()
+    for t in threads:
+        t.join()
+    duracao_total = time.perf_counter() - inicio
+
+    ordenados = sorted(latencias)
+    return {
+        "cenario": nome,
+        "requisicoes": len(ordenados),
+        "falhas": falhas[0],
+        "excecoes": erros[:5],
+        "duracao_s": round(duracao_total, 3),
+        "vazao_rps": round(len(ordenados) / duracao_total, 1) if duracao_total else 0.0,
+        "p50_ms": round(_percentil(ordenados, 50) * 1000, 1),
+        "p90_ms": round(_percentil(ordenados, 90) * 1000, 1),
+        "p99_ms": round(_percentil(ordenados, 99) * 1000, 1),
+        "max_ms": round(ordenados[-1] * 1000, 1) if ordenados else 0.0,
+    }
+
+
+def main():
+    args = _argumentos()
+    cenarios = [c.strip() for c in args.cenarios.split(",") if c.strip()]
+    invalidos = [c for c in cenarios if c not in CENARIOS]
+    if invalidos:
+        sys.exit(f"Cenários desconhecidos: {', '.join(invalidos)}")
+
+    diretorio = args.diretorio or tempfile.mkdtemp(prefix="bench_recebimento_")
+    armazens = tuple(a.strip() for a in args.armazens.split(",") if a.strip())
+    print(f"[BENCH] Gerando bases em {diretorio} ...")
+    bases = gerar_bases(diretorio, armazens=armazens, locacoes=args.locacoes, ocupacao=args.ocupacao,
+                        recebimentos=args.recebimentos, itens=args.itens,
+                        usuarios=args.concorrencia, semente=args.semente)
+    print(f"[BENCH] Bases: {bases['resumo']}")
+
+    _preparar_ambiente(args, diretorio)
+    odbc = instalar_pyodbc_falso(diretorio, args.latencia_conexao_ms / 1000, args.latencia_consulta_ms / 1000)
+    impressora = ImpressoraFalsa(latencia_etiqueta=args.latencia_etiqueta_ms / 1000).iniciar()
+
+    import etiquetaszpl
+    host, porta = impressora.endereco
+    etiquetaszpl.IMPRESSORAS[IMPRESSORA_BENCH] = dict(etiquetaszpl.IMPRESSORAS["BRTEMAN01"], ip=host, porta=porta)
+
+    import app as sistema
+    from reservas import reservas
+
+    recebimentos = bases["recebimentos"]
+    usuarios = bases["usuarios"]
+    rnd = random.Random(args.semente)
+    sorteio = [rnd.randrange(len(recebimentos)) for _ in range(args.requisicoes + args.aquecimento)]
+    rnd_alturas = [rnd.uniform(0.5, 1.2) for _ in range(args.requisicoes + args.aquecimento)]
+
+    def terminal_flask(indice):
+        cliente = sistema.app.test_client()
+        with cliente.session_transaction() as sessao:
+            sessao["usuario_id"] = usuarios[indice]
+            sessao["upin"] = f"UP{usuarios[indice][-3:]}"
+        return cliente
+
+    def consultar(cliente, n):
+        r = recebimentos[sorteio[n]]
+        resposta = cliente.post("/", data={
+            "action": "consultar", "item": r["item"], "lote": r["lote"], "Mov": f"W{r['mov']}",
+            "Armazem": r["armazem"], "Volume": str(r["volume"]), "QUD": str(r["qud"]),
+            "Impressora": IMPRESSORA_BENCH,
+        })
+        return resposta.status_code == 200 and "Consulta adicionada com sucesso".encode() in resposta.data
+
+    def fetch_locacao(cliente, n):
+        r = recebimentos[sorteio[n]]
+        resposta = cliente.post("/fetch_locacao", json={
+            "zona": ("PEQ", "MED", "GRA", "RUA")[n % 4], "armazem": r["armazem"],
+            "altura_min": round(rnd_alturas[n], 2), "limite": 10,
+        })
+        return resposta.status_code == 200 and bool((resposta.get_json() or {}).get("success"))
+
+    def fallback(usuario_id, n):
+        r = recebimentos[sorteio[n]]
+        endereco, _ = sistema.buscar_locacao_com_fallback(r["armazem"], r["item"], r["volume"], usuario_id=usuario_id)
+        return bool(endereco)
+
+    execucoes = {
+        "consultar": (terminal_flask, consultar),
+        "fetch_locacao": (terminal_flask, fetch_locacao),
+        "fallback": (lambda indice: usuarios[indice], fallback),
+    }
+
+    resultados = []
+    for cenario in cenarios:
+        antes = impressora.estatisticas()["etiquetas"]
+        preparar, chamada = execucoes[cenario]
+        resultado = _executar(cenario, args.concorrencia, args.requisicoes, args.aquecimento, preparar, chamada)
+        if cenario == "consultar":
+            # O envio é assíncrono: espera a fila de impressão esvaziar antes de contar
+            limite = time.time() + 30
+            while time.time() < limite and not all(
+                    not s.get("na_fila") for s in sistema.fila_impressao.status().values()):
+                time.sleep(0.05)
+            resultado["etiquetas_impressas"] = impressora.estatisticas()["etiquetas"] - antes
+        resultados.append(resultado)
+        # Cada cenário começa com o armazém livre: desfaz as reservas feitas pelo anterior
+        for armazem in armazens:
+            for locacao in reservas.reservadas(armazem):
+                sistema.liberar_reserva_locacao(armazem, locacao, None)
+
+    resumo = {
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("saida_json", "verboso")},
+        "bases": bases["resumo"],
+        "conexoes_odbc": odbc.estatisticas["conexoes"],
+        "pool_odbc": sistema.odbc_pool_stats(),
+        "resultados": resultados,
+    }
+    impressora.parar()
+
+    print()
+    print(f"{'cenário':<15}{'req':>7}{'falhas':>8}{'req/s':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'máx ms':>9}")
+    for r in resultados:
+        print(f"{r['cenario']:<15}{r['requisicoes']:>7}{r['falhas']:>8}{r['vazao_rps']:>9}"
+              f"{r['p50_ms']:>9}{r['p90_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}")
+        for erro in r["excecoes"]:
+            print(f"   exceção: {erro}")
+        if "etiquetas_impressas" in r:
+            print(f"   etiquetas recebidas pela impressora falsa: {r['etiquetas_impressas']}")
+    print(f"\nConexões ODBC abertas: {resumo['conexoes_odbc']}")
+
+    if args.saida_json:
+        with open(args.saida_json, "w", encoding="utf-8") as f:
+            json.dump(resumo, f, ensure_ascii=False, indent=2)
+        print(f"Resultado gravado em {args.saida_json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Impressora Zebra de mentira (porta 9100 em TCP) para os benchmarks: aceita conexões
+persistentes, conta as etiquetas (^XZ) e os bytes recebidos e pode simular o tempo de
+impressão por etiqueta.
+"""
+import socket
+import threading
+import socketserver
+
+
+class _Conexao(socketserver.BaseRequestHandler):
+    def handle(self):
+        servidor = self.server
+        with servidor.lock:
+            servidor.conexoes += 1
+        resto = b""
+        while True:
+            try:
+                dados = self.request.recv(65536)
+            except OSError:
+                return
+            if not dados:
+                return
+            dados = resto + dados
+            etiquetas = dados.count(b"^XZ")
+            resto = dados[-2:] if not dados.endswith(b"^XZ") else b""   # ^XZ partido entre dois recv
+            with servidor.lock:
+                servidor.bytes += len(dados) - len(resto)
+                servidor.etiquetas += etiquetas
+            if etiquetas and servidor.latencia_etiqueta:
+                threading.Event().wait(etiquetas * servidor.latencia_etiqueta)
+
+
+class _Servidor(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ImpressoraFalsa:
+    def __init__(self, host="127.0.0.1", porta=0, latencia_etiqueta=0.0):
+        self._servidor = _Servidor((host, porta), _Conexao)
+        self._servidor.lock = threading.Lock()
+        self._servidor.conexoes = 0
+        self._servidor.bytes = 0
+        self._servidor.etiquetas = 0
+        self._servidor.latencia_etiqueta = latencia_etiqueta
+        self._thread = None
+
+    @property
+    def endereco(self):
+        return self._servidor.server_address
+
+    def estatisticas(self):
+        with self._servidor.lock:
+            return {"conexoes": self._servidor.conexoes, "etiquetas": self._servidor.etiquetas,
+                    "bytes": self._servidor.bytes}
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._servidor.serve_forever, name="impressora-falsa", daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Impressora Zebra falsa (porta 9100).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=9100)
+    parser.add_argument("--latencia-etiqueta-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    impressora = ImpressoraFalsa(args.host, args.porta, args.latencia_etiqueta_ms / 1000).iniciar()
+    print(f"Impressora falsa ouvindo em {impressora.endereco[0]}:{impressora.endereco[1]} (Ctrl+C para sair)")
+    try:
+        while True:
+            time.sleep(5)
+            print(impressora.estatisticas())
+    except KeyboardInterrupt:
+        impressora.parar()
@@ -0,0 +1,89 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """
+    Cache em memória com limite de itens (LRU) e validade por entrada (TTL).
+    Seguro para uso entre threads e com contadores de acerto/erro.
+
+    Leitura que preenche o cache a partir da origem: pegue marca() antes de ler e passe-a
+    ao set(); se alguma escrita (set sem marca, invalidate, clear) aconteceu no meio, o
+    valor lido pode estar velho e não é guardado.
+    """
+
+    _AUSENTE = object()
+
+    def __init__(self, max_itens=1024, ttl=600):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._dados = OrderedDict()  # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirados = 0
+        self.removidos = 0
+        self.descartados = 0
+        self._escritas = 0
+
+    def get(self, chave, padrao=None):
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._dados.get(chave, self._AUSENTE)
+            if entrada is self._AUSENTE:
+                self.misses += 1
+                return padrao
+            expira_em, valor = entrada
+            if expira_em < agora:
+                del self._dados[chave]
+                self.expirados += 1
+                self.misses += 1
+                return padrao
+            self._dados.move_to_end(chave)
+            self.hits += 1
+            return valor
+
+    def marca(self):
+        with self._lock:
+            return self._escritas
+
+    def set(self, chave, valor, ttl=None, marca=None):
+        expira_em = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if marca is None:
+                self._escritas += 1
+            elif marca != self._escritas:
+                self.descartados += 1
+                return False
+            self._dados[chave] = (expira_em, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+                self.removidos += 1
+            return True
+
+    def invalidate(self, chave):
+        with self._lock:
+            self._escritas += 1
+            self._dados.pop(chave, None)
+
+    def clear(self):
+        with self._lock:
+            self._escritas += 1
+            self._dados.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "itens": len(self._dados),
+                "max_itens": self.max_itens,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirados": self.expirados,
+                "removidos": self.removidos,
+                "descartados": self.descartados,
+                "taxa_acerto": round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,162 @@
+import os
+import time
+import logging
+import threading
+
+from cryptography.fernet import Fernet, InvalidToken
+
+
+# Chave Fernet (base64) das senhas do BPCS em usuarios.db: CREDENCIAIS_CHAVE ou o arquivo em
+# CREDENCIAIS_CHAVE_PATH (caminho absoluto, fora da pasta do usuarios.db). A chave só é criada
+# automaticamente com CREDENCIAIS_CRIAR_CHAVE=1 (desenvolvimento); guarde uma cópia: sem ela as
+# senhas não são recuperáveis.
+CREDENCIAIS_CHAVE = os.environ.get('CREDENCIAIS_CHAVE')
+CREDENCIAIS_CHAVE_PATH = os.environ.get('CREDENCIAIS_CHAVE_PATH', '')
+CREDENCIAIS_CRIAR_CHAVE = os.environ.get('CREDENCIAIS_CRIAR_CHAVE', '0') == '1'
+CREDENCIAIS_TTL = float(os.environ.get('CREDENCIAIS_TTL', '900'))
+
+PREFIXO_CIFRADO = "fernet:"
+
+_fernet = None
+_fernet_lock = threading.Lock()
+
+
+class ChaveCredenciaisInvalida(RuntimeError):
+    """Chave de cifragem ausente, mal configurada ou diferente da que cifrou as senhas."""
+
+
+def _ler_ou_criar_chave():
+    if CREDENCIAIS_CHAVE:
+        return CREDENCIAIS_CHAVE.encode()
+    if not CREDENCIAIS_CHAVE_PATH:
+        raise ChaveCredenciaisInvalida(
+            "Defina CREDENCIAIS_CHAVE ou CREDENCIAIS_CHAVE_PATH (caminho absoluto) com a chave das senhas do BPCS.")
+    if not os.path.isabs(CREDENCIAIS_CHAVE_PATH) and not CREDENCIAIS_CRIAR_CHAVE:
+        # Caminho relativo muda com o diretório de trabalho: outra pasta leria (ou criaria) outra chave
+        raise ChaveCredenciaisInvalida(
+            f"CREDENCIAIS_CHAVE_PATH precisa ser um caminho absoluto (recebido: {CREDENCIAIS_CHAVE_PATH!r}).")
+    caminho = os.path.abspath(CREDENCIAIS_CHAVE_PATH)
+    try:
+        with open(caminho, 'rb') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        if not CREDENCIAIS_CRIAR_CHAVE:
+            raise ChaveCredenciaisInvalida(
+                f"Arquivo de chave {caminho} não encontrado. Restaure a chave usada para cifrar as senhas "
+                "(ou use CREDENCIAIS_CRIAR_CHAVE=1 só em desenvolvimento).")
+    chave = Fernet.generate_key()
+    # O_EXCL: se dois processos sobem juntos, só um cria a chave e o outro lê a mesma
+    try:
+        fd = os.open(caminho, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(caminho, 'rb') as f:
+            return f.read().strip()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(chave)
+    logging.warning(f"[CREDENCIAIS] Nova chave de cifragem criada em {caminho} (CREDENCIAIS_CRIAR_CHAVE=1).")
+    return chave
+
+
+def _cifrador():
+    global _fernet
+    if _fernet is None:
+        with _fernet_lock:
+            if _fernet is None:
+                try:
+                    _fernet = Fernet(_ler_ou_criar_chave())
+                except ValueError:
+                    raise ChaveCredenciaisInvalida("A chave das senhas do BPCS não é uma chave Fernet válida.")
+    return _fernet
+
+
+def exigir_chave():
+    """Chamada na subida do servidor: falha logo se a chave não estiver configurada."""
+    _cifrador()
+
+
+def senha_cifrada(valor):
+    return isinstance(valor, str) and valor.startswith(PREFIXO_CIFRADO)
+
+
+def cifrar_senha(senha):
+    return PREFIXO_CIFRADO + _cifrador().encrypt(str(senha).encode('utf-8')).decode('ascii')
+
+
+def decifrar_senha(valor):
+    """Senha em texto a partir do valor gravado; linhas antigas (ainda em texto puro) voltam como estão."""
+    if not senha_cifrada(valor):
+        return valor
+    try:
+        return _cifrador().decrypt(valor[len(PREFIXO_CIFRADO):].encode('ascii')).decode('utf-8')
+    except InvalidToken:
+        logging.error("[CREDENCIAIS] A chave configurada não corresponde à que cifrou as senhas do usuarios.db "
+                      "(verifique CREDENCIAIS_CHAVE / CREDENCIAIS_CHAVE_PATH).")
+        raise ChaveCredenciaisInvalida("Senha do BPCS cifrada com outra chave.")
+
+
+class CofreCredenciais:
+    """
+    Credenciais do BPCS já decifradas, só na memória do processo e por tempo limitado.
+    As consultas ao AS400 leem daqui em vez de abrir o usuarios.db a cada chamada.
+    carregar(usuario_id) -> dict com id, upin, nome e senha (em texto) ou None.
+    versao() -> versão atual da origem (opcional): quando muda (ex.: senha trocada em outro
+    worker), o cofre inteiro é descartado antes da leitura.
+    """
+
+    def __init__(self, carregar, ttl=CREDENCIAIS_TTL, versao=None):
+        self._carregar = carregar
+        self._versao = versao
+        self._versao_atual = None
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entradas = {}   # usuario_id -> (credencial, expira_em)
+        self.stats = {"hits": 0, "misses": 0, "expiradas": 0, "descartes": 0}
+
+    def obter(self, usuario_id):
+        if not usuario_id:
+            return None
+        chave = str(usuario_id)
+        agora = time.monotonic()
+        versao = None
+        if self._versao is not None:
+            try:
+                versao = self._versao()
+            except Exception as e:
+                # Sem como conferir a versão: lê direto do banco em vez de arriscar senha velha
+                logging.warning(f"[CREDENCIAIS] Versão do usuarios.db indisponível: {e}")
+                with self._lock:
+                    self._entradas.clear()
+                    self._versao_atual = None
+                return self._carregar(chave)
+        with self._lock:
+            if versao != self._versao_atual:
+                if self._entradas:
+                    self._entradas.clear()
+                    self.stats["descartes"] += 1
+                self._versao_atual = versao
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                if entrada[1] > agora:
+                    self.stats["hits"] += 1
+                    return entrada[0]
+                del self._entradas[chave]
+                self.stats["expiradas"] += 1
+            self.stats["misses"] += 1
+
+        credencial = self._carregar(chave)
+        if credencial is not None:
+            with self._lock:
+                # Se o cofre foi descartado durante a leitura, a linha lida pode já estar velha
+                if self._versao_atual == versao:
+                    self._entradas[chave] = (credencial, agora + self.ttl)
+        return credencial
+
+    def invalidar(self, usuario_id):
+        with self._lock:
+            self._entradas.pop(str(usuario_id), None)
+
+    def status(self):
+        agora = time.monotonic()
+        with self._lock:
+            ativas = sum(1 for _, expira_em in self._entradas.values() if expira_em > agora)
+            return {**self.stats, "ativas": ativas, "ttl": self.ttl}
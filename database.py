@@ -1,243 +1,756 @@
 import os
-import logging
 import time
-import sqlite3
-import pyodbc
 import math
-import pandas as pd
+import logging
+import sqlite3
+import threading
 from flask import session
+from pool_odbc import pool, abrir_conexao_odbc
+from cache import CacheLRU
+from indice_locacoes import IndiceLocacoes, INDICE_ARMAZENS
+from reservas import reservas
+from alturas import PerfilAltura
+from resiliencia import executar_bpcs, disjuntor_bpcs
+from telemetria import medir, span
+from credenciais import CofreCredenciais, ChaveCredenciaisInvalida, PREFIXO_CIFRADO, cifrar_senha, decifrar_senha, senha_cifrada
+from banco_sqlite import BancoSQLite, criar_indice, criar_contador_versao
 
 
 DB_PATH = os.environ.get('SQLITE_PATH', 'usuarios.db')
 
+# Usuário de serviço do BPCS para tarefas em segundo plano (índice de locações)
+BPCS_SERVICO_UID = os.environ.get('BPCS_SERVICO_UID')
+BPCS_SERVICO_PWD = os.environ.get('BPCS_SERVICO_PWD')
+# Conexões do usuário de serviço abertas por worker antes do primeiro acesso (servidor.py)
+ODBC_AQUECER_CONEXOES = int(os.environ.get('ODBC_AQUECER_CONEXOES', '2'))
+
+# Busca de locação: candidatos lidos por página do AS400 até achar um não reservado
+LOCACAO_CANDIDATOS_POR_PAGINA = int(os.environ.get('LOCACAO_CANDIDATOS_POR_PAGINA', '20'))
+LOCACAO_MAX_RECUSAS = 200
+# Reserva de uma locação depois que a macro com ela é gravada (0 libera na hora)
+RESERVA_TTL_GRAVADA = float(os.environ.get('RESERVA_TTL_GRAVADA', '300'))
+
+# Consulta de candidatas do coletor (/fetch_locacao): resultado compartilhado entre usuários
+# por (armazém, zona, faixa de altura) durante LOCACAO_CACHE_TTL segundos
+LOCACAO_CACHE_TTL = float(os.environ.get('LOCACAO_CACHE_TTL', '15'))
+LOCACAO_FAIXA_ALTURA = float(os.environ.get('LOCACAO_FAIXA_ALTURA', '0.10'))
+LOCACAO_CANDIDATOS_CACHE = int(os.environ.get('LOCACAO_CANDIDATOS_CACHE', '100'))
 
-logging.basicConfig(level=logging.INFO)
 
 # ---------- Conexão SQLite ----------
+def _migrar_usuarios_v1(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id TEXT PRIMARY KEY,
+            upin TEXT,
+            senha TEXT,
+            nome TEXT
+        )
+    """)
+    criar_indice(conn, "usuarios", "id", "idx_usuarios_id", unico=True)
+
+def _migrar_usuarios_v2(conn):
+    criar_contador_versao(conn, "usuarios")
+
+banco_usuarios = BancoSQLite(DB_PATH, migracoes=[(1, _migrar_usuarios_v1), (2, _migrar_usuarios_v2)],
+                             nome="usuarios.db")
+
 def connect_sqlite():
+    # Conexão reaproveitada da thread atual (não feche; use banco_usuarios.transacao() para escrever)
     try:
-        return sqlite3.connect(DB_PATH)
+        return banco_usuarios.conexao()
     except sqlite3.Error as e:
         logging.error(f"[ERRO SQLITE] Conexão falhou: {e}")
         return None
 
+def _ler_usuario(user_id):
+    row = banco_usuarios.consultar_um("SELECT * FROM usuarios WHERE id = ?", (user_id,))
+    return dict(row) if row else None
+
 def get_usuario_by_id(user_id):
+    # Dados públicos do usuário: a senha do BPCS não sai daqui (use credenciais_usuario)
     try:
-        conn = connect_sqlite()
-        if not conn:
-            return None
-        conn.row_factory = sqlite3.Row
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM usuarios WHERE id = ?", (user_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        usuario = _ler_usuario(user_id)
+        if usuario:
+            usuario.pop('senha', None)
+        return usuario
     except Exception as e:
         logging.error(f"[ERRO SQLITE] get_usuario_by_id: {e}")
         return None
 
 def create_usuario(user_id, upin, senha, nome):
     try:
-        with connect_sqlite() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
+        with banco_usuarios.transacao() as conn:
+            conn.execute(
                 "INSERT INTO usuarios (id, upin, senha, nome) VALUES (?, ?, ?, ?)",
-                (user_id, upin, senha, nome)
+                (user_id, upin, cifrar_senha(senha), nome)
             )
-            conn.commit()
     except Exception as e:
         logging.error(f"[ERRO SQLITE] create_usuario: {e}")
+    cofre_credenciais.invalidar(user_id)
 
 def update_usuario_senha(user_id, nova_senha):
     try:
-        with connect_sqlite() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE usuarios SET senha = ? WHERE id = ?", (nova_senha, user_id)
+        with banco_usuarios.transacao() as conn:
+            conn.execute(
+                "UPDATE usuarios SET senha = ? WHERE id = ?", (cifrar_senha(nova_senha), user_id)
             )
-            conn.commit()
     except Exception as e:
         logging.error(f"[ERRO SQLITE] update_usuario_senha: {e}")
+    cofre_credenciais.invalidar(user_id)
 
-# ---------- Conexão ODBC / AS400 ----------
-def connect_odbc(uid, pwd):
+# ---------- Credenciais do BPCS ----------
+def _carregar_credencial(user_id):
     try:
-        return pyodbc.connect(
-            f'DRIVER={{iSeries Access ODBC Driver}};'
-            f'SYSTEM=US400BR;'
-            f'UID={uid};'
-            f'PWD={pwd}'
-        )
+        usuario = _ler_usuario(user_id)
+        if not usuario:
+            return None
+        senha = usuario.get('senha')
+        if senha and not senha_cifrada(senha):
+            _cifrar_senha_legada(user_id, senha)
+        usuario['senha'] = decifrar_senha(senha)
+        return usuario
+    except ChaveCredenciaisInvalida:
+        # Problema de configuração do servidor, não de login: não vira "usuário não encontrado"
+        raise
     except Exception as e:
-        logging.error(f"[ERRO ODBC] Conexão ODBC falhou: {e}")
+        logging.error(f"[ERRO SQLITE] Credenciais do usuário '{user_id}': {e}")
+        return None
+
+def _cifrar_senha_legada(user_id, senha):
+    # Linha gravada antes da cifragem: regrava cifrada (só se ainda estiver em texto puro)
+    with banco_usuarios.transacao() as conn:
+        conn.execute("UPDATE usuarios SET senha = ? WHERE id = ? AND senha = ?",
+                     (cifrar_senha(senha), user_id, senha))
+
+def verificar_chave_senhas():
+    """Confere na subida se a chave decifra as senhas já gravadas; ChaveCredenciaisInvalida se não."""
+    row = banco_usuarios.consultar_um(f"SELECT senha FROM usuarios WHERE senha LIKE '{PREFIXO_CIFRADO}%' LIMIT 1")
+    if row is not None:
+        decifrar_senha(row[0])
+
+def migrar_senhas_cifradas():
+    """Cifra as senhas ainda gravadas em texto puro no usuarios.db. Retorna quantas foram migradas."""
+    try:
+        with banco_usuarios.transacao() as conn:
+            linhas = conn.execute("SELECT id, senha FROM usuarios").fetchall()
+            legadas = [(user_id, senha) for user_id, senha in linhas if senha and not senha_cifrada(senha)]
+            conn.executemany("UPDATE usuarios SET senha = ? WHERE id = ? AND senha = ?",
+                             [(cifrar_senha(senha), user_id, senha) for user_id, senha in legadas])
+        if legadas:
+            logging.info(f"[CREDENCIAIS] {len(legadas)} senha(s) do BPCS cifradas no usuarios.db.")
+        return len(legadas)
+    except ChaveCredenciaisInvalida:
         raise
+    except Exception as e:
+        logging.error(f"[ERRO SQLITE] migrar_senhas_cifradas: {e}")
+        return 0
 
-def fetch_data(item, lote, mov, quantidade, armazem):
-    max_retries = 3
-    usuario_id = session.get('usuario_id')
+# Senha trocada ou usuário criado em outro worker muda a versão de usuarios: o cofre é descartado
+cofre_credenciais = CofreCredenciais(_carregar_credencial, versao=lambda: banco_usuarios.versao("usuarios"))
+
+def credenciais_usuario(usuario_id):
+    """(upin, senha) do BPCS do usuário, lidos do cofre em memória; None se não cadastrado."""
+    credencial = cofre_credenciais.obter(usuario_id)
+    if not credencial:
+        return None
+    return credencial.get("upin"), credencial.get("senha")
+
+def autenticar_usuario(user_id):
+    """Login do scanner: dados públicos do usuário (sem senha), já deixando as credenciais no cofre."""
+    credencial = cofre_credenciais.obter(user_id)
+    if not credencial:
+        return None
+    return {k: v for k, v in credencial.items() if k != 'senha'}
+
+def credenciais_stats():
+    return cofre_credenciais.status()
+
+def sqlite_stats():
+    return {"usuarios": banco_usuarios.status(), "itens": banco_itens.status(), "reservas": reservas.banco.status()}
+
+# ---------- Conexão ODBC / AS400 ----------
+def connect_odbc(uid, pwd):
+    # Conexão avulsa, fora do pool
+    return abrir_conexao_odbc(uid, pwd)
+
+def conexao_pool(uid, pwd):
+    # Empresta uma conexão aquecida do pool do usuário (devolvida ao sair do with)
+    return pool.conexao(uid, pwd)
+
+class RegistroBPCS:
+    """Linha retornada por fetch_data (IW1 + classe do ITH)."""
+    __slots__ = ("armazem", "item", "lote", "quantidade", "mov", "classe")
+
+    def __init__(self, armazem, item, lote, quantidade, mov, classe):
+        self.armazem = armazem
+        self.item = item
+        self.lote = lote
+        self.quantidade = quantidade
+        self.mov = mov
+        self.classe = classe
+
+    def as_dict(self):
+        return {campo: getattr(self, campo) for campo in self.__slots__}
+
+    def __repr__(self):
+        return f"RegistroBPCS({self.as_dict()})"
+
+@medir("fetch_data")
+def fetch_data(item, lote, mov, quantidade, armazem, usuario_id=None):
+    # usuario_id explícito permite chamar fora do contexto de requisição Flask (modo ASGI)
+    if usuario_id is None:
+        usuario_id = session.get('usuario_id')
 
     if not usuario_id:
         logging.warning("[AUTH] Usuário não autenticado.")
         return None
 
-    usuario = get_usuario_by_id(usuario_id)
-    if not usuario:
+    credenciais = credenciais_usuario(usuario_id)
+    if not credenciais:
         logging.warning(f"[AUTH] Usuário ID '{usuario_id}' não encontrado.")
         return None
 
-    uid = usuario.get("upin")
-    pwd = usuario.get("senha")
+    uid, pwd = credenciais
+
+    query = """
+        SELECT W1TWHS Armazem, W1PROD Item, W1LOT Lote, W1PQTY Quantidade, W1MOVN Mov, SUBSTR(T2.TCLAS, 1, 1) AS Classe
+        FROM V60ARQ3M.IW1 T1
+        LEFT JOIN V60BPCSF.ITH T2 ON T1.W1MOVN = T2.TREF AND T1.W1DATE = T2.TTDTE
+        WHERE W1PROD = ? AND W1LOT = ? AND W1MOVN = ? AND W1PQTY = ? AND W1TWHS = ?
+        GROUP BY W1TWHS, W1PROD, W1LOT, W1PQTY, W1MOVN, SUBSTR(T2.TCLAS, 1, 1)
+    """
+    params = (
+        str(item).strip(),
+        str(lote).strip(),
+        str(mov).strip(),
+        f"{float(quantidade):.3f}",
+        str(armazem).strip()
+    )
+
+    def consultar():
+        with conexao_pool(uid, pwd) as con:
+            cursor = con.cursor()
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+            cursor.close()
+            return row
 
-    for attempt in range(max_retries):
-        try:
-            with connect_odbc(uid, pwd) as con:
-                query = """
+    row = executar_bpcs(consultar, "fetch_data")
+    return RegistroBPCS(*(_texto(valor) if isinstance(valor, str) else valor for valor in row)) if row else None
+
+
+MANIFESTO_TAMANHO_BLOCO = int(os.environ.get('MANIFESTO_TAMANHO_BLOCO', '500'))
+
+def _texto(valor):
+    return str(valor).strip() if valor is not None else ""
+
+def _chave_recebimento(item, lote, mov, quantidade, armazem):
+    return (_texto(item), _texto(lote), _texto(mov), f"{float(quantidade):.3f}", _texto(armazem))
+
+@medir("validar_manifesto")
+def validar_manifesto(linhas, usuario_id=None):
+    """
+    Valida várias linhas (item, lote, mov, quantidade, armazem) contra IW1/ITH
+    com poucas consultas: as movimentações vão em blocos num IN e o casamento
+    das linhas é feito em memória. Retorna, na ordem recebida, um dict
+    {'encontrado': bool, 'classe': str | None} por linha.
+    """
+    if usuario_id is None:
+        usuario_id = session.get('usuario_id')
+    credenciais = credenciais_usuario(usuario_id)
+    if not credenciais:
+        logging.warning(f"[AUTH] Usuário ID '{usuario_id}' não encontrado.")
+        raise ValueError("Usuário não autenticado.")
+
+    uid, pwd = credenciais
+
+    movs = sorted({_texto(linha['mov']) for linha in linhas})
+    encontrados = {}
+
+    def consultar():
+        with conexao_pool(uid, pwd) as con:
+            cursor = con.cursor()
+            for inicio in range(0, len(movs), MANIFESTO_TAMANHO_BLOCO):
+                bloco = movs[inicio:inicio + MANIFESTO_TAMANHO_BLOCO]
+                placeholders = ','.join(['?'] * len(bloco))
+                cursor.execute(f"""
                     SELECT W1TWHS Armazem, W1PROD Item, W1LOT Lote, W1PQTY Quantidade, W1MOVN Mov, SUBSTR(T2.TCLAS, 1, 1) AS Classe
                     FROM V60ARQ3M.IW1 T1
                     LEFT JOIN V60BPCSF.ITH T2 ON T1.W1MOVN = T2.TREF AND T1.W1DATE = T2.TTDTE
-                    WHERE W1PROD = ? AND W1LOT = ? AND W1MOVN = ? AND W1PQTY = ? AND W1TWHS = ?
+                    WHERE W1MOVN IN ({placeholders})
                     GROUP BY W1TWHS, W1PROD, W1LOT, W1PQTY, W1MOVN, SUBSTR(T2.TCLAS, 1, 1)
-                """
-                params = (
-                    str(item).strip(),
-                    str(lote).strip(),
-                    str(mov).strip(),
-                    f"{float(quantidade):.3f}",
-                    str(armazem).strip()
-                )
-                df = pd.read_sql(query, con, params=params)
-                return df if not df.empty else None
+                """, bloco)
+                for armazem, item, lote, quantidade, mov, classe in cursor.fetchall():
+                    chave = _chave_recebimento(item, lote, mov, quantidade, armazem)
+                    encontrados.setdefault(chave, _texto(classe))
+                logging.info(f"[MANIFESTO] Bloco de {len(bloco)} movimentações consultado.")
 
-        except Exception as e:
-            error_msg = str(e)
-            logging.error(f"[ERRO DB] Tentativa {attempt+1} de {max_retries}: {error_msg}")
-
-            if "CWBSY0002" in error_msg:
-                raise ValueError("Senha do BPCS incorreta.")
-            if "CWBSY0011" in error_msg:
-                raise ValueError("Usuário BPCS bloqueado ou desativado.")
+    executar_bpcs(consultar, "validar_manifesto")
 
-            time.sleep(2)  # Pequeno delay entre as tentativas
+    resultado = []
+    for linha in linhas:
+        chave = _chave_recebimento(linha['item'], linha['lote'], linha['mov'], linha['quantidade'], linha['armazem'])
+        classe = encontrados.get(chave)
+        resultado.append({"encontrado": chave in encontrados, "classe": classe})
+    return resultado
 
-    return None
 
+def fetch_data_locação(zona=None, armazem=None, volume=None, item=None, dono=None, usuario_id=None):
+    if not zona:
+        logging.warning("Zona, armazém, item ou volume não informados em fetch_data_locação.")
+        return None
+    endereco, _ = fetch_locacao_zonas([zona], armazem, volume, item, dono, usuario_id)
+    return endereco
+
+
+cache_candidatas = CacheLRU(max_itens=2000, ttl=LOCACAO_CACHE_TTL)
+_cargas_candidatas = {}
+_cargas_candidatas_lock = threading.Lock()
+
+def _faixa_altura(altura_min):
+    # Arredonda para baixo: a faixa contém todas as locações que comportam o pedido, e a
+    # altura exata é filtrada depois de ler o cache
+    return round(math.floor(altura_min / LOCACAO_FAIXA_ALTURA + 1e-9) * LOCACAO_FAIXA_ALTURA, 2)
+
+def _carregar_candidatas(armazem, zona, faixa, usuario_id):
+    # Menores locações livres da zona com altura >= faixa; lê além do necessário para
+    # sobrar candidatas depois de descontar as reservadas e as abaixo da altura pedida
+    quantidade = LOCACAO_CANDIDATOS_CACHE + min(len(reservas.reservadas(armazem)), 1000)
+    livres = indice_locacoes.listar_livres(armazem, [zona]) if indice_locacoes is not None else None
+    if livres is not None:
+        livres = sorted(((loc, z, float(altura)) for loc, z, altura in livres if float(altura) >= faixa),
+                        key=lambda l: (l[2], l[0]))
+        return livres[:quantidade]
+
+    credenciais = credenciais_usuario(usuario_id)
+    if not credenciais:
+        raise ValueError("Usuário não autenticado.")
+    query = f"""
+        SELECT ILE.LELOC, UPPER(ILE.LEZONE), CAST(ILE.LEHGHT AS DECIMAL(5,2))
+        FROM V60BPCSF.ILE ILE
+        WHERE
+            ILE.LEWHS = ?
+            AND ILE.LEID = 'LE'
+            AND ILE.LELOCT = '0'
+            AND ILE.LELCDE = 'E'
+            AND CAST(ILE.LEHGHT AS DECIMAL(5,2)) >= ?
+            AND NOT EXISTS (
+                SELECT 1
+                FROM V60ARQ3M.IULM IULM
+                WHERE IULM.ULWHSE = ILE.LEWHS AND IULM.ULLOCA = ILE.LELOC
+            )
+            AND UPPER(ILE.LEZONE) = ?
+        ORDER BY CAST(ILE.LEHGHT AS DECIMAL(5,2)) ASC, ILE.LELOC
+        FETCH FIRST {int(quantidade)} ROWS ONLY
+    """
 
-def fetch_data_locação(zona=None, armazem=None, excluir_locs=None, volume=None, item=None):
+    def consultar():
+        with conexao_pool(*credenciais) as con:
+            cursor = con.cursor()
+            cursor.execute(query, [armazem, faixa, zona])
+            rows = cursor.fetchall()
+            cursor.close()
+            return [(row[0], str(row[1]).strip(), float(row[2])) for row in rows]
+
+    return executar_bpcs(consultar, "buscar_locacoes_candidatas")
+
+@medir("buscar_locacoes_candidatas")
+def buscar_locacoes_candidatas(armazem, zona, altura_min=0.0, limite=10, usuario_id=None):
+    """
+    Consulta (sem reservar) das `limite` menores locações livres da zona que comportam
+    altura_min. O resultado do AS400/índice fica em cache por (armazém, zona, faixa de altura),
+    com a altura arredondada para baixo em múltiplos de LOCACAO_FAIXA_ALTURA, e é compartilhado
+    entre os coletores; a altura exata e as reservas são aplicadas a cada chamada.
+    Retorna (lista de (loc, zona, altura), veio_do_cache).
+    """
+    zona = zona.upper()
+    chave = (armazem, zona, _faixa_altura(altura_min))
+    candidatas = cache_candidatas.get(chave)
+    do_cache = candidatas is not None
+    if candidatas is None:
+        if usuario_id is None:
+            usuario_id = session.get('usuario_id')
+        # Uma única carga por chave: coletores pedindo o mesmo ao mesmo tempo esperam por ela
+        with _cargas_candidatas_lock:
+            carga = _cargas_candidatas.setdefault(chave, threading.Lock())
+        with carga:
+            candidatas = cache_candidatas.get(chave)
+            do_cache = candidatas is not None
+            if candidatas is None:
+                candidatas = _carregar_candidatas(armazem, zona, chave[2], usuario_id)
+                cache_candidatas.set(chave, candidatas)
+        with _cargas_candidatas_lock:
+            _cargas_candidatas.pop(chave, None)
+
+    reservadas = reservas.reservadas(armazem)
+    resultado = [c for c in candidatas if c[2] >= altura_min and c[0] not in reservadas]
+    return resultado[:limite], do_cache
+
+def candidatas_cache_stats():
+    return cache_candidatas.stats()
+
+def _tomar_locacao(armazem, endereco, dono, ttl=None):
+    # Sem dono a consulta é apenas informativa: não reserva, só respeita as reservas existentes
+    if dono is None:
+        return not reservas.reservada(armazem, endereco)
+    return reservas.reivindicar(armazem, endereco, dono, ttl)
+
+
+@medir("fetch_locacao_zonas")
+def fetch_locacao_zonas(zonas=None, armazem=None, volume=None, item=None, dono=None, usuario_id=None, ttl=None):
+    """
+    Busca, em uma única consulta, a melhor locação livre entre as zonas informadas.
+    O resultado é ordenado pela prioridade da zona (ordem da lista), depois LEHGHT e LELOC.
+    A locação escolhida fica reservada para o dono na tabela de reservas compartilhada
+    (por ttl segundos, se informado; o prefetch usa uma reserva provisória curta).
+    Retorna (endereco, zona) ou (None, None).
+    """
     try:
-        if not zona or not armazem or volume is None or not item:
-            logging.warning("Zona, armazém, item ou volume não informados em fetch_data_locação.")
-            return None
+        if not zonas or not armazem or volume is None or not item:
+            logging.warning("Zona, armazém, item ou volume não informados em fetch_locacao_zonas.")
+            return None, None
 
-        usuario_id = session.get('usuario_id')
-        usuario = get_usuario_by_id(usuario_id)
-        if not usuario:
-            return None
-
-        uid = usuario.get("upin")
-        pwd = usuario.get("senha")
+        if usuario_id is None:
+            usuario_id = session.get('usuario_id')
+        credenciais = credenciais_usuario(usuario_id)
+        if not credenciais:
+            return None, None
 
-        excluir_locs = excluir_locs or []
+        uid, pwd = credenciais
 
-        # Buscar dados do item
-        info = get_item_cubagem(item)
-        if not info:
-            logging.warning("Item não encontrado na tabela de cubagem.")
-            return None
+        zonas = [z.upper() for z in zonas]
 
+        # Mesma altura usada na escolha das zonas (calculadora única do item)
         try:
-            volume = float(volume)
-            cx_lastro = float(info['Cx_Lastro'])
-            altura_item = float(info['Altura'])
+            calculo = calcular_altura_item(item, float(volume))
         except (ValueError, TypeError):
-            logging.warning("Erro ao converter volume ou dados de cubagem.")
-            return None
+            calculo = None
+        if calculo is None:
+            logging.warning("Item sem cubagem completa ou volume inválido.")
+            return None, None
+        altura_necessaria, _ = calculo
+        logging.info(f"[LOCACAO] Buscando locação nas zonas {zonas} com altura necessária mínima de {altura_necessaria:.2f}m")
+
+        # Reservas de outros processos entram como recusadas desde o início; o índice só
+        # conhece as feitas neste processo
+        reservadas = reservas.reservadas(armazem)
+        if indice_locacoes is not None:
+            recusadas = set(reservadas)
+            while len(recusadas) < len(reservadas) + LOCACAO_MAX_RECUSAS:
+                resultado = indice_locacoes.buscar(armazem, zonas, altura_necessaria, recusadas)
+                if resultado is None:
+                    logging.info(f"[LOCACAO] Índice do armazém {armazem} desatualizado; consultando o AS400.")
+                    break
+                endereco, zona, height = resultado
+                if not endereco:
+                    return None, None
+                if _tomar_locacao(armazem, endereco, dono, ttl):
+                    if dono is not None:
+                        indice_locacoes.reservar(armazem, endereco, ttl)
+                    logging.info(f"[LOCACAO] Endereço escolhido pelo índice: {endereco} (zona {zona}) com LEHGHT={height}")
+                    return endereco, zona
+                recusadas.add(endereco)
+
+        placeholders_zonas = ','.join(['?'] * len(zonas))
+        prioridade_zonas = ' '.join(f'WHEN ? THEN {i}' for i in range(len(zonas)))
+
+        query = f"""
+            SELECT ILE.LELOC, ILE.LEHGHT, UPPER(ILE.LEZONE) AS ZONA
+            FROM V60BPCSF.ILE ILE
+            WHERE 
+                ILE.LEWHS = ?
+                AND ILE.LEID = 'LE' 
+                AND ILE.LELOCT = '0'
+                AND ILE.LELCDE = 'E'
+                AND CAST(ILE.LEHGHT AS DECIMAL(5,2)) >= ?
+                AND NOT EXISTS (
+                    SELECT 1 
+                    FROM V60ARQ3M.IULM IULM
+                    WHERE IULM.ULWHSE = ILE.LEWHS AND IULM.ULLOCA = ILE.LELOC
+                )
+                AND UPPER(ILE.LEZONE) IN ({placeholders_zonas})
+            ORDER BY 
+            CASE UPPER(ILE.LEZONE) {prioridade_zonas} END,
+            CAST(ILE.LEHGHT AS DECIMAL(5,2)) ASC,
+            ILE.LELOC
+        """
+        params = [armazem, altura_necessaria] + zonas + zonas
+
+        # Página do tamanho das reservas atuais mais uma folga: em geral uma única consulta
+        # já passa das reservadas e chega a uma livre
+        tamanho_pagina = LOCACAO_CANDIDATOS_POR_PAGINA + min(len(reservadas), 1000)
+
+        def consultar_pagina(pagina):
+            offset = pagina * tamanho_pagina
+            with span("ile_consulta", armazem=armazem, zonas=zonas, pagina=pagina), conexao_pool(uid, pwd) as con:
+                cursor = con.cursor()
+                cursor.execute(
+                    query + f" OFFSET {offset} ROWS FETCH FIRST {tamanho_pagina} ROWS ONLY",
+                    params
+                )
+                rows = cursor.fetchall()
+                cursor.close()
+                return rows
+
+        # Candidatos em páginas até acabar o resultado: locações reservadas por outros
+        # terminais são descartadas pela chave primária da tabela de reservas, sem NOT IN
+        pagina = 0
+        while True:
+            rows = executar_bpcs(lambda: consultar_pagina(pagina), "fetch_locacao_zonas")
+            for row in rows:
+                endereco, height, zona = row[0], row[1], str(row[2]).strip()
+                if endereco in reservadas:
+                    continue
+                if _tomar_locacao(armazem, endereco, dono, ttl):
+                    if indice_locacoes is not None and dono is not None:
+                        indice_locacoes.reservar(armazem, endereco, ttl)
+                    logging.info(f"[LOCACAO] Endereço escolhido: {endereco} (zona {zona}) com LEHGHT={height}")
+                    return endereco, zona
+            if len(rows) < tamanho_pagina:
+                break
+            pagina += 1
+        return None, None
+
+    except (ValueError, ConnectionError):
+        raise
+    except Exception as e:
+        logging.error(f"[ERRO] fetch_locacao_zonas: {e}")
+        return None, None
 
-        ALTURA_PALLET = 0.15
-        altura_necessaria = (math.ceil(volume / cx_lastro) * altura_item) + ALTURA_PALLET
-        altura_necessaria = round(altura_necessaria, 2)
-        logging.info(f"[LOCACAO] Buscando locação para zona '{zona.upper()}' com altura necessária mínima de {altura_necessaria:.2f}m")
+def carregar_locacoes_cadastro(armazem, credenciais=None):
+    # Todas as locações de armazenagem do armazém (ocupadas ou não); usuário de serviço por padrão
+    uid, pwd = credenciais or (BPCS_SERVICO_UID, BPCS_SERVICO_PWD)
 
-        with connect_odbc(uid, pwd) as con:
-            query = """
-                SELECT ILE.LELOC, ILE.LEHGHT
+    def consultar():
+        with conexao_pool(uid, pwd) as con:
+            cursor = con.cursor()
+            cursor.execute("""
+                SELECT ILE.LELOC, UPPER(ILE.LEZONE), CAST(ILE.LEHGHT AS DECIMAL(5,2))
                 FROM V60BPCSF.ILE ILE
-                WHERE 
+                WHERE
                     ILE.LEWHS = ?
-                    AND ILE.LEID = 'LE' 
+                    AND ILE.LEID = 'LE'
                     AND ILE.LELOCT = '0'
                     AND ILE.LELCDE = 'E'
-                    AND CAST(ILE.LEHGHT AS DECIMAL(5,2)) >= ?
-                    AND NOT EXISTS (
-                        SELECT 1 
-                        FROM V60ARQ3M.IULM IULM
-                        WHERE IULM.ULWHSE = ILE.LEWHS AND IULM.ULLOCA = ILE.LELOC
-                    )
-                    AND UPPER(ILE.LEZONE) = ?
-            """
-
-            if excluir_locs:
-                placeholders = ','.join(['?'] * len(excluir_locs))
-                query += f" AND ILE.LELOC NOT IN ({placeholders})"
-
-            query += """
-                ORDER BY 
-                CASE 
-                    WHEN UPPER(ILE.LEZONE) = 'RUA' THEN 2
-                    ELSE 1
-                END,
-                CAST(ILE.LEHGHT AS DECIMAL(5,2)) ASC,
-                ILE.LELOC
-                FETCH FIRST 1 ROWS ONLY
-                """
-
-            params = [armazem, altura_necessaria, zona.upper()] + excluir_locs
+            """, (armazem,))
+            return [(row[0], row[1], row[2]) for row in cursor.fetchall()]
+    return executar_bpcs(consultar, "carregar_locacoes_cadastro")
 
-            cursor = con.cursor()
-            cursor.execute(query, params)
-            row = cursor.fetchone()
-            if row:
-                endereco, height = row[0], row[1]
-                logging.info(f"[LOCACAO] Endereço escolhido: {endereco} com LEHGHT={height}")
-                return endereco
-            return None
+def carregar_locacoes_ocupadas(armazem, credenciais=None):
+    uid, pwd = credenciais or (BPCS_SERVICO_UID, BPCS_SERVICO_PWD)
 
-    except Exception as e:
-        logging.error(f"[ERRO] fetch_data_locação: {e}")
-        return None
+    def consultar():
+        with conexao_pool(uid, pwd) as con:
+            cursor = con.cursor()
+            cursor.execute("SELECT DISTINCT ULLOCA FROM V60ARQ3M.IULM WHERE ULWHSE = ?", (armazem,))
+            return [row[0] for row in cursor.fetchall()]
+    return executar_bpcs(consultar, "carregar_locacoes_ocupadas")
+
+# Índice só é ativado quando há usuário de serviço configurado
+indice_locacoes = (
+    IndiceLocacoes(carregar_locacoes_cadastro, carregar_locacoes_ocupadas, armazens=INDICE_ARMAZENS)
+    if BPCS_SERVICO_UID and BPCS_SERVICO_PWD else None
+)
+
+def carregar_locacoes_livres(armazem, zonas, altura_min=0.0, usuario_id=None):
+    """
+    Candidatas para o planejamento em lote: todas as locações livres (loc, zona, altura)
+    das zonas com altura >= altura_min, lidas uma única vez (índice em memória, se
+    atualizado, ou uma consulta ao AS400) e sem as que já estão reservadas.
+    """
+    zonas = [z.upper() for z in zonas]
+    livres = indice_locacoes.listar_livres(armazem, zonas) if indice_locacoes is not None else None
+
+    if livres is None:
+        if usuario_id is None:
+            usuario_id = session.get('usuario_id')
+        credenciais = credenciais_usuario(usuario_id)
+        if not credenciais:
+            raise ValueError("Usuário não autenticado.")
+
+        placeholders_zonas = ','.join(['?'] * len(zonas))
+        query = f"""
+            SELECT ILE.LELOC, UPPER(ILE.LEZONE), CAST(ILE.LEHGHT AS DECIMAL(5,2))
+            FROM V60BPCSF.ILE ILE
+            WHERE
+                ILE.LEWHS = ?
+                AND ILE.LEID = 'LE'
+                AND ILE.LELOCT = '0'
+                AND ILE.LELCDE = 'E'
+                AND CAST(ILE.LEHGHT AS DECIMAL(5,2)) >= ?
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM V60ARQ3M.IULM IULM
+                    WHERE IULM.ULWHSE = ILE.LEWHS AND IULM.ULLOCA = ILE.LELOC
+                )
+                AND UPPER(ILE.LEZONE) IN ({placeholders_zonas})
+        """
+
+        def consultar():
+            with conexao_pool(*credenciais) as con:
+                cursor = con.cursor()
+                cursor.execute(query, [armazem, altura_min] + zonas)
+                rows = cursor.fetchall()
+                cursor.close()
+                return [(row[0], str(row[1]).strip(), float(row[2])) for row in rows]
+
+        livres = executar_bpcs(consultar, "carregar_locacoes_livres")
+
+    reservadas = reservas.reservadas(armazem)
+    return [(loc, zona, float(altura)) for loc, zona, altura in livres
+            if loc not in reservadas and float(altura) >= altura_min]
+
+def reservar_locacao(armazem, endereco, dono, ttl=None):
+    """Reserva uma locação específica (ex.: escolhida pelo planejador). Retorna True se conseguiu."""
+    if not reservas.reivindicar(armazem, endereco, dono, ttl=ttl):
+        return False
+    if indice_locacoes is not None:
+        indice_locacoes.reservar(armazem, endereco, ttl)
+    return True
+
+def aquecer_processo(itens=(), conexoes_odbc=ODBC_AQUECER_CONEXOES):
+    """
+    Prepara um processo recém-criado (worker do servidor.py) antes de receber tráfego: conexões
+    ODBC do usuário de serviço, primeira sincronização do índice de locações e cubagem dos
+    itens informados no cache. Falhas só vão para o log; o worker sobe mesmo sem o AS400.
+    """
+    resumo = {"conexoes_odbc": 0, "armazens_indice": 0, "itens_cubagem": 0}
+    if BPCS_SERVICO_UID and BPCS_SERVICO_PWD and conexoes_odbc:
+        try:
+            resumo["conexoes_odbc"] = pool.aquecer(BPCS_SERVICO_UID, BPCS_SERVICO_PWD, conexoes_odbc)
+        except Exception as e:
+            logging.warning(f"[AQUECIMENTO] Pool ODBC não aquecido: {e}")
+    if indice_locacoes is not None:
+        for armazem in INDICE_ARMAZENS:
+            try:
+                indice_locacoes.sincronizar(armazem, completo=True)
+                resumo["armazens_indice"] += 1
+            except Exception as e:
+                logging.warning(f"[AQUECIMENTO] Índice do armazém {armazem} não sincronizado: {e}")
+        indice_locacoes.iniciar()
+    for item in itens:
+        if get_item_cubagem(item):
+            resumo["itens_cubagem"] += 1
+    return resumo
+
+def indice_locacoes_stats():
+    if indice_locacoes is None:
+        return {"ativo": False}
+    return {"ativo": True, **indice_locacoes.status()}
 
 ITENS_DB_PATH = os.environ.get('ITENS_DB_PATH', 'Itens.db')
+CUBAGEM_CACHE_MAX = int(os.environ.get('CUBAGEM_CACHE_MAX', '5000'))
+CUBAGEM_CACHE_TTL = float(os.environ.get('CUBAGEM_CACHE_TTL', '600'))
+
+cache_cubagem = CacheLRU(max_itens=CUBAGEM_CACHE_MAX, ttl=CUBAGEM_CACHE_TTL)
+
+def _migrar_itens_v1(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Itens_cubagem (
+            Item TEXT PRIMARY KEY,
+            Comprimento REAL,
+            Largura REAL,
+            Altura REAL,
+            Cubagem REAL,
+            Cx_Lastro REAL
+        )
+    """)
+    # O UPSERT de salvar_ou_atualizar_item_cubagem depende de Item ser único: de itens repetidos
+    # em bases antigas fica a cubagem gravada por último
+    criar_indice(conn, "Itens_cubagem", "Item", "idx_itens_cubagem_item", unico=True, deduplicar=True)
+
+def _migrar_itens_v2(conn):
+    criar_contador_versao(conn, "Itens_cubagem")
+
+banco_itens = BancoSQLite(ITENS_DB_PATH, migracoes=[(1, _migrar_itens_v1), (2, _migrar_itens_v2)], nome="Itens.db")
+_versao_cache_cubagem = None
 
 def connect_itens_db():
+    # Conexão reaproveitada da thread atual (não feche)
     try:
-        return sqlite3.connect(ITENS_DB_PATH)
+        return banco_itens.conexao()
     except sqlite3.Error as e:
         logging.error(f"[ERRO SQLITE] Conexão com Itens.db falhou: {e}")
         return None
 
+def _ler_item_cubagem(item):
+    with span("sqlite_itens", item=item):
+        row = banco_itens.consultar_um("SELECT * FROM Itens_cubagem WHERE Item = ?", (item,))
+        return dict(row) if row else None
+
+def _entrada_cubagem(info):
+    # O cache guarda a linha junto com o perfil de altura pré-calculado do item
+    try:
+        perfil = PerfilAltura(float(info['Cx_Lastro']), float(info['Altura']))
+    except (KeyError, TypeError, ValueError):
+        perfil = None   # cubagem incompleta
+    return info, perfil
+
+def _conferir_versao_cubagem():
+    # Cubagem gravada em outro worker (modal, importação) muda a versão: o cache pode estar velho
+    global _versao_cache_cubagem
+    versao = banco_itens.versao("Itens_cubagem")
+    if versao != _versao_cache_cubagem:
+        cache_cubagem.clear()
+        _versao_cache_cubagem = versao
+
+def _acompanhar_versao_cubagem(conn, gravadas):
+    # Dentro da transação de gravação: se só esta gravação mudou a versão desde a última
+    # conferência, o cache continua válido (o próprio chamador atualiza os itens gravados)
+    global _versao_cache_cubagem
+    versao = conn.execute("SELECT versao FROM versao_Itens_cubagem").fetchone()[0]
+    if _versao_cache_cubagem is not None and versao - gravadas == _versao_cache_cubagem:
+        _versao_cache_cubagem = versao
+
+def _carregar_cubagem(item):
+    _conferir_versao_cubagem()
+    entrada = cache_cubagem.get(item)
+    if entrada is None:
+        # Uma gravação da cubagem durante a leitura descarta a linha lida (pode ser a anterior)
+        marca = cache_cubagem.marca()
+        info = _ler_item_cubagem(item)
+        if info is None:
+            return None
+        entrada = _entrada_cubagem(info)
+        cache_cubagem.set(item, entrada, marca=marca)
+    return entrada
+
+@medir("get_item_cubagem")
 def get_item_cubagem(item):
     try:
-        conn = connect_itens_db()
-        conn.row_factory = sqlite3.Row
-        with conn:
-            cur = conn.cursor()
-            cur.execute("SELECT * FROM Itens_cubagem WHERE Item = ?", (item,))
-            row = cur.fetchone()
-            return dict(row) if row else None
+        entrada = _carregar_cubagem(item)
+        return dict(entrada[0]) if entrada else None
     except Exception as e:
         logging.error(f"[ERRO] get_item_cubagem: {e}")
         return None
 
+def calcular_altura_item(item, volume):
+    """
+    Altura necessária e zonas prioritárias do item para o volume, pela calculadora
+    única (alturas.py). Retorna (altura, zonas) ou None se a cubagem estiver incompleta.
+    """
+    try:
+        entrada = _carregar_cubagem(item)
+    except Exception as e:
+        logging.error(f"[ERRO] calcular_altura_item: {e}")
+        return None
+    if not entrada or entrada[1] is None:
+        return None
+    return entrada[1].calcular(volume)
+
+CAMPOS_CUBAGEM = ("Comprimento", "Largura", "Altura", "Cubagem", "Cx_Lastro")
+
+def arredondar_cubagem(valor):
+    # Mesma regra do modal de cubagem: 4 casas decimais
+    return round(float(valor), 4) if valor not in (None, '') else None
+
 def salvar_ou_atualizar_item_cubagem(dados):
     try:
-        cubagem_formatada = (
-            round(float(dados['Cubagem']), 4)
-            if dados.get('Cubagem') not in (None, '')
-            else None
-        )
+        cubagem_formatada = arredondar_cubagem(dados.get('Cubagem'))
 
-        with connect_itens_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
+        with banco_itens.transacao() as conn:
+            conn.execute("""
                 INSERT INTO Itens_cubagem (Item, Comprimento, Largura, Altura, Cubagem, Cx_Lastro)
                 VALUES (?, ?, ?, ?, ?, ?)
                 ON CONFLICT(Item) DO UPDATE SET
@@ -254,8 +767,100 @@ def salvar_ou_atualizar_item_cubagem(dados):
                 cubagem_formatada,
                 dados['Cx_Lastro']
             ))
-            conn.commit()
-            return True
+            _acompanhar_versao_cubagem(conn, 1)
     except Exception as e:
         logging.error(f"[ERRO] salvar_ou_atualizar_item_cubagem: {e}")
-        return False
\ No newline at end of file
+        cache_cubagem.invalidate(dados.get('Item'))
+        return False
+
+    # Write-through: recarrega a linha gravada para o cache. O invalidate antes da leitura faz
+    # leitores que pegaram a linha anterior desistirem do set; se outra gravação do mesmo item
+    # terminar no meio, é esta leitura que desiste
+    try:
+        cache_cubagem.invalidate(dados['Item'])
+        marca = cache_cubagem.marca()
+        info = _ler_item_cubagem(dados['Item'])
+        if info:
+            cache_cubagem.set(dados['Item'], _entrada_cubagem(info), marca=marca)
+    except Exception as e:
+        logging.warning(f"[CACHE CUBAGEM] Falha ao atualizar cache do item {dados['Item']}: {e}")
+        cache_cubagem.invalidate(dados['Item'])
+    return True
+
+def importar_lote_cubagem(linhas):
+    """
+    Grava um lote da importação em massa numa única transação (executemany).
+    linhas: tuplas (Item, Comprimento, Largura, Altura, Cubagem, Cx_Lastro) já validadas.
+    Campo vazio no arquivo não apaga o valor já cadastrado (COALESCE).
+    """
+    with span("sqlite_importacao_cubagem", linhas=len(linhas)):
+        with banco_itens.transacao() as conn:
+            conn.executemany("""
+                INSERT INTO Itens_cubagem (Item, Comprimento, Largura, Altura, Cubagem, Cx_Lastro)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(Item) DO UPDATE SET
+                    Comprimento=COALESCE(excluded.Comprimento, Itens_cubagem.Comprimento),
+                    Largura=COALESCE(excluded.Largura, Itens_cubagem.Largura),
+                    Altura=COALESCE(excluded.Altura, Itens_cubagem.Altura),
+                    Cubagem=COALESCE(excluded.Cubagem, Itens_cubagem.Cubagem),
+                    Cx_Lastro=COALESCE(excluded.Cx_Lastro, Itens_cubagem.Cx_Lastro)
+            """, linhas)
+            _acompanhar_versao_cubagem(conn, len(linhas))
+    # Próxima leitura de cada item volta ao banco (e recalcula o perfil de altura)
+    for linha in linhas:
+        cache_cubagem.invalidate(linha[0])
+    return len(linhas)
+
+def itens_cubagem_incompletos():
+    """Itera (Item, [campos faltando]) dos itens de Itens.db sem cubagem completa."""
+    condicao = " OR ".join(f"{c} IS NULL OR {c} = 0" for c in CAMPOS_CUBAGEM)
+    cursor = banco_itens.conexao().execute(
+        f"SELECT Item, {', '.join(CAMPOS_CUBAGEM)} FROM Itens_cubagem WHERE {condicao} ORDER BY Item"
+    )
+    for row in cursor:
+        yield row["Item"], [c for c in CAMPOS_CUBAGEM if row[c] in (None, 0)]
+
+def cubagem_cache_stats():
+    return cache_cubagem.stats()
+
+def odbc_pool_stats():
+    return pool.status()
+
+def disjuntor_bpcs_stats():
+    return disjuntor_bpcs.status()
+
+def reservas_stats():
+    return reservas.status()
+
+def confirmar_reserva_locacao(armazem, endereco, dono):
+    """Transforma a reserva provisória do prefetch em reserva normal. False se ela já expirou."""
+    if not reservas.confirmar(armazem, endereco, dono):
+        return False
+    if indice_locacoes is not None:
+        indice_locacoes.reservar(armazem, endereco)
+    return True
+
+def liberar_reserva_locacao(armazem, endereco, dono):
+    reservas.liberar(armazem, endereco, dono)
+    if indice_locacoes is not None:
+        indice_locacoes.liberar(armazem, endereco)
+
+def liberar_reserva_provisoria(armazem, endereco, dono, ttl):
+    """
+    Libera a reserva provisória do prefetch só se ela ainda vence em até ttl segundos: se um
+    "Consultar" simultâneo já a confirmou (reserva longa), a locação continua reservada.
+    """
+    if reservas.liberar(armazem, endereco, dono, expira_ate=time.time() + ttl) and indice_locacoes is not None:
+        indice_locacoes.liberar(armazem, endereco)
+
+def encerrar_reservas_gravadas(locacoes, dono):
+    """
+    Reservas das locações que entraram numa macro gravada: ficam só RESERVA_TTL_GRAVADA
+    segundos (tempo de rodar a macro no AS400, que passa a mostrar a locação ocupada)
+    em vez do RESERVA_TTL inteiro; com 0 são liberadas na hora. locacoes: [(armazem, locacao)].
+    """
+    for armazem, endereco in locacoes:
+        if RESERVA_TTL_GRAVADA <= 0:
+            liberar_reserva_locacao(armazem, endereco, dono)
+        elif reservas.confirmar(armazem, endereco, dono, ttl=RESERVA_TTL_GRAVADA) and indice_locacoes is not None:
+            indice_locacoes.reservar(armazem, endereco, RESERVA_TTL_GRAVADA)
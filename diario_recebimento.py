@@ -0,0 +1,213 @@
+"""
+Diário de recebimento: registro permanente (só inclusão) de cada conferência concluída, com
+item, lote, movimentação, locação, zona, impressora, UPIN e horários.
+
+Quem registra só enfileira a linha; uma thread grava em lotes de DIARIO_LOTE linhas (ou a
+cada DIARIO_INTERVALO segundos), numa transação curta no diario_recebimento.db em WAL. Assim
+a conferência não espera o disco e as consultas por movimentação ou locação usam índices.
+Com a macro e os dados da etiqueta guardados, dá para reimprimir e regerar a macro sem
+repetir a validação no BPCS nem a busca de locação.
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+
+from banco_sqlite import BancoSQLite, criar_indice
+from telemetria import span, correlacao_atual
+
+
+DIARIO_DB_PATH = os.environ.get('DIARIO_DB_PATH', 'diario_recebimento.db')
+DIARIO_LOTE = int(os.environ.get('DIARIO_LOTE', '200'))
+DIARIO_INTERVALO = float(os.environ.get('DIARIO_INTERVALO', '1'))
+DIARIO_FILA_MAX = int(os.environ.get('DIARIO_FILA_MAX', '10000'))
+DIARIO_CONSULTA_MAX = 1000
+
+CAMPOS_DIARIO = ("registrado_em", "evento", "origem_id", "usuario_id", "upin", "armazem", "item", "lote",
+                 "mov", "volume", "qud", "locacao", "zona", "impressora", "job_impressao", "macro", "correlacao")
+
+
+def _migrar_diario_v1(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recebimentos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            registrado_em REAL NOT NULL,
+            evento TEXT NOT NULL,
+            origem_id INTEGER,
+            usuario_id TEXT,
+            upin TEXT,
+            armazem TEXT,
+            item TEXT,
+            lote TEXT,
+            mov TEXT,
+            volume TEXT,
+            qud TEXT,
+            locacao TEXT,
+            zona TEXT,
+            impressora TEXT,
+            job_impressao TEXT,
+            macro TEXT,
+            correlacao TEXT
+        )
+    """)
+    criar_indice(conn, "recebimentos", "mov", "idx_recebimentos_mov")
+    criar_indice(conn, "recebimentos", "locacao", "idx_recebimentos_locacao")
+    criar_indice(conn, "recebimentos", "registrado_em", "idx_recebimentos_registrado_em")
+    criar_indice(conn, "recebimentos", "usuario_id", "idx_recebimentos_usuario")
+
+
+def _migrar_diario_v2(conn):
+    criar_indice(conn, "recebimentos", "job_impressao", "idx_recebimentos_job")
+
+
+class DiarioRecebimento:
+    """
+    Diário com gravação assíncrona em lotes. registrar() nunca toca no disco; se a fila
+    estiver cheia (disco travado), a linha vai para o log com o aviso em vez de bloquear
+    a conferência.
+    """
+
+    def __init__(self, caminho=DIARIO_DB_PATH, lote=DIARIO_LOTE, intervalo=DIARIO_INTERVALO):
+        self.banco = BancoSQLite(caminho, migracoes=[(1, _migrar_diario_v1), (2, _migrar_diario_v2)], nome="diario_recebimento")
+        self.lote = lote
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._fila = None
+        self._thread = None
+        self._pid = None
+        self.stats = {"registradas": 0, "gravadas": 0, "lotes": 0, "descartadas": 0, "erros": 0}
+
+    def _iniciar(self):
+        # Threads não sobrevivem a fork: cada processo tem a própria fila e gravador
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._fila = queue.Queue(maxsize=DIARIO_FILA_MAX)
+            self._thread = threading.Thread(target=self._loop, name="diario-recebimento", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    # ---------- Gravação ----------
+    def registrar(self, evento="recebimento", **campos):
+        self._iniciar()
+        linha = dict(campos, evento=evento, registrado_em=time.time(),
+                     correlacao=campos.get("correlacao") or correlacao_atual())
+        try:
+            self._fila.put_nowait(tuple(linha.get(c) for c in CAMPOS_DIARIO))
+        except queue.Full:
+            with self._lock:
+                self.stats["descartadas"] += 1
+            logging.error(f"[DIARIO] Fila do diário cheia; registro não gravado: {linha}")
+            return
+        with self._lock:
+            self.stats["registradas"] += 1
+
+    def _loop(self):
+        while True:
+            pendentes = [self._fila.get()]
+            limite = time.monotonic() + self.intervalo
+            while len(pendentes) < self.lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    pendentes.append(self._fila.get(timeout=restante))
+                except queue.Empty:
+                    break
+            self._gravar(pendentes)
+            for _ in pendentes:
+                self._fila.task_done()
+
+    def _gravar(self, linhas):
+        try:
+            with span("sqlite_diario", linhas=len(linhas)), self.banco.transacao() as conn:
+                conn.executemany(
+                    f"INSERT INTO recebimentos ({', '.join(CAMPOS_DIARIO)}) "
+                    f"VALUES ({', '.join('?' for _ in CAMPOS_DIARIO)})",
+                    linhas,
+                )
+            with self._lock:
+                self.stats["gravadas"] += len(linhas)
+                self.stats["lotes"] += 1
+        except Exception as e:
+            with self._lock:
+                self.stats["erros"] += len(linhas)
+            logging.error(f"[DIARIO] Falha ao gravar {len(linhas)} registro(s) do diário: {e}")
+
+    def descarregar(self, timeout=5.0):
+        """Espera a fila deste processo ser gravada (encerramento, testes, CLI)."""
+        if self._pid != os.getpid():
+            return True
+        limite = time.monotonic() + timeout
+        while self._fila.unfinished_tasks and time.monotonic() < limite:
+            time.sleep(0.02)
+        return not self._fila.unfinished_tasks
+
+    # ---------- Consulta ----------
+    def consultar(self, mov=None, armazem=None, locacao=None, usuario_id=None, desde=None, ate=None,
+                  limite=100):
+        """Registros mais recentes primeiro, filtrados pelos campos informados (AND)."""
+        filtros, params = [], []
+        for coluna, valor in (("mov", mov), ("armazem", armazem), ("locacao", locacao), ("usuario_id", usuario_id)):
+            if valor:
+                filtros.append(f"{coluna} = ?")
+                params.append(str(valor))
+        if desde is not None:
+            filtros.append("registrado_em >= ?")
+            params.append(float(desde))
+        if ate is not None:
+            filtros.append("registrado_em <= ?")
+            params.append(float(ate))
+        onde = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+        params.append(max(1, min(int(limite), DIARIO_CONSULTA_MAX)))
+        with span("sqlite_diario_consulta", filtros=len(filtros)):
+            linhas = self.banco.consultar(
+                f"SELECT * FROM recebimentos {onde} ORDER BY registrado_em DESC, id DESC LIMIT ?", params)
+        return [dict(linha) for linha in linhas]
+
+    def obter(self, ids):
+        """Registros pelos IDs, na ordem em que foram gravados."""
+        ids = [int(i) for i in ids][:DIARIO_CONSULTA_MAX]
+        if not ids:
+            return []
+        linhas = self.banco.consultar(
+            f"SELECT * FROM recebimentos WHERE id IN ({', '.join('?' for _ in ids)}) ORDER BY id", ids)
+        return [dict(linha) for linha in linhas]
+
+    def falhas_impressao(self, jobs):
+        """IDs, entre os informados, dos jobs de etiqueta que falharam de vez (evento falha_impressao)."""
+        jobs = [str(j) for j in jobs if j][:DIARIO_CONSULTA_MAX]
+        if not jobs:
+            return set()
+        linhas = self.banco.consultar(
+            f"SELECT job_impressao FROM recebimentos WHERE evento = 'falha_impressao' "
+            f"AND job_impressao IN ({', '.join('?' for _ in jobs)})", jobs)
+        return {linha["job_impressao"] for linha in linhas}
+
+    def itens_recentes(self, limite=200):
+        """Itens distintos dos últimos recebimentos (aquecimento do cache de cubagem)."""
+        linhas = self.banco.consultar(
+            "SELECT item FROM recebimentos WHERE evento = 'recebimento' AND item IS NOT NULL "
+            "ORDER BY id DESC LIMIT ?", (int(limite) * 5,))
+        return list(dict.fromkeys(linha["item"] for linha in linhas))[:limite]
+
+    def recebimentos_periodo(self, armazem, desde):
+        """(item, volume, locacao, zona) de cada recebimento do armazém desde o timestamp, sem limite de linhas."""
+        cursor = self.banco.conexao().execute(
+            "SELECT item, volume, locacao, zona FROM recebimentos "
+            "WHERE evento = 'recebimento' AND armazem = ? AND registrado_em >= ?", (str(armazem), float(desde)))
+        for linha in cursor:
+            yield tuple(linha)
+
+    def status(self):
+        with self._lock:
+            pendentes = self._fila.qsize() if self._pid == os.getpid() else 0
+            return {**self.stats, "na_fila": pendentes, "lote": self.lote, "intervalo": self.intervalo}
+
+
+diario_recebimento = DiarioRecebimento()
+atexit.register(diario_recebimento.descarregar)
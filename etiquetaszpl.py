@@ -1,5 +1,10 @@
 import socket
 import logging
+from string import Formatter
+
+from telemetria import medir
+
+IMPRESSORA_PORTA = 9100
 
 IMPRESSORAS = {
     "BRTEMAN01": {
@@ -8,7 +13,7 @@ IMPRESSORAS = {
         "margem_outros": "25",
         "length_peq_med_gra": "190", 
         "length_outros": "180",
-        "zpl": lambda endereco, length, margem, movimentacao, upin: f"""
+        "zpl": """
             ^XA
             ^PRC
             ^FO500,30^BQ0N,4,4^FDQA,{endereco}^FS
@@ -26,7 +31,7 @@ IMPRESSORAS = {
         "margem_outros": "20",
         "length_peq_med_gra": "140", 
         "length_outros": "130",
-        "zpl": lambda endereco, length, margem, movimentacao, upin: f"""
+        "zpl": """
             ^XA
             ^PRC
             ^FO350,25^BQ0N,3,3^FDQA,{endereco}^FS
@@ -40,29 +45,84 @@ IMPRESSORAS = {
     }
 }
 
-def imprimir_etiqueta(enderecos, zona="", movimentacao="", upin="", impressora="BRTEMAN01"):
-    if not enderecos:
-        return
-
+def config_impressora(impressora):
     impressora_cfg = IMPRESSORAS.get(impressora)
     if not impressora_cfg:
         raise ValueError(f"Impressora '{impressora}' não reconhecida.")
+    return impressora_cfg
+
+def endereco_impressora(impressora):
+    impressora_cfg = config_impressora(impressora)
+    return impressora_cfg["ip"], impressora_cfg.get("porta", IMPRESSORA_PORTA)
+
+ZONAS_PEQ_MED_GRA = ("PEQ", "MED", "GRA")
+CODIFICACAO_ZPL = 'ISO-8859-1'
+
+_templates_compilados = {}
+
+def _classe_zona(zona):
+    return "peq_med_gra" if zona.upper().strip() in ZONAS_PEQ_MED_GRA else "outros"
 
-    zona = zona.upper().strip()
-    margem = impressora_cfg["margem_peq_med_gra"] if zona in ["PEQ", "MED", "GRA"] else impressora_cfg["margem_outros"]
-    length = impressora_cfg["length_peq_med_gra"] if zona in ["PEQ", "MED", "GRA"] else impressora_cfg["length_outros"]
-    ip = impressora_cfg["ip"]
-    port = 9100
-    gerar_zpl = impressora_cfg["zpl"]
+def _compilar_template(impressora, classe):
+    """
+    Compila o template da impressora para a classe de zona: remove a indentação,
+    fixa margem/length e separa o texto em trechos de bytes e placeholders.
+    """
+    impressora_cfg = config_impressora(impressora)
+    zpl = "".join(linha.strip() for linha in impressora_cfg["zpl"].splitlines())
+    zpl = (zpl.replace("{margem}", impressora_cfg[f"margem_{classe}"])
+              .replace("{length}", impressora_cfg[f"length_{classe}"]))
+
+    trechos = []
+    for literal, campo, _, _ in Formatter().parse(zpl):
+        trechos.append(literal.encode(CODIFICACAO_ZPL))
+        if campo is not None:
+            trechos.append(campo)
+    return trechos
+
+def template_compilado(impressora, zona=""):
+    chave = (impressora, _classe_zona(zona))
+    trechos = _templates_compilados.get(chave)
+    if trechos is None:
+        trechos = _templates_compilados[chave] = _compilar_template(*chave)
+    return trechos
+
+def renderizar_etiquetas(enderecos, zona="", movimentacao="", upin="", impressora="BRTEMAN01"):
+    """Renderiza todas as etiquetas do lote num único buffer de bytes."""
+    return renderizar_lote(
+        [{"endereco": endereco, "zona": zona, "movimentacao": movimentacao, "upin": upin} for endereco in enderecos],
+        impressora
+    )
+
+def renderizar_lote(etiquetas, impressora="BRTEMAN01"):
+    """
+    Renderiza etiquetas heterogêneas (zona/movimentação/UPIN por etiqueta) num único buffer.
+    Cada etiqueta é um dict com 'endereco' e, opcionalmente, 'zona', 'movimentacao' e 'upin'.
+    """
+    buffer = bytearray()
+    for etiqueta in etiquetas:
+        valores = {
+            "endereco": str(etiqueta["endereco"]).encode(CODIFICACAO_ZPL),
+            "movimentacao": str(etiqueta.get("movimentacao", "")).encode(CODIFICACAO_ZPL),
+            "upin": str(etiqueta.get("upin", "")).encode(CODIFICACAO_ZPL),
+        }
+        for trecho in template_compilado(impressora, etiqueta.get("zona", "")):
+            buffer += valores[trecho] if isinstance(trecho, str) else trecho
+    return bytes(buffer)
+
+@medir("imprimir_etiqueta")
+def imprimir_etiqueta(enderecos, zona="", movimentacao="", upin="", impressora="BRTEMAN01"):
+    if not enderecos:
+        return
+
+    zpl = renderizar_etiquetas(enderecos, zona, movimentacao, upin, impressora)
+    ip, port = endereco_impressora(impressora)
 
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.settimeout(5)
             s.connect((ip, port))
-
-            for endereco in enderecos:
-                zpl = gerar_zpl(endereco, length, margem, movimentacao, upin)
-                s.sendall(zpl.encode('ISO-8859-1'))
+            s.sendall(zpl)  # lote inteiro numa única escrita
 
     except (socket.timeout, socket.error) as e:
         logging.error(f"[IMPRESSÃO] Falha ao conectar à impressora: {e}")
@@ -0,0 +1,353 @@
+import os
+import time
+import asyncio
+import uuid
+import queue
+import select
+import socket
+import logging
+import threading
+from collections import OrderedDict
+
+from etiquetaszpl import IMPRESSORAS, renderizar_etiquetas, renderizar_lote, endereco_impressora
+from telemetria import span, definir_correlacao, correlacao_atual
+
+
+FILA_IMPRESSAO_MAX = int(os.environ.get('FILA_IMPRESSAO_MAX', '200'))
+IMPRESSAO_TIMEOUT = float(os.environ.get('IMPRESSAO_TIMEOUT', '5'))
+IMPRESSAO_MAX_TENTATIVAS = int(os.environ.get('IMPRESSAO_MAX_TENTATIVAS', '5'))
+# Tempo total (s) de um job entre tentativas, conexões e esperas: bem abaixo dos 30 s em que a
+# tela acompanha o job, para o erro chegar ao operador
+IMPRESSAO_PRAZO = float(os.environ.get('IMPRESSAO_PRAZO', '15'))
+IMPRESSAO_BACKOFF_INICIAL = 0.5
+IMPRESSAO_BACKOFF_MAXIMO = 30.0
+IMPRESSAO_RECONECTAR_APOS = 120.0   # segundos ociosos antes de reabrir o socket
+JOBS_MANTIDOS = 1000
+ERRO_IMPRESSORA = "Erro ao conectar à impressora. Verifique se está ligada e acessível."
+
+
+class _ImpressoraWorker:
+    """Uma thread e um socket persistente por impressora."""
+
+    def __init__(self, nome, spooler):
+        self.nome = nome
+        self.spooler = spooler
+        self.fila = queue.Queue(maxsize=FILA_IMPRESSAO_MAX)
+        self.sock = None
+        self.usado_em = 0.0
+        self.falhas_seguidas = 0
+        self.thread = threading.Thread(target=self._loop, name=f"impressao-{nome}", daemon=True)
+        self.thread.start()
+
+    def _conectar(self, timeout=IMPRESSAO_TIMEOUT):
+        ip, porta = endereco_impressora(self.nome)
+        sock = socket.create_connection((ip, porta), timeout=timeout)
+        sock.settimeout(timeout)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        logging.info(f"[IMPRESSÃO] Conectado à impressora {self.nome} ({ip}:{porta}).")
+        return sock
+
+    def _socket_valido(self):
+        if self.sock is None:
+            return False
+        if time.monotonic() - self.usado_em > IMPRESSAO_RECONECTAR_APOS:
+            return False
+        try:
+            # Socket legível sem dados pendentes = impressora encerrou a conexão
+            legivel, _, _ = select.select([self.sock], [], [], 0)
+            if legivel and self.sock.recv(1, socket.MSG_PEEK) == b"":
+                return False
+        except OSError:
+            return False
+        return True
+
+    def _fechar(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    def _enviar(self, dados):
+        tentativa = 0
+        limite = time.monotonic() + IMPRESSAO_PRAZO
+        # Impressora que já vinha falhando: uma tentativa só, sem segurar os jobs seguintes
+        tentativas = 1 if self.falhas_seguidas >= IMPRESSAO_MAX_TENTATIVAS else IMPRESSAO_MAX_TENTATIVAS
+        while True:
+            try:
+                timeout = max(0.1, min(IMPRESSAO_TIMEOUT, limite - time.monotonic()))
+                if not self._socket_valido():
+                    self._fechar()
+                    self.sock = self._conectar(timeout)
+                self.sock.settimeout(timeout)
+                self.sock.sendall(dados)
+                self.usado_em = time.monotonic()
+                self.falhas_seguidas = 0
+                return
+            except OSError as e:
+                self._fechar()
+                tentativa += 1
+                self.falhas_seguidas += 1
+                espera = min(IMPRESSAO_BACKOFF_INICIAL * (2 ** (tentativa - 1)), IMPRESSAO_BACKOFF_MAXIMO)
+                if tentativa >= tentativas or limite - time.monotonic() <= espera:
+                    raise
+                logging.warning(f"[IMPRESSÃO] {self.nome}: falha no envio ({e}); nova tentativa em {espera:.1f}s.")
+                time.sleep(espera)
+
+    def _loop(self):
+        while True:
+            job_id, dados, id_correlacao = self.fila.get()
+            definir_correlacao(id_correlacao)   # logs do envio ligados à requisição que gerou o job
+            self.spooler.atualizar_job(job_id, status="imprimindo")
+            try:
+                with span("impressora_envio", impressora=self.nome, job=job_id, bytes=len(dados)):
+                    self._enviar(dados)
+                self.spooler.finalizar_job(job_id)
+            except OSError as e:
+                logging.error(f"[IMPRESSÃO] Falha ao imprimir job {job_id} na {self.nome}: {e}")
+                self.spooler.finalizar_job(job_id, erro=ERRO_IMPRESSORA)
+            finally:
+                self.fila.task_done()
+
+
+class FilaImpressao:
+    """
+    Spooler de etiquetas: a requisição só enfileira o job e recebe o ID;
+    o envio para a impressora acontece na thread da impressora.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._workers = {}
+        self._jobs = OrderedDict()
+        self._ao_falhar = {}     # job_id -> função(job_id, erro) chamada se o job falhar de vez
+        self._pid = os.getpid()
+        self.fila_async = None   # FilaImpressaoAsync, quando o modo ASGI está ativo
+
+    def _worker(self, impressora):
+        if self._pid != os.getpid():
+            # Threads não sobrevivem a fork: recria os workers no processo filho
+            self._lock = threading.Lock()
+            self._workers = {}
+            self._pid = os.getpid()
+        with self._lock:
+            worker = self._workers.get(impressora)
+            if worker is None:
+                worker = self._workers[impressora] = _ImpressoraWorker(impressora, self)
+            return worker
+
+    def enfileirar(self, enderecos, zona="", movimentacao="", upin="", impressora="BRTEMAN01", ao_falhar=None):
+        if not enderecos:
+            return None
+
+        # Renderiza já na requisição para validar a impressora (ValueError)
+        dados = renderizar_etiquetas(enderecos, zona, movimentacao, upin, impressora)
+        return self._enfileirar_dados(dados, len(enderecos), impressora, ao_falhar)
+
+    def enfileirar_lote(self, etiquetas, impressora="BRTEMAN01"):
+        if not etiquetas:
+            return None
+        dados = renderizar_lote(etiquetas, impressora)
+        return self._enfileirar_dados(dados, len(etiquetas), impressora)
+
+    def _enfileirar_dados(self, dados, quantidade, impressora, ao_falhar=None):
+        job_id = self.registrar_job(impressora, quantidade, ao_falhar)
+        try:
+            self._worker(impressora).fila.put_nowait((job_id, dados, correlacao_atual()))
+        except queue.Full:
+            # Quem enfileirou recebe o ConnectionError e desfaz o que precisar
+            self.finalizar_job(job_id, erro="Fila de impressão cheia.", avisar=False)
+            raise ConnectionError(f"Fila de impressão da {impressora} está cheia. Verifique a impressora.")
+        return job_id
+
+    def registrar_job(self, impressora, quantidade, ao_falhar=None):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if ao_falhar is not None:
+                self._ao_falhar[job_id] = ao_falhar
+            self._jobs[job_id] = {
+                "id": job_id,
+                "impressora": impressora,
+                "etiquetas": quantidade,
+                "status": "na_fila",
+                "erro": None,
+                "criado_em": time.time(),
+                "atualizado_em": time.time(),
+            }
+            while len(self._jobs) > JOBS_MANTIDOS:
+                antigo, _ = self._jobs.popitem(last=False)
+                self._ao_falhar.pop(antigo, None)
+        return job_id
+
+    def atualizar_job(self, job_id, **campos):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(campos, atualizado_em=time.time())
+
+    def finalizar_job(self, job_id, erro=None, avisar=True):
+        """Concluído, ou erro definitivo: nesse caso chama o ao_falhar registrado com o job."""
+        self.atualizar_job(job_id, status="erro" if erro else "concluido", erro=erro)
+        with self._lock:
+            ao_falhar = self._ao_falhar.pop(job_id, None)
+        if erro and avisar and ao_falhar is not None:
+            try:
+                ao_falhar(job_id, erro)
+            except Exception as e:
+                logging.error(f"[IMPRESSÃO] Falha ao desfazer o job {job_id}: {e}")
+
+    def status_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def status(self):
+        with self._lock:
+            impressoras = {
+                nome: {
+                    "na_fila": worker.fila.qsize(),
+                    "conectada": worker.sock is not None,
+                    "falhas_seguidas": worker.falhas_seguidas,
+                }
+                for nome, worker in self._workers.items()
+                if nome in IMPRESSORAS
+            }
+        if self.fila_async is not None:
+            impressoras.update(self.fila_async.status())
+        return impressoras
+
+
+fila_impressao = FilaImpressao()
+
+
+class _ImpressoraAsync:
+    """Uma tarefa asyncio e uma conexão persistente (asyncio streams) por impressora."""
+
+    def __init__(self, nome, spooler):
+        self.nome = nome
+        self.spooler = spooler
+        self.fila = asyncio.Queue(maxsize=FILA_IMPRESSAO_MAX)
+        self.leitor = None
+        self.escritor = None
+        self.usado_em = 0.0
+        self.falhas_seguidas = 0
+        self.tarefa = asyncio.get_running_loop().create_task(self._loop(), name=f"impressao-{nome}")
+
+    async def _conectar(self, timeout=IMPRESSAO_TIMEOUT):
+        ip, porta = endereco_impressora(self.nome)
+        self.leitor, self.escritor = await asyncio.wait_for(asyncio.open_connection(ip, porta), timeout)
+        sock = self.escritor.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        logging.info(f"[IMPRESSÃO] Conectado à impressora {self.nome} ({ip}:{porta}).")
+
+    def _conexao_valida(self):
+        if self.escritor is None or self.escritor.is_closing():
+            return False
+        if time.monotonic() - self.usado_em > IMPRESSAO_RECONECTAR_APOS:
+            return False
+        # EOF recebido = impressora encerrou a conexão
+        return not self.leitor.at_eof()
+
+    def _fechar(self):
+        if self.escritor is not None:
+            self.escritor.close()
+        self.leitor = self.escritor = None
+
+    async def _enviar(self, dados):
+        tentativa = 0
+        limite = time.monotonic() + IMPRESSAO_PRAZO
+        tentativas = 1 if self.falhas_seguidas >= IMPRESSAO_MAX_TENTATIVAS else IMPRESSAO_MAX_TENTATIVAS
+        while True:
+            try:
+                timeout = max(0.1, min(IMPRESSAO_TIMEOUT, limite - time.monotonic()))
+                if not self._conexao_valida():
+                    self._fechar()
+                    await self._conectar(timeout)
+                self.escritor.write(dados)
+                await asyncio.wait_for(self.escritor.drain(), timeout)
+                self.usado_em = time.monotonic()
+                self.falhas_seguidas = 0
+                return
+            except (OSError, asyncio.TimeoutError) as e:
+                self._fechar()
+                tentativa += 1
+                self.falhas_seguidas += 1
+                espera = min(IMPRESSAO_BACKOFF_INICIAL * (2 ** (tentativa - 1)), IMPRESSAO_BACKOFF_MAXIMO)
+                if tentativa >= tentativas or limite - time.monotonic() <= espera:
+                    raise
+                logging.warning(f"[IMPRESSÃO] {self.nome}: falha no envio ({e!r}); nova tentativa em {espera:.1f}s.")
+                await asyncio.sleep(espera)
+
+    async def _loop(self):
+        while True:
+            job_id, dados, id_correlacao = await self.fila.get()
+            definir_correlacao(id_correlacao)
+            self.spooler.atualizar_job(job_id, status="imprimindo")
+            try:
+                with span("impressora_envio", impressora=self.nome, job=job_id, bytes=len(dados)):
+                    await self._enviar(dados)
+                self.spooler.finalizar_job(job_id)
+            except (OSError, asyncio.TimeoutError) as e:
+                logging.error(f"[IMPRESSÃO] Falha ao imprimir job {job_id} na {self.nome}: {e!r}")
+                # O ao_falhar do job grava no SQLite: fora do event loop
+                await asyncio.to_thread(self.spooler.finalizar_job, job_id, ERRO_IMPRESSORA)
+            finally:
+                self.fila.task_done()
+
+
+class FilaImpressaoAsync:
+    """
+    Mesma fila de etiquetas para o modo ASGI: o envio é feito no event loop, sem
+    thread por impressora. Os jobs ficam no registro do spooler síncrono, então
+    /impressao/<job_id> e /status continuam valendo nos dois modos.
+    """
+
+    def __init__(self, spooler=fila_impressao):
+        self.spooler = spooler
+        self._workers = {}
+        spooler.fila_async = self
+
+    def _worker(self, impressora):
+        worker = self._workers.get(impressora)
+        if worker is None:
+            worker = self._workers[impressora] = _ImpressoraAsync(impressora, self.spooler)
+        return worker
+
+    def enfileirar(self, enderecos, zona="", movimentacao="", upin="", impressora="BRTEMAN01", ao_falhar=None):
+        if not enderecos:
+            return None
+        dados = renderizar_etiquetas(enderecos, zona, movimentacao, upin, impressora)
+        job_id = self.spooler.registrar_job(impressora, len(enderecos), ao_falhar)
+        try:
+            self._worker(impressora).fila.put_nowait((job_id, dados, correlacao_atual()))
+        except asyncio.QueueFull:
+            self.spooler.finalizar_job(job_id, erro="Fila de impressão cheia.", avisar=False)
+            raise ConnectionError(f"Fila de impressão da {impressora} está cheia. Verifique a impressora.")
+        return job_id
+
+    def status(self):
+        return {
+            nome: {
+                "na_fila": worker.fila.qsize(),
+                "conectada": worker.escritor is not None,
+                "falhas_seguidas": worker.falhas_seguidas,
+            }
+            for nome, worker in list(self._workers.items())
+            if nome in IMPRESSORAS
+        }
+
+    async def fechar(self):
+        for worker in self._workers.values():
+            worker.tarefa.cancel()
+            worker._fechar()
+        self._workers = {}
+
+
+def enfileirar_etiqueta(enderecos, zona="", movimentacao="", upin="", impressora="BRTEMAN01", ao_falhar=None):
+    return fila_impressao.enfileirar(enderecos, zona, movimentacao, upin, impressora, ao_falhar)
+
+
+def enfileirar_lote_etiquetas(etiquetas, impressora="BRTEMAN01"):
+    return fila_impressao.enfileirar_lote(etiquetas, impressora)
@@ -0,0 +1,84 @@
+import os
+import re
+import time
+import secrets
+import logging
+import tempfile
+from xml.sax.saxutils import escape
+
+
+MACRO_MAX_ACOES = int(os.environ.get('MACRO_MAX_ACOES', '0'))  # 0 = sem limite por arquivo
+
+CABECALHO_MACRO = (
+    '<HAScript name="Macro">'
+    '<screen name="MainScreen" entryscreen="true">'
+    '<description></description>'
+    '<actions><input value="'
+)
+RODAPE_MACRO = (
+    '"/></actions>'
+    '<nextscreens timeout="0" ><nextscreen name="EndScreen" /></nextscreens>'
+    '</screen>'
+    '<screen name="EndScreen" exitscreen="true">'
+    '<description></description><actions></actions>'
+    '<nextscreens timeout="0" ></nextscreens>'
+    '</screen>'
+    '</HAScript>'
+)
+
+
+def _nome_seguro(valor):
+    return re.sub(r'[^A-Za-z0-9_-]', '', str(valor)) or "usuario"
+
+
+def gravar_macros(entradas, diretorio, usuario="", max_acoes=MACRO_MAX_ACOES):
+    """
+    Grava as entradas do buffer direto em arquivo, sem montar a macro em memória.
+    Cada parte é escrita num arquivo temporário no próprio diretório e renomeada
+    atomicamente para um nome exclusivo do usuário e do lote. Com max_acoes > 0,
+    recebimentos grandes são divididos em várias macros.
+    Retorna a lista de nomes de arquivo gerados (vazia se não havia entradas).
+    """
+    os.makedirs(diretorio, exist_ok=True)
+    lote = f"{time.strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(3)}"
+    base = f"macro_{_nome_seguro(usuario)}_{lote}"
+
+    temporarios = []
+    arquivo = None
+    acoes = 0
+    try:
+        for entrada in entradas:
+            if arquivo is None or (max_acoes and acoes >= max_acoes):
+                if arquivo is not None:
+                    arquivo.write(RODAPE_MACRO)
+                    arquivo.close()
+                arquivo = tempfile.NamedTemporaryFile(
+                    'w', dir=diretorio, prefix=f".{base}_", suffix=".tmp", delete=False
+                )
+                temporarios.append(arquivo.name)
+                arquivo.write(CABECALHO_MACRO)
+                acoes = 0
+            arquivo.write(escape(entrada, {'"': '&quot;'}))
+            acoes += 1
+
+        if arquivo is not None:
+            arquivo.write(RODAPE_MACRO)
+            arquivo.close()
+    except Exception:
+        if arquivo is not None:
+            arquivo.close()
+        for caminho in temporarios:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+        raise
+
+    nomes = []
+    for parte, caminho in enumerate(temporarios, start=1):
+        nome = f"{base}.mac" if len(temporarios) == 1 else f"{base}_parte{parte:02d}.mac"
+        os.replace(caminho, os.path.join(diretorio, nome))
+        nomes.append(nome)
+
+    logging.info(f"[MACRO] {len(nomes)} arquivo(s) gravado(s) em {diretorio}: {nomes}")
+    return nomes
@@ -0,0 +1,277 @@
+"""
+Importação em massa da cubagem (Itens_cubagem) a partir do cadastro mestre em CSV ou XLSX.
+
+O arquivo é lido em streaming (csv.reader / openpyxl em modo read_only), validado linha a
+linha e gravado em lotes de CUBAGEM_IMPORTACAO_LOTE linhas, cada lote numa transação curta:
+com o Itens.db em WAL, as consultas de cubagem do recebimento continuam sendo atendidas
+durante a carga. Ao final é gerado um relatório (CSV) com as linhas inválidas e os itens que
+continuam sem cubagem completa.
+
+Uso pela linha de comando:
+    python importador_cubagem.py cadastro.xlsx [--lote 5000] [--relatorio faltantes.csv]
+"""
+import os
+import csv
+import time
+import uuid
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+
+from database import CAMPOS_CUBAGEM, arredondar_cubagem, importar_lote_cubagem, itens_cubagem_incompletos
+
+
+CUBAGEM_IMPORTACAO_LOTE = int(os.environ.get('CUBAGEM_IMPORTACAO_LOTE', '5000'))
+CUBAGEM_RELATORIO_DIR = os.environ.get(
+    'CUBAGEM_RELATORIO_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'relatorios'))
+IMPORTACOES_MANTIDAS = 20
+ERROS_NO_STATUS = 50
+EXTENSOES_ACEITAS = (".csv", ".xlsx")
+
+# Cabeçalhos aceitos no arquivo (sem acento, minúsculos) -> coluna de Itens_cubagem
+COLUNAS = {
+    "item": "Item", "sku": "Item", "codigo": "Item", "cod_item": "Item",
+    "comprimento": "Comprimento", "comp": "Comprimento",
+    "largura": "Largura", "larg": "Largura",
+    "altura": "Altura", "alt": "Altura",
+    "cubagem": "Cubagem", "m3": "Cubagem",
+    "cx_lastro": "Cx_Lastro", "cxlastro": "Cx_Lastro", "caixas_lastro": "Cx_Lastro", "lastro": "Cx_Lastro",
+}
+
+
+class LinhaInvalida(ValueError):
+    pass
+
+
+# ---------- Leitura em streaming ----------
+def _chave_cabecalho(texto):
+    texto = str(texto or "").strip().lower()
+    for de, para in (("á", "a"), ("ã", "a"), ("â", "a"), ("é", "e"), ("ê", "e"), ("í", "i"),
+                     ("ó", "o"), ("õ", "o"), ("ô", "o"), ("ú", "u"), ("ç", "c")):
+        texto = texto.replace(de, para)
+    return texto.replace(" ", "_").replace("-", "_").replace(".", "")
+
+
+def _mapear_cabecalho(cabecalho):
+    mapa = {}
+    for indice, nome in enumerate(cabecalho):
+        coluna = COLUNAS.get(_chave_cabecalho(nome))
+        if coluna and coluna not in mapa:
+            mapa[coluna] = indice
+    if "Item" not in mapa:
+        raise ValueError("Arquivo sem a coluna Item (aceitos: Item, SKU, Codigo).")
+    return mapa
+
+
+def _linhas_csv(caminho):
+    # utf-8-sig cobre o BOM do Excel; o separador (';' ou ',') é detectado no início do arquivo
+    with open(caminho, newline="", encoding="utf-8-sig", errors="replace") as f:
+        amostra = f.read(8192)
+        f.seek(0)
+        try:
+            dialeto = csv.Sniffer().sniff(amostra, delimiters=";,\t|")
+        except csv.Error:
+            dialeto = csv.excel
+        yield from csv.reader(f, dialeto)
+
+
+def _linhas_xlsx(caminho):
+    from openpyxl import load_workbook   # só quem importa XLSX precisa do openpyxl carregado
+
+    livro = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        yield from livro.worksheets[0].iter_rows(values_only=True)
+    finally:
+        livro.close()
+
+
+def ler_registros(caminho):
+    """Itera (número da linha no arquivo, dict coluna -> valor bruto), sem carregar o arquivo inteiro."""
+    extensao = os.path.splitext(caminho)[1].lower()
+    if extensao not in EXTENSOES_ACEITAS:
+        raise ValueError(f"Formato não suportado: {extensao or 'sem extensão'} (use CSV ou XLSX).")
+    linhas = _linhas_csv(caminho) if extensao == ".csv" else _linhas_xlsx(caminho)
+
+    mapa = None
+    for numero, linha in enumerate(linhas, start=1):
+        if mapa is None:
+            mapa = _mapear_cabecalho(linha)
+            continue
+        if not linha or all(v in (None, "") for v in linha):
+            continue
+        yield numero, {coluna: (linha[i] if i < len(linha) else None) for coluna, i in mapa.items()}
+
+
+# ---------- Validação ----------
+def _numero(valor, campo):
+    if valor is None or (isinstance(valor, str) and not valor.strip()):
+        return None
+    if isinstance(valor, str):
+        texto = valor.strip()
+        if "," in texto:
+            texto = texto.replace(".", "").replace(",", ".")   # 1.234,5 -> 1234.5
+        valor = texto
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        raise LinhaInvalida(f"{campo} não numérico: {valor!r}")
+    if numero < 0 or numero != numero:
+        raise LinhaInvalida(f"{campo} inválido: {valor!r}")
+    return numero
+
+
+def validar_registro(registro):
+    """
+    Converte uma linha do arquivo na tupla gravada em Itens_cubagem, com as mesmas regras do
+    modal de cubagem: Cubagem com 4 casas (calculada por C x L x A quando vier vazia) e
+    Cx_Lastro inteiro. Campos vazios ficam None. Lança LinhaInvalida.
+    """
+    item = str(registro.get("Item") or "").strip()
+    if item.endswith(".0") and isinstance(registro.get("Item"), float):
+        item = item[:-2]   # código numérico lido do XLSX como float
+    if not item:
+        raise LinhaInvalida("Item vazio")
+
+    valores = {campo: _numero(registro.get(campo), campo) for campo in CAMPOS_CUBAGEM}
+    if valores["Cx_Lastro"] is not None:
+        if valores["Cx_Lastro"] != int(valores["Cx_Lastro"]):
+            raise LinhaInvalida(f"Cx_Lastro deve ser inteiro: {registro.get('Cx_Lastro')!r}")
+        valores["Cx_Lastro"] = int(valores["Cx_Lastro"])
+    if valores["Cubagem"] is None and all(valores[c] for c in ("Comprimento", "Largura", "Altura")):
+        valores["Cubagem"] = valores["Comprimento"] * valores["Largura"] * valores["Altura"]
+    valores["Cubagem"] = arredondar_cubagem(valores["Cubagem"])
+
+    return (item, valores["Comprimento"], valores["Largura"], valores["Altura"],
+            valores["Cubagem"], valores["Cx_Lastro"])
+
+
+# ---------- Importação ----------
+def importar_arquivo(caminho, lote=CUBAGEM_IMPORTACAO_LOTE, relatorio=None, progresso=None):
+    """
+    Importa o arquivo inteiro e grava o relatório de pendências em `relatorio` (CSV ';').
+    progresso(dict) é chamado a cada lote gravado. Retorna o resumo da importação.
+    """
+    inicio = time.perf_counter()
+    resumo = {"lidas": 0, "gravadas": 0, "invalidas": 0, "erros": [], "incompletos": 0,
+              "amostra_incompletos": [], "relatorio": relatorio}
+    invalidas = []
+    pendentes = []
+
+    def gravar():
+        resumo["gravadas"] += importar_lote_cubagem(pendentes)
+        pendentes.clear()
+        if progresso:
+            progresso(dict(resumo, erros=list(resumo["erros"])))
+
+    for numero, registro in ler_registros(caminho):
+        resumo["lidas"] += 1
+        try:
+            pendentes.append(validar_registro(registro))
+        except LinhaInvalida as e:
+            resumo["invalidas"] += 1
+            invalidas.append((numero, str(registro.get("Item") or ""), str(e)))
+            if len(resumo["erros"]) < ERROS_NO_STATUS:
+                resumo["erros"].append({"linha": numero, "item": registro.get("Item"), "motivo": str(e)})
+            continue
+        if len(pendentes) >= lote:
+            gravar()
+    if pendentes:
+        gravar()
+
+    # Pendências do cadastro inteiro (inclui os itens criados vazios pelo /verificar_item_cubagem)
+    escritor = arquivo = None
+    if relatorio:
+        os.makedirs(os.path.dirname(os.path.abspath(relatorio)), exist_ok=True)
+        arquivo = open(relatorio, "w", newline="", encoding="utf-8-sig")
+        escritor = csv.writer(arquivo, delimiter=";")
+        escritor.writerow(["Item", "Situacao", "Detalhe"])
+        for numero, item, motivo in invalidas:
+            escritor.writerow([item, "linha_invalida", f"linha {numero}: {motivo}"])
+    try:
+        for item, faltando in itens_cubagem_incompletos():
+            resumo["incompletos"] += 1
+            if len(resumo["amostra_incompletos"]) < ERROS_NO_STATUS:
+                resumo["amostra_incompletos"].append({"item": item, "faltando": faltando})
+            if escritor:
+                escritor.writerow([item, "incompleto", ",".join(faltando)])
+    finally:
+        if arquivo:
+            arquivo.close()
+
+    resumo["duracao_s"] = round(time.perf_counter() - inicio, 3)
+    logging.info(f"[CUBAGEM] Importação de {os.path.basename(caminho)}: {resumo['gravadas']} gravadas, "
+                 f"{resumo['invalidas']} inválidas, {resumo['incompletos']} itens incompletos "
+                 f"em {resumo['duracao_s']}s.")
+    return resumo
+
+
+class ImportacoesCubagem:
+    """
+    Importações disparadas pelo endpoint: cada uma roda numa thread em segundo plano e
+    elas são executadas uma por vez; o status fica consultável pelo ID.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._execucao = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def iniciar(self, caminho, nome_arquivo, apagar_ao_final=True):
+        job_id = uuid.uuid4().hex
+        relatorio = os.path.join(CUBAGEM_RELATORIO_DIR, f"cubagem_pendencias_{job_id[:12]}.csv")
+        with self._lock:
+            self._jobs[job_id] = {"id": job_id, "arquivo": nome_arquivo, "status": "na_fila",
+                                  "criado_em": time.time(), "relatorio": relatorio}
+            while len(self._jobs) > IMPORTACOES_MANTIDAS:
+                self._jobs.popitem(last=False)
+        threading.Thread(target=self._executar, args=(job_id, caminho, relatorio, apagar_ao_final),
+                         name=f"importacao-cubagem-{job_id[:8]}", daemon=True).start()
+        return job_id
+
+    def _atualizar(self, job_id, **campos):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(campos, atualizado_em=time.time())
+
+    def _executar(self, job_id, caminho, relatorio, apagar_ao_final):
+        try:
+            with self._execucao:
+                self._atualizar(job_id, status="importando")
+                resumo = importar_arquivo(caminho, relatorio=relatorio,
+                                          progresso=lambda parcial: self._atualizar(job_id, **parcial))
+                self._atualizar(job_id, status="concluido", **resumo)
+        except Exception as e:
+            logging.error(f"[CUBAGEM] Falha na importação {job_id}: {e}")
+            self._atualizar(job_id, status="erro", mensagem=str(e))
+        finally:
+            if apagar_ao_final:
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+
+importacoes_cubagem = ImportacoesCubagem()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa a cubagem dos itens (CSV ou XLSX) para o Itens.db.")
+    parser.add_argument("arquivo")
+    parser.add_argument("--lote", type=int, default=CUBAGEM_IMPORTACAO_LOTE, help="linhas por transação")
+    parser.add_argument("--relatorio", default="cubagem_pendencias.csv",
+                        help="CSV com as linhas inválidas e os itens ainda incompletos")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    resultado = importar_arquivo(args.arquivo, lote=args.lote, relatorio=args.relatorio)
+    print(f"Linhas lidas: {resultado['lidas']}  gravadas: {resultado['gravadas']}  "
+          f"inválidas: {resultado['invalidas']}  itens incompletos: {resultado['incompletos']}  "
+          f"({resultado['duracao_s']}s)")
+    print(f"Relatório: {args.relatorio}")
@@ -0,0 +1,272 @@
+import os
+import re
+import time
+import bisect
+import logging
+import threading
+
+
+INDICE_ARMAZENS = [a.strip() for a in os.environ.get('INDICE_ARMAZENS', '').split(',') if a.strip()]
+INDICE_INTERVALO_DELTA = float(os.environ.get('INDICE_INTERVALO_DELTA', '30'))
+INDICE_INTERVALO_COMPLETO = float(os.environ.get('INDICE_INTERVALO_COMPLETO', '900'))
+INDICE_IDADE_MAXIMA = float(os.environ.get('INDICE_IDADE_MAXIMA', '120'))
+INDICE_RESERVA_TTL = float(os.environ.get('INDICE_RESERVA_TTL', '7200'))
+
+# Armazéns descobertos pelas consultas aguardando validação no cadastro, por ciclo
+_MAX_PENDENTES = 8
+
+
+class IndiceLocacoes:
+    """
+    Índice em memória das locações vazias por armazém e zona, ordenadas por altura.
+    O cadastro (ILE) é recarregado periodicamente e a ocupação (IULM) é sincronizada
+    por diferença; reservas feitas por este processo são aplicadas localmente.
+    """
+
+    def __init__(self, carregar_mestre, carregar_ocupadas, armazens=None,
+                 intervalo_delta=INDICE_INTERVALO_DELTA, intervalo_completo=INDICE_INTERVALO_COMPLETO,
+                 idade_maxima=INDICE_IDADE_MAXIMA, reserva_ttl=INDICE_RESERVA_TTL):
+        # carregar_mestre(armazem) -> [(loc, zona, altura)]
+        # carregar_ocupadas(armazem) -> iterável de loc
+        self._carregar_mestre = carregar_mestre
+        self._carregar_ocupadas = carregar_ocupadas
+        self.intervalo_delta = intervalo_delta
+        self.intervalo_completo = intervalo_completo
+        self.idade_maxima = idade_maxima
+        self.reserva_ttl = reserva_ttl
+
+        self._lock = threading.RLock()
+        self._armazens = set(armazens or [])
+        self._configurados = frozenset(self._armazens)
+        self._pendentes = set()   # códigos vindos das consultas, ainda não confirmados na ILE
+        self._recusados = {}      # armazem -> monotonic da recusa (sem locações na ILE)
+        self._mestre = {}         # armazem -> {loc: (zona, altura)}
+        self._livres = {}         # (armazem, zona) -> [(altura, loc)] ordenado
+        self._ocupadas = {}       # armazem -> set(loc)
+        self._reservadas = {}     # armazem -> {loc: expira_em}
+        self._sincronizado_em = {}  # armazem -> monotonic da última sincronização
+        self._mestre_em = {}        # armazem -> monotonic da última carga do cadastro
+        self._thread = None
+        self._pid = os.getpid()
+        self.stats = {"consultas": 0, "acertos": 0, "desatualizado": 0, "syncs": 0, "falhas_sync": 0}
+
+    # ---------- Consulta ----------
+    def atualizado(self, armazem):
+        sincronizado_em = self._sincronizado_em.get(armazem)
+        return sincronizado_em is not None and time.monotonic() - sincronizado_em <= self.idade_maxima
+
+    def buscar(self, armazem, zonas, altura_min, excluir=()):
+        """
+        Menor locação com altura >= altura_min, respeitando a ordem das zonas.
+        Retorna (loc, zona, altura), (None, None, None) se não houver, ou None se o índice
+        do armazém estiver desatualizado (o chamador deve consultar o AS400).
+        """
+        self._garantir_processo()
+        self.registrar_armazem(armazem)
+        with self._lock:
+            self.stats["consultas"] += 1
+            if not self.atualizado(armazem):
+                self.stats["desatualizado"] += 1
+                return None
+
+            excluir = set(excluir or ())
+            reservadas = self._reservadas_validas(armazem)
+            for zona in zonas:
+                lista = self._livres.get((armazem, zona.upper()))
+                if not lista:
+                    continue
+                i = bisect.bisect_left(lista, (altura_min, ''))
+                while i < len(lista):
+                    altura, loc = lista[i]
+                    i += 1
+                    if loc in excluir or loc in reservadas:
+                        continue
+                    self.stats["acertos"] += 1
+                    return loc, zona.upper(), altura
+            return None, None, None
+
+    def listar_livres(self, armazem, zonas):
+        """
+        Todas as locações livres (loc, zona, altura) das zonas, sem as reservadas localmente,
+        ou None se o índice do armazém estiver desatualizado.
+        """
+        self._garantir_processo()
+        self.registrar_armazem(armazem)
+        with self._lock:
+            if not self.atualizado(armazem):
+                self.stats["desatualizado"] += 1
+                return None
+            reservadas = self._reservadas_validas(armazem)
+            return [
+                (loc, zona.upper(), altura)
+                for zona in zonas
+                for altura, loc in self._livres.get((armazem, zona.upper()), ())
+                if loc not in reservadas
+            ]
+
+    # ---------- Reservas locais ----------
+    def reservar(self, armazem, loc, ttl=None):
+        with self._lock:
+            expira_em = time.monotonic() + (self.reserva_ttl if ttl is None else ttl)
+            self._reservadas.setdefault(armazem, {})[loc] = expira_em
+
+    def liberar(self, armazem, loc):
+        with self._lock:
+            self._reservadas.get(armazem, {}).pop(loc, None)
+
+    def _reservadas_validas(self, armazem):
+        reservadas = self._reservadas.get(armazem)
+        if not reservadas:
+            return {}
+        agora = time.monotonic()
+        for loc in [loc for loc, expira_em in reservadas.items() if expira_em < agora]:
+            del reservadas[loc]
+        return reservadas
+
+    # ---------- Sincronização ----------
+    def registrar_armazem(self, armazem):
+        """
+        Com INDICE_ARMAZENS configurado só esses armazéns são sincronizados. Sem ele, o código
+        consultado entra na fila de validação e só passa a ser sincronizado se existir na ILE.
+        """
+        if not armazem or armazem in self._armazens or self._configurados:
+            return
+        if not re.fullmatch(r"[A-Za-z0-9]{1,10}", armazem):
+            return
+        with self._lock:
+            if armazem in self._pendentes or len(self._pendentes) >= _MAX_PENDENTES:
+                return
+            if time.monotonic() - self._recusados.get(armazem, float('-inf')) <= self.intervalo_completo:
+                return
+            self._pendentes.add(armazem)
+        self.iniciar()
+
+    def _validar_pendentes(self):
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, set()
+            limite = time.monotonic() - self.intervalo_completo
+            for armazem in [a for a, recusado_em in self._recusados.items() if recusado_em < limite]:
+                del self._recusados[armazem]
+        for armazem in pendentes:
+            try:
+                self.sincronizar(armazem, completo=True)
+            except Exception as e:
+                self.stats["falhas_sync"] += 1
+                logging.error(f"[INDICE] Falha ao validar armazém {armazem}: {e}")
+                self._descartar(armazem)
+                continue
+            with self._lock:
+                if self._mestre.get(armazem):
+                    self._armazens.add(armazem)
+                    continue
+            logging.warning(f"[INDICE] Armazém {armazem} sem locações na ILE; não será sincronizado.")
+            self._descartar(armazem)
+            with self._lock:
+                self._recusados[armazem] = time.monotonic()
+
+    def _descartar(self, armazem):
+        with self._lock:
+            for chave in [c for c in self._livres if c[0] == armazem]:
+                del self._livres[chave]
+            for dados in (self._mestre, self._ocupadas, self._mestre_em, self._sincronizado_em):
+                dados.pop(armazem, None)
+
+    def sincronizar(self, armazem, completo=False):
+        agora = time.monotonic()
+        if completo or armazem not in self._mestre:
+            mestre = {loc: (str(zona).strip().upper(), round(float(altura), 2))
+                      for loc, zona, altura in self._carregar_mestre(armazem)}
+            ocupadas = set(self._carregar_ocupadas(armazem))
+            livres = {}
+            for loc, (zona, altura) in mestre.items():
+                if loc not in ocupadas:
+                    livres.setdefault((armazem, zona), []).append((altura, loc))
+            with self._lock:
+                for chave in [c for c in self._livres if c[0] == armazem]:
+                    del self._livres[chave]
+                for chave, lista in livres.items():
+                    lista.sort()
+                    self._livres[chave] = lista
+                self._mestre[armazem] = mestre
+                self._ocupadas[armazem] = ocupadas
+                self._mestre_em[armazem] = agora
+                self._sincronizado_em[armazem] = agora
+            logging.info(f"[INDICE] Armazém {armazem}: {len(mestre)} locações, {len(mestre) - len(ocupadas & mestre.keys())} livres.")
+        else:
+            ocupadas = set(self._carregar_ocupadas(armazem))
+            with self._lock:
+                anteriores = self._ocupadas.get(armazem, set())
+                mestre = self._mestre[armazem]
+                for loc in ocupadas - anteriores:
+                    self._remover_livre(armazem, loc, mestre)
+                for loc in anteriores - ocupadas:
+                    self._inserir_livre(armazem, loc, mestre)
+                self._ocupadas[armazem] = ocupadas
+                self._sincronizado_em[armazem] = agora
+        self.stats["syncs"] += 1
+
+    def _remover_livre(self, armazem, loc, mestre):
+        if loc not in mestre:
+            return
+        zona, altura = mestre[loc]
+        lista = self._livres.get((armazem, zona), [])
+        i = bisect.bisect_left(lista, (altura, loc))
+        if i < len(lista) and lista[i] == (altura, loc):
+            del lista[i]
+        # Ocupação confirmada no AS400: a reserva local já foi consumida
+        self._reservadas.get(armazem, {}).pop(loc, None)
+
+    def _inserir_livre(self, armazem, loc, mestre):
+        if loc not in mestre:
+            return
+        zona, altura = mestre[loc]
+        lista = self._livres.setdefault((armazem, zona), [])
+        i = bisect.bisect_left(lista, (altura, loc))
+        if i >= len(lista) or lista[i] != (altura, loc):
+            lista.insert(i, (altura, loc))
+
+    def iniciar(self):
+        self._garantir_processo()
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="indice-locacoes", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            for armazem in list(self._armazens):
+                completo = time.monotonic() - self._mestre_em.get(armazem, float('-inf')) > self.intervalo_completo
+                try:
+                    self.sincronizar(armazem, completo=completo)
+                except Exception as e:
+                    self.stats["falhas_sync"] += 1
+                    logging.error(f"[INDICE] Falha ao sincronizar armazém {armazem}: {e}")
+            self._validar_pendentes()
+            time.sleep(self.intervalo_delta)
+
+    def _garantir_processo(self):
+        # Após fork, a thread de sincronização não existe no processo filho
+        if self._pid != os.getpid():
+            self._lock = threading.RLock()
+            self._thread = None
+            self._pid = os.getpid()
+
+    def status(self):
+        with self._lock:
+            agora = time.monotonic()
+            return {
+                "armazens": {
+                    armazem: {
+                        "livres": sum(len(l) for (a, _), l in self._livres.items() if a == armazem),
+                        "reservadas": len(self._reservadas.get(armazem, {})),
+                        "idade_segundos": round(agora - self._sincronizado_em[armazem], 1)
+                        if armazem in self._sincronizado_em else None,
+                        "atualizado": self.atualizado(armazem),
+                    }
+                    for armazem in sorted(self._armazens)
+                },
+                **self.stats,
+            }
@@ -0,0 +1,350 @@
+"""
+Ocupação dos armazéns por zona e faixa de altura.
+
+Uma thread captura periodicamente o cadastro de locações (ILE) e as ocupadas (IULM) de cada
+armazém e grava um arquivo .npz por captura em OCUPACAO_DIR: colunas compactas por locação
+(código, zona, altura em cm, ocupada) e os totais por zona x faixa já agregados, que bastam
+para a tendência sem reler as colunas. O painel cruza a última captura com os recebimentos
+do diário para medir capacidade livre, cobertura por faixa de altura e desencaixe (pallets
+guardados fora da zona preferida ou com muita sobra de altura), tudo com agregação vetorizada
+em NumPy e em cache por OCUPACAO_CACHE_TTL segundos.
+"""
+import os
+import re
+import glob
+import time
+import logging
+import threading
+
+from cache import CacheLRU
+from alturas import FAIXAS_ZONAS
+from telemetria import span
+from database import (BPCS_SERVICO_UID, BPCS_SERVICO_PWD, INDICE_ARMAZENS, carregar_locacoes_cadastro,
+                      carregar_locacoes_ocupadas, calcular_altura_item)
+from diario_recebimento import diario_recebimento
+
+
+OCUPACAO_DIR = os.environ.get(
+    'OCUPACAO_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ocupacao'))
+OCUPACAO_INTERVALO = float(os.environ.get('OCUPACAO_INTERVALO', '900'))
+OCUPACAO_ARMAZENS = [a.strip() for a in os.environ.get('OCUPACAO_ARMAZENS', '').split(',') if a.strip()] \
+    or INDICE_ARMAZENS
+OCUPACAO_RETENCAO_DIAS = float(os.environ.get('OCUPACAO_RETENCAO_DIAS', '30'))
+OCUPACAO_CACHE_TTL = float(os.environ.get('OCUPACAO_CACHE_TTL', '60'))
+OCUPACAO_JANELA_HORAS = float(os.environ.get('OCUPACAO_JANELA_HORAS', '24'))
+OCUPACAO_ALERTA = float(os.environ.get('OCUPACAO_ALERTA', '0.9'))
+OCUPACAO_TENDENCIA = 96   # capturas na série do painel (24 h com o intervalo padrão)
+
+# Limites das faixas de altura: os mesmos de ZONAS_POR_ALTURA (sem o '*')
+LIMITES_FAIXAS = [limite for limite, _ in FAIXAS_ZONAS if limite != float('inf')]
+
+
+def nomes_faixas():
+    nomes, anterior = [], 0.0
+    for limite in LIMITES_FAIXAS:
+        nomes.append(f"{anterior:.2f}-{limite:.2f}")
+        anterior = limite
+    nomes.append(f">{anterior:.2f}")
+    return nomes
+
+
+def validar_armazem(armazem):
+    # O código vira parte do nome do arquivo da captura
+    armazem = str(armazem or "").strip()
+    if not re.fullmatch(r"[A-Za-z0-9]{1,10}", armazem):
+        raise ValueError("Armazém inválido.")
+    return armazem
+
+
+def _arquivo(armazem, ts):
+    return os.path.join(OCUPACAO_DIR, f"ocupacao_{armazem}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(ts))}.npz")
+
+
+def _agregar(zona_cod, faixa, ocupada, altura_cm, n_zonas):
+    """Totais por zona x faixa com um bincount por métrica (sem laço por locação)."""
+    import numpy as np
+    n_faixas = len(LIMITES_FAIXAS) + 1
+    grupo = zona_cod.astype(np.int64) * n_faixas + faixa
+    tamanho = n_zonas * n_faixas
+    forma = (n_zonas, n_faixas)
+    total = np.bincount(grupo, minlength=tamanho).reshape(forma)
+    ocupadas = np.bincount(grupo, weights=ocupada, minlength=tamanho).astype(np.int64).reshape(forma)
+    cm_livres = np.bincount(grupo, weights=np.where(ocupada, 0, altura_cm), minlength=tamanho).reshape(forma)
+    return total, ocupadas, cm_livres
+
+
+class AnaliseOcupacao:
+    """Capturas periódicas em .npz e painel de ocupação calculado sob demanda, com cache."""
+
+    def __init__(self, diretorio=OCUPACAO_DIR, intervalo=OCUPACAO_INTERVALO, armazens=OCUPACAO_ARMAZENS):
+        self.diretorio = diretorio
+        self.intervalo = intervalo
+        self.armazens = list(armazens)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = os.getpid()
+        self._cache_capturas = CacheLRU(max_itens=OCUPACAO_TENDENCIA + 8, ttl=OCUPACAO_INTERVALO * 2)
+        self._cache_painel = CacheLRU(max_itens=64, ttl=OCUPACAO_CACHE_TTL)
+        self.stats = {"capturas": 0, "falhas": 0, "removidas": 0}
+
+    # ---------- Captura ----------
+    def capturar(self, armazem, credenciais=None):
+        """Lê ILE/IULM do armazém e grava uma captura. Retorna o caminho do arquivo."""
+        import numpy as np
+        armazem = validar_armazem(armazem)
+        with span("ocupacao_captura", armazem=armazem):
+            cadastro = carregar_locacoes_cadastro(armazem, credenciais)
+            ocupadas_as400 = set(carregar_locacoes_ocupadas(armazem, credenciais))
+
+            ts = time.time()
+            locs = np.array([str(loc).strip() for loc, _, _ in cadastro], dtype=str)
+            zonas_loc = np.array([str(zona).strip().upper() for _, zona, _ in cadastro], dtype=str)
+            altura_cm = np.rint(np.array([float(altura or 0) for _, _, altura in cadastro]) * 100).astype(np.uint16)
+            ocupada = np.array([str(loc).strip() in ocupadas_as400 for loc, _, _ in cadastro], dtype=bool)
+
+            zonas, zona_cod = np.unique(zonas_loc, return_inverse=True)
+            ordem = np.argsort(locs, kind="stable")   # ordenado por código: busca por searchsorted
+            locs, zona_cod, altura_cm, ocupada = locs[ordem], zona_cod[ordem].astype(np.uint8), altura_cm[ordem], ocupada[ordem]
+            faixa = np.searchsorted(LIMITES_FAIXAS, altura_cm / 100.0, side="left")
+            total, ocupadas, cm_livres = _agregar(zona_cod, faixa, ocupada, altura_cm, len(zonas))
+
+            os.makedirs(self.diretorio, exist_ok=True)
+            caminho = _arquivo(armazem, ts)
+            temporario = f"{caminho}.{os.getpid()}.tmp"
+            with open(temporario, "wb") as f:
+                np.savez_compressed(
+                    f, ts=np.float64(ts), armazem=np.array(armazem), zonas=zonas, limites=np.array(LIMITES_FAIXAS),
+                    loc=locs, zona=zona_cod, altura_cm=altura_cm, ocupada=ocupada,
+                    agg_total=total, agg_ocupadas=ocupadas, agg_cm_livres=cm_livres,
+                )
+            os.replace(temporario, caminho)
+        # Duas capturas no mesmo segundo usam o mesmo arquivo: nada do anterior pode ficar em cache
+        self._cache_capturas.invalidate((caminho, True))
+        self._cache_capturas.invalidate((caminho, False))
+        self._cache_painel.clear()
+
+        with self._lock:
+            self.stats["capturas"] += 1
+        logging.info(f"[OCUPACAO] Armazém {armazem}: {len(locs)} locações, {int(ocupada.sum())} ocupadas.")
+        self._remover_antigas(armazem)
+        return caminho
+
+    def _remover_antigas(self, armazem):
+        limite = time.time() - OCUPACAO_RETENCAO_DIAS * 86400
+        for caminho in self._arquivos(armazem):
+            if os.path.getmtime(caminho) >= limite:
+                break
+            try:
+                os.remove(caminho)
+                with self._lock:
+                    self.stats["removidas"] += 1
+            except OSError:
+                pass
+
+    def _arquivos(self, armazem):
+        # Nome com data/hora: a ordem alfabética é a cronológica
+        return sorted(glob.glob(os.path.join(self.diretorio, f"ocupacao_{glob.escape(armazem)}_*.npz")))
+
+    def _carregar(self, caminho, colunas=True):
+        import numpy as np
+        chave = (caminho, colunas)
+        dados = self._cache_capturas.get(chave)
+        if dados is None:
+            with np.load(caminho) as npz:
+                nomes = npz.files if colunas else [n for n in npz.files if n not in ("loc", "zona", "altura_cm", "ocupada")]
+                dados = {nome: npz[nome] for nome in nomes}
+            self._cache_capturas.set(chave, dados)
+        return dados
+
+    # ---------- Painel ----------
+    def painel(self, armazem, janela_horas=OCUPACAO_JANELA_HORAS):
+        """Painel da última captura do armazém (None se ainda não houver captura)."""
+        armazem = validar_armazem(armazem)
+        arquivos = self._arquivos(armazem)
+        if not arquivos:
+            return None
+        chave = (armazem, arquivos[-1], float(janela_horas))
+        painel = self._cache_painel.get(chave)
+        if painel is None:
+            with span("ocupacao_painel", armazem=armazem):
+                painel = self._montar_painel(armazem, arquivos, float(janela_horas))
+            self._cache_painel.set(chave, painel)
+        return painel
+
+    def _montar_painel(self, armazem, arquivos, janela_horas):
+        captura = self._carregar(arquivos[-1])
+        zonas = [str(z) for z in captura["zonas"]]
+        faixas = nomes_faixas()
+        total, ocupadas = captura["agg_total"], captura["agg_ocupadas"]
+        livres = total - ocupadas
+        m_livres = captura["agg_cm_livres"] / 100.0
+
+        por_zona = {}
+        for i, zona in enumerate(zonas):
+            total_zona = int(total[i].sum())
+            taxa = float(ocupadas[i].sum() / total_zona) if total_zona else 0.0
+            por_zona[zona] = {
+                "total": total_zona,
+                "ocupadas": int(ocupadas[i].sum()),
+                "livres": int(livres[i].sum()),
+                "taxa_ocupacao": round(taxa, 4),
+                "metros_livres": round(float(m_livres[i].sum()), 2),
+                "livres_por_faixa": dict(zip(faixas, livres[i].tolist())),
+                "alerta": taxa >= OCUPACAO_ALERTA,
+            }
+
+        demanda, desencaixe = self._desencaixe(armazem, captura, zonas, janela_horas)
+        livres_faixa = livres.sum(axis=0)
+        cobertura = {}
+        for j, faixa in enumerate(faixas):
+            # Locações livres que comportam a faixa (mesma faixa ou mais altas), em qualquer zona
+            capacidade = int(livres_faixa[j:].sum())
+            por_hora = demanda[j] / janela_horas if janela_horas else 0.0
+            cobertura[faixa] = {
+                "pallets_na_janela": int(demanda[j]),
+                "livres_que_comportam": capacidade,
+                "horas_de_cobertura": round(capacidade / por_hora, 1) if por_hora else None,
+            }
+
+        return {
+            "armazem": armazem,
+            "capturado_em": float(captura["ts"]),
+            "idade_segundos": round(time.time() - float(captura["ts"]), 1),
+            "janela_horas": janela_horas,
+            "faixas": faixas,
+            "zonas": por_zona,
+            "cobertura_por_faixa": cobertura,
+            "desencaixe": desencaixe,
+            "tendencia": self._tendencia(arquivos[-OCUPACAO_TENDENCIA:]),
+            "alertas": [f"Zona {zona} com {dados['taxa_ocupacao']:.0%} de ocupação."
+                        for zona, dados in por_zona.items() if dados["alerta"]],
+        }
+
+    def _desencaixe(self, armazem, captura, zonas, janela_horas):
+        """
+        Recebimentos da janela cruzados com a captura: altura necessária x altura da locação
+        usada e zona usada x zona preferida (primeira de zonas_por_altura).
+        """
+        import numpy as np
+        n_faixas = len(LIMITES_FAIXAS) + 1
+        registros = list(diario_recebimento.recebimentos_periodo(armazem, time.time() - janela_horas * 3600))
+
+        # Altura calculada uma vez por (item, volume); o resto é vetorizado
+        alturas = {}
+        necessaria, preferida, usada, locs = [], [], [], []
+        for item, volume, locacao, zona in registros:
+            try:
+                chave = (item, float(volume))
+            except (TypeError, ValueError):
+                continue
+            if chave not in alturas:
+                alturas[chave] = calcular_altura_item(*chave)
+            resultado = alturas[chave]
+            if not resultado:
+                continue
+            necessaria.append(resultado[0])
+            preferida.append(resultado[1][0])
+            usada.append(str(zona or "").upper())
+            locs.append(str(locacao or "").strip())
+
+        demanda = np.zeros(n_faixas, dtype=np.int64)
+        if not necessaria:
+            return demanda, {"pallets": 0, "por_zona": {}, "preferida_x_usada": {}}
+
+        necessaria = np.array(necessaria)
+        preferida = np.array(preferida, dtype=str)
+        usada = np.array(usada, dtype=str)
+        demanda = np.bincount(np.searchsorted(LIMITES_FAIXAS, necessaria, side="left"), minlength=n_faixas)
+
+        # Altura da locação usada pela busca binária no cadastro ordenado da captura
+        locs = np.array(locs, dtype=str)
+        cad_locs, cad_altura = captura["loc"], captura["altura_cm"] / 100.0
+        sobra = np.full(len(locs), np.nan)
+        if len(cad_locs):
+            pos = np.minimum(np.searchsorted(cad_locs, locs), len(cad_locs) - 1)
+            encontrada = cad_locs[pos] == locs
+            sobra[encontrada] = cad_altura[pos[encontrada]] - necessaria[encontrada]
+        fora = preferida != usada
+
+        por_zona = {}
+        for zona in np.unique(usada):
+            filtro = usada == zona
+            sobras = sobra[filtro & ~np.isnan(sobra)]
+            por_zona[str(zona)] = {
+                "pallets": int(filtro.sum()),
+                "fora_da_zona_preferida": int((filtro & fora).sum()),
+                "sobra_media_m": round(float(sobras.mean()), 3) if len(sobras) else None,
+                "sobra_p90_m": round(float(np.percentile(sobras, 90)), 3) if len(sobras) else None,
+            }
+
+        pares, contagem = np.unique(np.char.add(np.char.add(preferida[fora], "|"), usada[fora]), return_counts=True)
+        matriz = {}
+        for par, n in zip(pares.tolist(), contagem.tolist()):
+            de, _, para = par.partition("|")
+            matriz.setdefault(de, {})[para] = int(n)
+
+        return demanda, {
+            "pallets": int(len(necessaria)),
+            "fora_da_zona_preferida": int(fora.sum()),
+            "por_zona": por_zona,
+            "preferida_x_usada": matriz,
+        }
+
+    def _tendencia(self, arquivos):
+        serie = []
+        for caminho in arquivos:
+            try:
+                captura = self._carregar(caminho, colunas=False)
+            except (OSError, ValueError) as e:
+                logging.warning(f"[OCUPACAO] Captura ilegível ignorada ({caminho}): {e}")
+                continue
+            total = captura["agg_total"].sum(axis=1)
+            ocupadas = captura["agg_ocupadas"].sum(axis=1)
+            serie.append({
+                "ts": float(captura["ts"]),
+                "taxa_ocupacao": {str(z): round(float(o / t), 4) if t else 0.0
+                                  for z, o, t in zip(captura["zonas"], ocupadas, total)},
+            })
+        return serie
+
+    # ---------- Thread de captura ----------
+    def iniciar(self):
+        """Capturas periódicas dos armazéns configurados (precisa do usuário de serviço)."""
+        if not (BPCS_SERVICO_UID and BPCS_SERVICO_PWD and self.armazens):
+            return False
+        self._garantir_processo()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="ocupacao", daemon=True)
+                self._thread.start()
+        return True
+
+    def _loop(self):
+        while True:
+            for armazem in self.armazens:
+                arquivos = self._arquivos(armazem)
+                # Com vários workers, quem acordar depois aproveita a captura recente do outro
+                if arquivos and time.time() - os.path.getmtime(arquivos[-1]) < self.intervalo * 0.9:
+                    continue
+                try:
+                    self.capturar(armazem)
+                except Exception as e:
+                    with self._lock:
+                        self.stats["falhas"] += 1
+                    logging.error(f"[OCUPACAO] Falha ao capturar o armazém {armazem}: {e}")
+            time.sleep(self.intervalo)
+
+    def _garantir_processo(self):
+        # Após fork, a thread de captura não existe no processo filho
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._thread = None
+            self._pid = os.getpid()
+
+    def status(self):
+        with self._lock:
+            return {**self.stats, "ativa": self._thread is not None and self._pid == os.getpid(),
+                    "armazens": self.armazens, "intervalo": self.intervalo}
+
+
+analise_ocupacao = AnaliseOcupacao()
@@ -0,0 +1,95 @@
+import logging
+
+from alturas import ALTURA_PALLET
+
+
+def calcular_alturas(volumes, cx_lastro, altura_caixa):
+    """
+    Altura necessária de todos os pallets de uma vez, versão vetorizada de
+    alturas.calcular_altura: camadas (volume / Cx_Lastro arredondado para cima) x altura da caixa + pallet.
+    """
+    import numpy as np   # carregado no primeiro planejamento, não na importação do app
+    volumes = np.asarray(volumes, dtype=np.float64)
+    cx_lastro = np.asarray(cx_lastro, dtype=np.float64)
+    altura_caixa = np.asarray(altura_caixa, dtype=np.float64)
+    alturas = np.ceil(volumes / cx_lastro) * altura_caixa + ALTURA_PALLET
+    # round() do Python (e não np.round) para bater centavo a centavo com a busca unitária
+    return np.array([round(altura, 2) for altura in alturas.tolist()], dtype=np.float64)
+
+
+class _ProximoLivre:
+    """
+    Union-find sobre as locações de uma zona ordenadas por altura: encontrar(i) devolve
+    a primeira locação ainda livre a partir de i; ocupar(i) a liga à seguinte.
+    """
+
+    def __init__(self, tamanho):
+        self.pai = list(range(tamanho + 1))   # posição extra = "não há mais livres"
+
+    def encontrar(self, i):
+        raiz = i
+        while self.pai[raiz] != raiz:
+            raiz = self.pai[raiz]
+        while self.pai[i] != raiz:
+            self.pai[i], i = raiz, self.pai[i]
+        return raiz
+
+    def ocupar(self, i):
+        self.pai[i] = i + 1
+
+
+def planejar(alturas, zonas_por_palete, locacoes, tomar=None):
+    """
+    Distribui os pallets de um recebimento nas locações livres (best-fit decreasing).
+
+    alturas: altura necessária de cada pallet (ver calcular_alturas).
+    zonas_por_palete: lista de zonas aceitas por pallet, em ordem de prioridade.
+    locacoes: candidatas (loc, zona, altura), lidas uma única vez.
+    tomar: função opcional loc -> bool chamada antes de confirmar cada escolha
+           (reserva); se recusar, a locação é descartada e a próxima é tentada.
+
+    Os pallets mais altos escolhem primeiro e cada um fica com a menor locação que o
+    comporta na zona de maior prioridade que ainda tiver espaço, o que minimiza a
+    sobra de altura e evita que um pallet baixo ocupe a vaga de que um alto precisava.
+    Retorna, na ordem dos pallets, (loc, zona, altura_locacao) ou None.
+    """
+    import numpy as np
+    alturas = np.asarray(alturas, dtype=np.float64)
+    resultado = [None] * len(alturas)
+    if not len(alturas) or not locacoes:
+        return resultado
+
+    nomes = np.array([l[0] for l in locacoes], dtype=object)
+    zonas_loc = np.array([str(l[1]).upper() for l in locacoes], dtype=object)
+    alturas_loc = np.array([float(l[2]) for l in locacoes], dtype=np.float64)
+
+    # Por zona: locações ordenadas por altura e, para todos os pallets de uma vez,
+    # a posição da primeira locação com altura suficiente
+    grupos = {}
+    for zona in np.unique(zonas_loc):
+        indices = np.flatnonzero(zonas_loc == zona)
+        ordem = indices[np.lexsort((nomes[indices].astype(str), alturas_loc[indices]))]
+        alturas_zona = alturas_loc[ordem]
+        inicio = np.searchsorted(alturas_zona, alturas - 1e-9, side="left")
+        grupos[zona] = (ordem, alturas_zona, inicio, _ProximoLivre(len(ordem)))
+
+    for p in np.argsort(-alturas, kind="stable"):
+        for zona in zonas_por_palete[p]:
+            grupo = grupos.get(str(zona).upper())
+            if grupo is None:
+                continue
+            ordem, alturas_zona, inicio, livres = grupo
+            i = livres.encontrar(int(inicio[p]))
+            while i < len(ordem):
+                livres.ocupar(i)
+                loc = nomes[ordem[i]]
+                if tomar is None or tomar(loc):
+                    resultado[p] = (loc, str(zona).upper(), float(alturas_zona[i]))
+                    break
+                i = livres.encontrar(i)
+            if resultado[p] is not None:
+                break
+
+    alocados = sum(1 for r in resultado if r is not None)
+    logging.info(f"[PLANEJADOR] {alocados} de {len(resultado)} pallets alocados em {len(locacoes)} locações candidatas.")
+    return resultado
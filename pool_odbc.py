@@ -0,0 +1,245 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from telemetria import span
+
+
+# Configurações do pool (podem ser ajustadas via .env)
+POOL_MAX_POR_USUARIO = int(os.environ.get('ODBC_POOL_MAX_POR_USUARIO', '4'))
+POOL_TEMPO_OCIOSO = float(os.environ.get('ODBC_POOL_TEMPO_OCIOSO', '300'))
+POOL_TEMPO_VIDA = float(os.environ.get('ODBC_POOL_TEMPO_VIDA', '1800'))
+POOL_VERIFICAR_APOS = float(os.environ.get('ODBC_POOL_VERIFICAR_APOS', '30'))
+POOL_ESPERA_MAXIMA = float(os.environ.get('ODBC_POOL_ESPERA_MAXIMA', '10'))
+
+QUERY_HEALTH_CHECK = "SELECT 1 FROM SYSIBM.SYSDUMMY1"
+
+
+class PoolEsgotado(ConnectionError):
+    pass
+
+
+def abrir_conexao_odbc(uid, pwd):
+    import pyodbc   # driver carregado na primeira conexão, não na importação do app
+    try:
+        with span("odbc_conectar", uid=uid):
+            return pyodbc.connect(
+                f'DRIVER={{iSeries Access ODBC Driver}};'
+                f'SYSTEM=US400BR;'
+                f'UID={uid};'
+                f'PWD={pwd}'
+            )
+    except Exception as e:
+        logging.error(f"[ERRO ODBC] Conexão ODBC falhou: {e}")
+        raise
+
+
+class _ConexaoPool:
+    __slots__ = ("con", "criada_em", "usada_em")
+
+    def __init__(self, con):
+        agora = time.monotonic()
+        self.con = con
+        self.criada_em = agora
+        self.usada_em = agora
+
+
+class PoolODBC:
+    """
+    Pool de conexões ODBC com o AS400, separado por UPIN.
+    Mantém conexões aquecidas, valida antes de reutilizar, recicla as antigas
+    e descarta as ociosas.
+    """
+
+    def __init__(self, conectar=abrir_conexao_odbc, max_por_usuario=POOL_MAX_POR_USUARIO,
+                 tempo_ocioso=POOL_TEMPO_OCIOSO, tempo_vida=POOL_TEMPO_VIDA,
+                 verificar_apos=POOL_VERIFICAR_APOS, espera_maxima=POOL_ESPERA_MAXIMA):
+        self._conectar = conectar
+        self.max_por_usuario = max_por_usuario
+        self.tempo_ocioso = tempo_ocioso
+        self.tempo_vida = tempo_vida
+        self.verificar_apos = verificar_apos
+        self.espera_maxima = espera_maxima
+
+        self._lock = threading.Condition()
+        self._livres = {}       # upin -> [_ConexaoPool]
+        self._em_uso = {}       # upin -> quantidade emprestada
+        self._senhas = {}       # upin -> senha usada nas conexões livres
+        self._limpador = None
+        self._pid = os.getpid()
+
+        self.stats = {"criadas": 0, "reutilizadas": 0, "descartadas": 0, "falhas_health_check": 0}
+
+    # ---------- Empréstimo / devolução ----------
+    @contextmanager
+    def conexao(self, uid, pwd):
+        entrada = self._emprestar(uid, pwd)
+        try:
+            yield entrada.con
+        except Exception:
+            # Conexão pode ter ficado em estado inválido; não volta para o pool
+            self._devolver(uid, entrada, descartar=True)
+            raise
+        else:
+            self._devolver(uid, entrada)
+
+    def _emprestar(self, uid, pwd):
+        self._garantir_processo()
+        self._iniciar_limpador()
+        limite = time.monotonic() + self.espera_maxima
+
+        with self._lock:
+            # Senha mudou: conexões antigas do usuário não servem mais
+            if self._senhas.get(uid) not in (None, pwd):
+                self._fechar_todas(self._livres.pop(uid, []))
+            self._senhas[uid] = pwd
+
+            while True:
+                livres = self._livres.setdefault(uid, [])
+                if livres:
+                    entrada = livres.pop()
+                    self._em_uso[uid] = self._em_uso.get(uid, 0) + 1
+                    break
+                if self._em_uso.get(uid, 0) < self.max_por_usuario:
+                    entrada = None
+                    self._em_uso[uid] = self._em_uso.get(uid, 0) + 1
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    raise PoolEsgotado("Limite de conexões com o BPCS atingido. Tente novamente.")
+                self._lock.wait(restante)
+
+        try:
+            if entrada is not None:
+                if self._valida(entrada):
+                    self.stats["reutilizadas"] += 1
+                    return entrada
+                self._fechar(entrada)
+
+            entrada = _ConexaoPool(self._conectar(uid, pwd))
+            self.stats["criadas"] += 1
+            return entrada
+        except Exception:
+            with self._lock:
+                self._em_uso[uid] -= 1
+                self._lock.notify()
+            raise
+
+    def _devolver(self, uid, entrada, descartar=False):
+        agora = time.monotonic()
+        with self._lock:
+            self._em_uso[uid] -= 1
+            expirada = agora - entrada.criada_em > self.tempo_vida
+            if descartar or expirada:
+                self._fechar(entrada)
+            else:
+                entrada.usada_em = agora
+                self._livres.setdefault(uid, []).append(entrada)
+            self._lock.notify()
+
+    # ---------- Saúde e reciclagem ----------
+    def _valida(self, entrada):
+        agora = time.monotonic()
+        if agora - entrada.criada_em > self.tempo_vida:
+            return False
+        if agora - entrada.usada_em < self.verificar_apos:
+            return True
+        try:
+            with span("odbc_health_check"):
+                cursor = entrada.con.cursor()
+                cursor.execute(QUERY_HEALTH_CHECK)
+                cursor.fetchone()
+                cursor.close()
+            return True
+        except Exception as e:
+            self.stats["falhas_health_check"] += 1
+            logging.warning(f"[POOL ODBC] Conexão inválida descartada: {e}")
+            return False
+
+    def _fechar(self, entrada):
+        self.stats["descartadas"] += 1
+        try:
+            entrada.con.close()
+        except Exception:
+            pass
+
+    def _fechar_todas(self, entradas):
+        for entrada in entradas:
+            self._fechar(entrada)
+
+    def remover_ociosas(self):
+        agora = time.monotonic()
+        with self._lock:
+            for uid, livres in list(self._livres.items()):
+                manter = []
+                for entrada in livres:
+                    if (agora - entrada.usada_em > self.tempo_ocioso
+                            or agora - entrada.criada_em > self.tempo_vida):
+                        self._fechar(entrada)
+                    else:
+                        manter.append(entrada)
+                if manter:
+                    self._livres[uid] = manter
+                else:
+                    del self._livres[uid]
+                    if not self._em_uso.get(uid):
+                        self._senhas.pop(uid, None)
+
+    def aquecer(self, uid, pwd, quantidade):
+        """Abre até `quantidade` conexões do usuário antes do primeiro uso (ex.: worker recém-criado)."""
+        entradas = []
+        try:
+            for _ in range(min(quantidade, self.max_por_usuario)):
+                entradas.append(self._emprestar(uid, pwd))
+        finally:
+            for entrada in entradas:
+                self._devolver(uid, entrada)
+        return len(entradas)
+
+    def fechar(self):
+        with self._lock:
+            for livres in self._livres.values():
+                self._fechar_todas(livres)
+            self._livres.clear()
+
+    def _iniciar_limpador(self):
+        if self._limpador is not None:
+            return
+        with self._lock:
+            if self._limpador is not None:
+                return
+            self._limpador = threading.Thread(target=self._loop_limpador, name="pool-odbc-limpador", daemon=True)
+            self._limpador.start()
+
+    def _loop_limpador(self):
+        intervalo = max(5.0, min(self.tempo_ocioso, 60.0))
+        while True:
+            time.sleep(intervalo)
+            try:
+                self.remover_ociosas()
+            except Exception as e:
+                logging.error(f"[POOL ODBC] Erro ao remover conexões ociosas: {e}")
+
+    def _garantir_processo(self):
+        # Conexões não podem ser compartilhadas entre processos (fork)
+        if self._pid == os.getpid():
+            return
+        self._lock = threading.Condition()
+        self._livres = {}
+        self._em_uso = {}
+        self._senhas = {}
+        self._limpador = None
+        self._pid = os.getpid()
+
+    def status(self):
+        with self._lock:
+            return {
+                "livres": {uid: len(livres) for uid, livres in self._livres.items() if livres},
+                "em_uso": {uid: n for uid, n in self._em_uso.items() if n},
+                **self.stats,
+            }
+
+
+pool = PoolODBC()
@@ -0,0 +1,122 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+
+from banco_sqlite import BancoSQLite, criar_indice
+from telemetria import span
+
+
+RESERVAS_DB_PATH = os.environ.get('RESERVAS_DB_PATH', 'reservas.db')
+RESERVA_TTL = float(os.environ.get('RESERVA_TTL', '14400'))
+RESERVA_LIMPEZA_INTERVALO = 60
+
+
+def _migrar_reservas_v1(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS reservas_locacao (
+            armazem TEXT NOT NULL,
+            locacao TEXT NOT NULL,
+            dono TEXT NOT NULL,
+            criada_em REAL NOT NULL,
+            expira_em REAL NOT NULL,
+            PRIMARY KEY (armazem, locacao)
+        )
+    """)
+    criar_indice(conn, "reservas_locacao", "expira_em", "idx_reservas_expira")
+    criar_indice(conn, "reservas_locacao", "dono", "idx_reservas_dono")
+
+
+class ReservasLocacao:
+    """
+    Reservas de locação compartilhadas entre sessões, terminais e processos.
+    A reserva é tomada com um único INSERT ... ON CONFLICT atômico: só vence quem
+    encontra a locação livre ou com a reserva expirada.
+    """
+
+    def __init__(self, caminho=RESERVAS_DB_PATH, ttl=RESERVA_TTL):
+        self.banco = BancoSQLite(caminho, migracoes=[(1, _migrar_reservas_v1)], nome="reservas.db")
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._ultima_limpeza = 0.0
+
+    def reivindicar(self, armazem, locacao, dono, ttl=None):
+        """Tenta reservar a locação para o dono. Retorna True se conseguiu."""
+        agora = time.time()
+        expira_em = agora + (self.ttl if ttl is None else ttl)
+        self._limpar_expiradas(agora)
+        with span("sqlite_reserva", armazem=armazem, locacao=locacao), self.banco.transacao() as conn:
+            cur = conn.execute("""
+                INSERT INTO reservas_locacao (armazem, locacao, dono, criada_em, expira_em)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(armazem, locacao) DO UPDATE SET
+                    dono = excluded.dono,
+                    criada_em = excluded.criada_em,
+                    expira_em = excluded.expira_em
+                WHERE reservas_locacao.expira_em < ?
+            """, (armazem, locacao, str(dono), agora, expira_em, agora))
+            return cur.rowcount == 1
+
+    def confirmar(self, armazem, locacao, dono, ttl=None):
+        """Renova a reserva ainda válida do próprio dono (ex.: provisória do prefetch). Retorna True se conseguiu."""
+        agora = time.time()
+        expira_em = agora + (self.ttl if ttl is None else ttl)
+        with self.banco.transacao() as conn:
+            cur = conn.execute("""
+                UPDATE reservas_locacao SET expira_em = ?
+                WHERE armazem = ? AND locacao = ? AND dono = ? AND expira_em >= ?
+            """, (expira_em, armazem, locacao, str(dono), agora))
+            return cur.rowcount == 1
+
+    def liberar(self, armazem, locacao, dono=None, expira_ate=None):
+        """
+        Remove a reserva (só a do dono, se informado). Com expira_ate, só se ela vencer até lá:
+        uma reserva provisória que outra requisição já confirmou (renovou) continua valendo.
+        Retorna True se removeu.
+        """
+        query = "DELETE FROM reservas_locacao WHERE armazem = ? AND locacao = ?"
+        params = [armazem, locacao]
+        if dono is not None:
+            query += " AND dono = ?"
+            params.append(str(dono))
+        if expira_ate is not None:
+            query += " AND expira_em <= ?"
+            params.append(expira_ate)
+        with self.banco.transacao() as conn:
+            return conn.execute(query, params).rowcount > 0
+
+    def reservada(self, armazem, locacao):
+        row = self.banco.consultar_um(
+            "SELECT 1 FROM reservas_locacao WHERE armazem = ? AND locacao = ? AND expira_em >= ?",
+            (armazem, locacao, time.time())
+        )
+        return row is not None
+
+    def reservadas(self, armazem):
+        """Conjunto das locações com reserva válida no armazém (uma consulta só)."""
+        rows = self.banco.consultar(
+            "SELECT locacao FROM reservas_locacao WHERE armazem = ? AND expira_em >= ?",
+            (armazem, time.time())
+        )
+        return {row[0] for row in rows}
+
+    def _limpar_expiradas(self, agora):
+        with self._lock:
+            if agora - self._ultima_limpeza < RESERVA_LIMPEZA_INTERVALO:
+                return
+            self._ultima_limpeza = agora
+        try:
+            with self.banco.transacao() as conn:
+                conn.execute("DELETE FROM reservas_locacao WHERE expira_em < ?", (agora,))
+        except sqlite3.Error as e:
+            logging.warning(f"[RESERVAS] Falha ao remover reservas expiradas: {e}")
+
+    def status(self):
+        ativas = self.banco.consultar_um(
+            "SELECT COUNT(*) FROM reservas_locacao WHERE expira_em >= ?", (time.time(),)
+        )[0]
+        return {"ativas": ativas, "ttl": self.ttl}
+
+
+reservas = ReservasLocacao()
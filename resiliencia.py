@@ -0,0 +1,217 @@
+import os
+import time
+import random
+import logging
+import threading
+
+from pool_odbc import PoolEsgotado
+
+
+RETENTATIVAS_MAX = int(os.environ.get('BPCS_RETENTATIVAS', '3'))
+BACKOFF_BASE = float(os.environ.get('BPCS_BACKOFF_BASE', '0.2'))
+BACKOFF_MAXIMO = float(os.environ.get('BPCS_BACKOFF_MAXIMO', '1.5'))
+# Soma das esperas de uma chamada: a thread da requisição fica parada durante o backoff
+ESPERA_TOTAL_MAXIMA = float(os.environ.get('BPCS_ESPERA_TOTAL', '2'))
+DISJUNTOR_LIMITE_FALHAS = int(os.environ.get('BPCS_DISJUNTOR_FALHAS', '5'))
+DISJUNTOR_TEMPO_ABERTO = float(os.environ.get('BPCS_DISJUNTOR_TEMPO_ABERTO', '30'))
+LIMITADOR_CHAVES_MAX = 10000
+
+# Erros de credencial do iSeries Access: nunca repetir (bloqueariam o usuário)
+ERROS_AUTENTICACAO = {
+    "CWBSY0002": "Senha do BPCS incorreta.",
+    "CWBSY0011": "Usuário BPCS bloqueado ou desativado.",
+}
+
+# SQLSTATE de erros de comando/dados: repetir não adianta e não indica BPCS fora do ar
+SQLSTATE_PERMANENTES = ("42", "22", "23", "21", "07")
+
+AUTENTICACAO = "autenticacao"
+TRANSITORIO = "transitorio"
+PERMANENTE = "permanente"
+LOCAL = "local"
+
+
+class BPCSIndisponivel(ConnectionError):
+    pass
+
+
+def classificar_erro(erro):
+    if isinstance(erro, PoolEsgotado):
+        return LOCAL
+    mensagem = str(erro)
+    if any(codigo in mensagem for codigo in ERROS_AUTENTICACAO):
+        return AUTENTICACAO
+    sqlstate = str(erro.args[0]) if getattr(erro, "args", None) else ""
+    if len(sqlstate) == 5 and sqlstate.startswith(SQLSTATE_PERMANENTES):
+        return PERMANENTE
+    return TRANSITORIO
+
+
+class Disjuntor:
+    """
+    Circuit breaker do BPCS: após N falhas transitórias seguidas abre e falha
+    imediatamente; depois do tempo de espera libera uma chamada de teste (meio aberto).
+    """
+
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    MEIO_ABERTO = "meio_aberto"
+
+    def __init__(self, limite_falhas=DISJUNTOR_LIMITE_FALHAS, tempo_aberto=DISJUNTOR_TEMPO_ABERTO):
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto = tempo_aberto
+        self._lock = threading.Lock()
+        self.estado = self.FECHADO
+        self.falhas_seguidas = 0
+        self.aberto_em = None
+        self._teste_em_andamento = False
+        self.contadores = {
+            "chamadas": 0, "sucessos": 0, "falhas": 0, "retentativas": 0,
+            "rejeitadas": 0, "aberturas": 0, "erros_autenticacao": 0,
+        }
+
+    def permitir(self):
+        with self._lock:
+            self.contadores["chamadas"] += 1
+            if self.estado == self.ABERTO:
+                if time.monotonic() - self.aberto_em < self.tempo_aberto:
+                    self.contadores["rejeitadas"] += 1
+                    return False
+                self.estado = self.MEIO_ABERTO
+            if self.estado == self.MEIO_ABERTO:
+                if self._teste_em_andamento:
+                    self.contadores["rejeitadas"] += 1
+                    return False
+                self._teste_em_andamento = True
+            return True
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self.contadores["sucessos"] += 1
+            if self.estado != self.FECHADO:
+                logging.info("[BPCS] Disjuntor fechado: BPCS respondendo novamente.")
+            self.estado = self.FECHADO
+            self.falhas_seguidas = 0
+            self._teste_em_andamento = False
+
+    def registrar_falha(self):
+        with self._lock:
+            self.contadores["falhas"] += 1
+            self.falhas_seguidas += 1
+            self._teste_em_andamento = False
+            if self.estado == self.MEIO_ABERTO or self.falhas_seguidas >= self.limite_falhas:
+                if self.estado != self.ABERTO:
+                    self.contadores["aberturas"] += 1
+                    logging.error(f"[BPCS] Disjuntor aberto após {self.falhas_seguidas} falhas seguidas.")
+                self.estado = self.ABERTO
+                self.aberto_em = time.monotonic()
+
+    def liberar_teste(self):
+        # Chamada de teste terminou sem dizer nada sobre a saúde do BPCS
+        with self._lock:
+            self._teste_em_andamento = False
+
+    def status(self):
+        with self._lock:
+            return {
+                "estado": self.estado,
+                "falhas_seguidas": self.falhas_seguidas,
+                "reabre_em": round(max(0.0, self.tempo_aberto - (time.monotonic() - self.aberto_em)), 1)
+                if self.estado == self.ABERTO else None,
+                **self.contadores,
+            }
+
+
+disjuntor_bpcs = Disjuntor()
+
+
+class LimitadorTaxa:
+    """
+    Token bucket por chave (ex.: usuário): até `rajada` chamadas seguidas e depois
+    `taxa` chamadas por segundo. permitir() devolve (True, 0) ou (False, segundos de espera).
+    """
+
+    def __init__(self, taxa, rajada, max_chaves=LIMITADOR_CHAVES_MAX):
+        self.taxa = float(taxa)
+        self.rajada = float(rajada)
+        self.max_chaves = max_chaves
+        self._lock = threading.Lock()
+        self._baldes = {}   # chave -> (fichas, instante da última recarga)
+        self.contadores = {"permitidas": 0, "recusadas": 0}
+
+    def permitir(self, chave):
+        agora = time.monotonic()
+        with self._lock:
+            fichas, ultima = self._baldes.get(chave, (self.rajada, agora))
+            fichas = min(self.rajada, fichas + (agora - ultima) * self.taxa)
+            if fichas >= 1:
+                self._baldes[chave] = (fichas - 1, agora)
+                self.contadores["permitidas"] += 1
+                resultado = (True, 0.0)
+            else:
+                self._baldes[chave] = (fichas, agora)
+                self.contadores["recusadas"] += 1
+                resultado = (False, (1 - fichas) / self.taxa if self.taxa > 0 else 60.0)
+            excedeu = len(self._baldes) > self.max_chaves
+        if excedeu:
+            self._descartar_cheios(agora)
+        return resultado
+
+    def _descartar_cheios(self, agora):
+        # Baldes que já recarregaram por completo equivalem a um balde novo
+        with self._lock:
+            for chave, (fichas, ultima) in list(self._baldes.items()):
+                if fichas + (agora - ultima) * self.taxa >= self.rajada:
+                    del self._baldes[chave]
+
+    def status(self):
+        with self._lock:
+            return {"taxa_por_segundo": self.taxa, "rajada": self.rajada,
+                    "chaves": len(self._baldes), **self.contadores}
+
+
+def _espera_backoff(tentativa):
+    # Backoff exponencial com jitter completo
+    return random.uniform(0, min(BACKOFF_MAXIMO, BACKOFF_BASE * (2 ** tentativa)))
+
+
+def executar_bpcs(operacao, descricao="consulta", tentativas=RETENTATIVAS_MAX, disjuntor=disjuntor_bpcs):
+    """
+    Executa uma operação ODBC no BPCS com retentativa, backoff com jitter e disjuntor.
+    Erros de autenticação viram ValueError (sem retentativa); BPCS fora do ar vira
+    BPCSIndisponivel (ConnectionError). As esperas somam no máximo ESPERA_TOTAL_MAXIMA:
+    esgotado esse tempo, a chamada desiste e o disjuntor passa a falhar rápido.
+    """
+    espera_restante = ESPERA_TOTAL_MAXIMA
+    for tentativa in range(tentativas):
+        if not disjuntor.permitir():
+            raise BPCSIndisponivel("BPCS indisponível no momento. Tente novamente em instantes.")
+        try:
+            resultado = operacao()
+        except Exception as e:
+            tipo = classificar_erro(e)
+            logging.error(f"[ERRO DB] {descricao}: tentativa {tentativa + 1} de {tentativas} ({tipo}): {e}")
+
+            if tipo == AUTENTICACAO:
+                disjuntor.liberar_teste()
+                disjuntor.contadores["erros_autenticacao"] += 1
+                codigo = next(c for c in ERROS_AUTENTICACAO if c in str(e))
+                raise ValueError(ERROS_AUTENTICACAO[codigo])
+            if tipo == LOCAL:
+                disjuntor.liberar_teste()
+                raise
+            if tipo == PERMANENTE:
+                # O BPCS respondeu; o problema é o comando
+                disjuntor.registrar_sucesso()
+                raise
+
+            disjuntor.registrar_falha()
+            if tentativa + 1 >= tentativas or espera_restante <= 0:
+                raise BPCSIndisponivel("Erro de comunicação com o BPCS. Tente novamente.")
+            disjuntor.contadores["retentativas"] += 1
+            espera = min(_espera_backoff(tentativa), espera_restante)
+            espera_restante -= espera
+            time.sleep(espera)
+        else:
+            disjuntor.registrar_sucesso()
+            return resultado
@@ -0,0 +1,174 @@
+"""
+Servidor de produção do sistema de recebimento.
+
+O app é carregado uma única vez no processo principal (imports, migrações do SQLite, chave
+das credenciais e templates ZPL) e os workers são criados por fork a partir dele, já com tudo
+na memória. Cada worker aquece as próprias conexões (pool ODBC do usuário de serviço, índice
+de locações e cubagem dos itens recebidos por último) antes de aceitar requisições.
+
+    python servidor.py                       # Gunicorn no Linux, Waitress no Windows
+    SERVIDOR_MODO=waitress python servidor.py
+
+Gunicorn: SERVIDOR_PROCESSOS workers (gthread) com SERVIDOR_THREADS threads cada; `kill -HUP`
+no processo principal troca os workers sem fechar a porta. Waitress: um processo com
+SERVIDOR_THREADS threads (o Windows não tem fork).
+"""
+import os
+import time
+import logging
+import importlib
+import importlib.util
+
+from dotenv import load_dotenv
+
+# Antes de qualquer import do sistema: os módulos leem o ambiente ao serem importados
+load_dotenv()
+
+SERVIDOR_MODO = os.environ.get('SERVIDOR_MODO', 'auto').lower()
+SERVIDOR_HOST = os.environ.get('SERVIDOR_HOST', '0.0.0.0')
+SERVIDOR_PORTA = int(os.environ.get('SERVIDOR_PORTA', '5000'))
+SERVIDOR_PROCESSOS = int(os.environ.get('SERVIDOR_PROCESSOS', '0')) or (os.cpu_count() or 1)
+SERVIDOR_THREADS = int(os.environ.get('SERVIDOR_THREADS', '8'))
+SERVIDOR_TIMEOUT = int(os.environ.get('SERVIDOR_TIMEOUT', '120'))
+SERVIDOR_TIMEOUT_ENCERRAMENTO = int(os.environ.get('SERVIDOR_TIMEOUT_ENCERRAMENTO', '30'))
+SERVIDOR_MAX_REQUISICOES = int(os.environ.get('SERVIDOR_MAX_REQUISICOES', '0'))
+SERVIDOR_FILA_CONEXOES = int(os.environ.get('SERVIDOR_FILA_CONEXOES', '2048'))
+SERVIDOR_AQUECER = os.environ.get('SERVIDOR_AQUECER', '1') != '0'
+SERVIDOR_AQUECER_ITENS = int(os.environ.get('SERVIDOR_AQUECER_ITENS', '500'))
+
+# Carregados no processo principal para os workers já nascerem com eles
+MODULOS_PRECARREGADOS = ("numpy", "pyodbc", "openpyxl")
+
+
+def carregar_app():
+    """Carga única no processo principal, antes do fork."""
+    inicio = time.perf_counter()
+    from app import app
+    from database import banco_usuarios, banco_itens
+    from diario_recebimento import diario_recebimento
+    from reservas import reservas
+    from etiquetaszpl import IMPRESSORAS, ZONAS_PEQ_MED_GRA, template_compilado
+
+    for modulo in MODULOS_PRECARREGADOS:
+        try:
+            importlib.import_module(modulo)
+        except ImportError as e:
+            logging.warning(f"[SERVIDOR] {modulo} não pré-carregado: {e}")
+
+    # Migrações aplicadas uma vez aqui; a conexão não atravessa o fork
+    for banco in (banco_usuarios, banco_itens, reservas.banco, diario_recebimento.banco):
+        banco.conexao()
+        banco.fechar()
+
+    for impressora in IMPRESSORAS:
+        for zona in (ZONAS_PEQ_MED_GRA[0], ""):
+            template_compilado(impressora, zona)
+
+    logging.info(f"[SERVIDOR] App carregado em {time.perf_counter() - inicio:.2f}s.")
+    return app
+
+
+def iniciar_worker():
+    """Threads de segundo plano do processo atual (não sobrevivem ao fork) e aquecimento."""
+    from ocupacao import analise_ocupacao
+
+    capturas = analise_ocupacao.iniciar()
+    logging.info(f"[SERVIDOR] Worker {os.getpid()}: capturas de ocupação {'ativas' if capturas else 'desligadas'}.")
+    aquecer_worker()
+
+
+def aquecer_worker():
+    """Conexões e caches do processo atual, antes do primeiro acesso."""
+    if not SERVIDOR_AQUECER:
+        return
+    inicio = time.perf_counter()
+    from database import aquecer_processo
+    from diario_recebimento import diario_recebimento
+
+    try:
+        itens = diario_recebimento.itens_recentes(SERVIDOR_AQUECER_ITENS)
+    except Exception as e:
+        logging.warning(f"[SERVIDOR] Itens recentes do diário indisponíveis: {e}")
+        itens = []
+    resumo = aquecer_processo(itens)
+    logging.info(f"[SERVIDOR] Worker {os.getpid()} aquecido em {time.perf_counter() - inicio:.2f}s: {resumo}")
+
+
+def _encerrar_worker():
+    from diario_recebimento import diario_recebimento
+    diario_recebimento.descarregar()
+
+
+def config_gunicorn():
+    return {
+        "bind": f"{SERVIDOR_HOST}:{SERVIDOR_PORTA}",
+        "workers": SERVIDOR_PROCESSOS,
+        "worker_class": "gthread",
+        "threads": SERVIDOR_THREADS,
+        "preload_app": True,
+        "timeout": SERVIDOR_TIMEOUT,
+        "graceful_timeout": SERVIDOR_TIMEOUT_ENCERRAMENTO,
+        "max_requests": SERVIDOR_MAX_REQUISICOES,
+        "max_requests_jitter": SERVIDOR_MAX_REQUISICOES // 10,
+        "backlog": SERVIDOR_FILA_CONEXOES,
+        "post_fork": lambda servidor, worker: iniciar_worker(),
+        "worker_exit": lambda servidor, worker: _encerrar_worker(),
+    }
+
+
+def servir_gunicorn(app):
+    from gunicorn.app.base import BaseApplication
+
+    class _AplicacaoGunicorn(BaseApplication):
+        def load_config(self):
+            for chave, valor in config_gunicorn().items():
+                self.cfg.set(chave, valor)
+
+        def load(self):
+            return app
+
+    logging.info(f"[SERVIDOR] Gunicorn em {SERVIDOR_HOST}:{SERVIDOR_PORTA}: "
+                 f"{SERVIDOR_PROCESSOS} processos x {SERVIDOR_THREADS} threads.")
+    _AplicacaoGunicorn().run()
+
+
+def servir_waitress(app):
+    from waitress import serve
+
+    if SERVIDOR_PROCESSOS > 1 and os.environ.get('SERVIDOR_PROCESSOS'):
+        logging.warning("[SERVIDOR] Waitress roda em um único processo; SERVIDOR_PROCESSOS ignorado.")
+    iniciar_worker()
+    logging.info(f"[SERVIDOR] Waitress em {SERVIDOR_HOST}:{SERVIDOR_PORTA}: {SERVIDOR_THREADS} threads.")
+    try:
+        serve(app, host=SERVIDOR_HOST, port=SERVIDOR_PORTA, threads=SERVIDOR_THREADS,
+              backlog=SERVIDOR_FILA_CONEXOES, channel_timeout=SERVIDOR_TIMEOUT, ident="recebimento")
+    finally:
+        _encerrar_worker()
+
+
+def escolher_modo():
+    if SERVIDOR_MODO in ("gunicorn", "waitress"):
+        return SERVIDOR_MODO
+    if SERVIDOR_MODO != "auto":
+        raise SystemExit(f"SERVIDOR_MODO inválido: {SERVIDOR_MODO!r} (use auto, gunicorn ou waitress).")
+    if os.name == "posix" and importlib.util.find_spec("gunicorn") is not None:
+        return "gunicorn"
+    return "waitress"
+
+
+def main():
+    from credenciais import ChaveCredenciaisInvalida
+
+    modo = escolher_modo()
+    try:
+        app = carregar_app()
+    except ChaveCredenciaisInvalida as e:
+        raise SystemExit(f"[CREDENCIAIS] {e}")
+    if modo == "gunicorn":
+        servir_gunicorn(app)
+    else:
+        servir_waitress(app)
+
+
+if __name__ == "__main__":
+    main()
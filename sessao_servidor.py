@@ -0,0 +1,435 @@
+import os
+import json
+import time
+import secrets
+import logging
+import sqlite3
+import threading
+
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+
+
+SESSAO_BACKEND = os.environ.get('SESSAO_BACKEND', 'sqlite').lower()
+SESSAO_DB_PATH = os.environ.get('SESSAO_DB_PATH', 'sessoes.db')
+SESSAO_TTL = float(os.environ.get('SESSAO_TTL', '43200'))
+SESSAO_RENOVAR_APOS = 600        # segundos entre renovações de validade sem alteração
+SESSAO_LIMPEZA_INTERVALO = 300
+
+
+# ---------- Backends ----------
+class BackendMemoria:
+    """Sessões e buffers em memória do processo, com varredura periódica das expiradas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessoes = {}   # sid -> (dados, expira_em)
+        self._buffers = {}   # (sid, nome) -> [valores]
+        self._varredor = None
+        self._pid = os.getpid()
+
+    def _iniciar_varredor(self):
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._varredor = None
+            self._pid = os.getpid()
+        if self._varredor is None:
+            self._varredor = threading.Thread(target=self._loop_varredor, name="sessao-varredor", daemon=True)
+            self._varredor.start()
+
+    def _loop_varredor(self):
+        while True:
+            time.sleep(SESSAO_LIMPEZA_INTERVALO)
+            try:
+                self.limpar_expiradas()
+            except Exception as e:
+                logging.error(f"[SESSAO] Erro na limpeza de sessões expiradas: {e}")
+
+    def carregar(self, sid):
+        self._iniciar_varredor()
+        with self._lock:
+            entrada = self._sessoes.get(sid)
+            if entrada is None or entrada[1] < time.time():
+                return None
+            return dict(entrada[0])
+
+    def salvar(self, sid, dados, ttl):
+        with self._lock:
+            self._sessoes[sid] = (dict(dados), time.time() + ttl)
+
+    def atualizar(self, sid, alteradas, removidas, ttl):
+        with self._lock:
+            entrada = self._sessoes.get(sid)
+            dados = dict(entrada[0]) if entrada is not None and entrada[1] >= time.time() else {}
+            dados.update(alteradas)
+            for chave in removidas:
+                dados.pop(chave, None)
+            self._sessoes[sid] = (dados, time.time() + ttl)
+
+    def renovar(self, sid, ttl):
+        with self._lock:
+            entrada = self._sessoes.get(sid)
+            if entrada is not None:
+                self._sessoes[sid] = (entrada[0], time.time() + ttl)
+
+    def remover(self, sid):
+        with self._lock:
+            self._sessoes.pop(sid, None)
+            for chave in [c for c in self._buffers if c[0] == sid]:
+                del self._buffers[chave]
+
+    def trocar_sid(self, sid, novo_sid):
+        with self._lock:
+            self._sessoes.pop(sid, None)
+            for chave in [c for c in self._buffers if c[0] == sid]:
+                self._buffers[(novo_sid, chave[1])] = self._buffers.pop(chave)
+
+    def anexar(self, sid, nome, valor):
+        with self._lock:
+            self._buffers.setdefault((sid, nome), []).append(valor)
+
+    def iterar(self, sid, nome):
+        with self._lock:
+            valores = list(self._buffers.get((sid, nome), ()))
+        return iter(valores)
+
+    def contar(self, sid, nome):
+        with self._lock:
+            return len(self._buffers.get((sid, nome), ()))
+
+    def contem(self, sid, nome, valor):
+        with self._lock:
+            return valor in self._buffers.get((sid, nome), ())
+
+    def limpar_buffer(self, sid, nome):
+        with self._lock:
+            self._buffers.pop((sid, nome), None)
+
+    def remover_do_buffer(self, sid, nome, valor):
+        with self._lock:
+            valores = self._buffers.get((sid, nome), [])
+            for i in range(len(valores) - 1, -1, -1):
+                if valores[i] == valor:
+                    del valores[i]
+                    return True
+            return False
+
+    def limpar_expiradas(self):
+        agora = time.time()
+        with self._lock:
+            expiradas = {sid for sid, (_, expira_em) in self._sessoes.items() if expira_em < agora}
+            for sid in expiradas:
+                del self._sessoes[sid]
+            for chave in [c for c in self._buffers if c[0] in expiradas]:
+                del self._buffers[chave]
+
+
+class BackendSQLite:
+    """Sessões e buffers em SQLite (WAL), compartilhados entre processos."""
+
+    def __init__(self, caminho=SESSAO_DB_PATH):
+        self.caminho = caminho
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._ultima_limpeza = 0.0
+
+    def _conexao(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.caminho, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessoes (
+                    sid TEXT PRIMARY KEY,
+                    dados TEXT NOT NULL,
+                    expira_em REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessao_buffers (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sid TEXT NOT NULL,
+                    nome TEXT NOT NULL,
+                    valor TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessao_buffers ON sessao_buffers (sid, nome, seq)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessoes_expira ON sessoes (expira_em)")
+            self._conn = conn
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+        return self._conn
+
+    def carregar(self, sid):
+        with self._lock:
+            conn = self._conexao()
+            self._limpar_se_preciso(conn)
+            row = conn.execute("SELECT dados FROM sessoes WHERE sid = ? AND expira_em >= ?",
+                               (sid, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def salvar(self, sid, dados, ttl):
+        with self._lock:
+            self._conexao().execute(
+                "INSERT INTO sessoes (sid, dados, expira_em) VALUES (?, ?, ?) "
+                "ON CONFLICT(sid) DO UPDATE SET dados = excluded.dados, expira_em = excluded.expira_em",
+                (sid, json.dumps(dados), time.time() + ttl)
+            )
+
+    def atualizar(self, sid, alteradas, removidas, ttl):
+        # Lê e regrava na mesma transação: requisições simultâneas da mesma sessão (ex.: prefetch
+        # e "Consultar") só gravam as chaves que cada uma alterou
+        with self._lock:
+            conn = self._conexao()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                agora = time.time()
+                row = conn.execute("SELECT dados FROM sessoes WHERE sid = ? AND expira_em >= ?",
+                                   (sid, agora)).fetchone()
+                dados = json.loads(row[0]) if row else {}
+                dados.update(alteradas)
+                for chave in removidas:
+                    dados.pop(chave, None)
+                conn.execute(
+                    "INSERT INTO sessoes (sid, dados, expira_em) VALUES (?, ?, ?) "
+                    "ON CONFLICT(sid) DO UPDATE SET dados = excluded.dados, expira_em = excluded.expira_em",
+                    (sid, json.dumps(dados), agora + ttl)
+                )
+
+    def renovar(self, sid, ttl):
+        with self._lock:
+            self._conexao().execute("UPDATE sessoes SET expira_em = ? WHERE sid = ?", (time.time() + ttl, sid))
+
+    def remover(self, sid):
+        with self._lock:
+            conn = self._conexao()
+            with conn:
+                conn.execute("BEGIN")
+                conn.execute("DELETE FROM sessoes WHERE sid = ?", (sid,))
+                conn.execute("DELETE FROM sessao_buffers WHERE sid = ?", (sid,))
+
+    def trocar_sid(self, sid, novo_sid):
+        # Os buffers passam para o novo ID; a linha da sessão antiga deixa de existir
+        with self._lock:
+            conn = self._conexao()
+            with conn:
+                conn.execute("BEGIN")
+                conn.execute("DELETE FROM sessoes WHERE sid = ?", (sid,))
+                conn.execute("UPDATE sessao_buffers SET sid = ? WHERE sid = ?", (novo_sid, sid))
+
+    def anexar(self, sid, nome, valor):
+        with self._lock:
+            self._conexao().execute("INSERT INTO sessao_buffers (sid, nome, valor) VALUES (?, ?, ?)",
+                                    (sid, nome, json.dumps(valor)))
+
+    def iterar(self, sid, nome):
+        # Cursor próprio: os valores são lidos sob demanda, sem montar a lista inteira
+        conn = sqlite3.connect(self.caminho, timeout=5)
+        try:
+            cursor = conn.execute("SELECT valor FROM sessao_buffers WHERE sid = ? AND nome = ? ORDER BY seq",
+                                  (sid, nome))
+            for (valor,) in cursor:
+                yield json.loads(valor)
+        finally:
+            conn.close()
+
+    def contar(self, sid, nome):
+        with self._lock:
+            return self._conexao().execute("SELECT COUNT(*) FROM sessao_buffers WHERE sid = ? AND nome = ?",
+                                           (sid, nome)).fetchone()[0]
+
+    def contem(self, sid, nome, valor):
+        with self._lock:
+            return self._conexao().execute(
+                "SELECT 1 FROM sessao_buffers WHERE sid = ? AND nome = ? AND valor = ? LIMIT 1",
+                (sid, nome, json.dumps(valor))
+            ).fetchone() is not None
+
+    def limpar_buffer(self, sid, nome):
+        with self._lock:
+            self._conexao().execute("DELETE FROM sessao_buffers WHERE sid = ? AND nome = ?", (sid, nome))
+
+    def remover_do_buffer(self, sid, nome, valor):
+        # Só a entrada mais recente com esse valor (a mesma macro pode aparecer mais de uma vez)
+        with self._lock:
+            cur = self._conexao().execute("""
+                DELETE FROM sessao_buffers WHERE seq = (
+                    SELECT MAX(seq) FROM sessao_buffers WHERE sid = ? AND nome = ? AND valor = ?
+                )
+            """, (sid, nome, json.dumps(valor)))
+            return cur.rowcount == 1
+
+    def _limpar_se_preciso(self, conn):
+        agora = time.time()
+        if agora - self._ultima_limpeza < SESSAO_LIMPEZA_INTERVALO:
+            return
+        self._ultima_limpeza = agora
+        try:
+            with conn:
+                conn.execute("BEGIN")
+                conn.execute("DELETE FROM sessao_buffers WHERE sid IN (SELECT sid FROM sessoes WHERE expira_em < ?)",
+                             (agora,))
+                conn.execute("DELETE FROM sessoes WHERE expira_em < ?", (agora,))
+        except sqlite3.Error as e:
+            logging.warning(f"[SESSAO] Falha ao remover sessões expiradas: {e}")
+
+    def limpar_expiradas(self):
+        with self._lock:
+            self._ultima_limpeza = 0.0
+            self._limpar_se_preciso(self._conexao())
+
+
+def criar_backend(tipo=SESSAO_BACKEND):
+    if tipo == 'memoria':
+        return BackendMemoria()
+    if tipo == 'sqlite':
+        return BackendSQLite()
+    raise ValueError(f"Backend de sessão '{tipo}' não reconhecido (use 'sqlite' ou 'memoria').")
+
+
+# ---------- Sessão Flask ----------
+class SessaoServidor(CallbackDict, SessionMixin):
+    """
+    Sessão cujo conteúdo fica no servidor; o cookie leva apenas o ID assinado.
+    Buffers (listas que só crescem, como o macro_buffer) são gravados item a item.
+    Só as chaves alteradas na requisição são gravadas, sobre o que estiver no servidor.
+    """
+
+    def __init__(self, sid, backend, dados=None, nova=False):
+        def ao_alterar(_):
+            self.modified = True
+        super().__init__(dados or {}, ao_alterar)
+        self.sid = sid
+        self.backend = backend
+        self.new = nova
+        self.modified = False
+        self.usou_buffer = False
+        self.alteradas = set()
+
+    def __setitem__(self, chave, valor):
+        self.alteradas.add(chave)
+        super().__setitem__(chave, valor)
+
+    def __delitem__(self, chave):
+        self.alteradas.add(chave)
+        super().__delitem__(chave)
+
+    def pop(self, chave, *padrao):
+        if chave in self:
+            self.alteradas.add(chave)
+        return super().pop(chave, *padrao)
+
+    def popitem(self):
+        chave, valor = super().popitem()
+        self.alteradas.add(chave)
+        return chave, valor
+
+    def setdefault(self, chave, padrao=None):
+        if chave not in self:
+            self.alteradas.add(chave)
+        return super().setdefault(chave, padrao)
+
+    def update(self, *args, **kwargs):
+        novos = dict(*args, **kwargs)
+        self.alteradas.update(novos)
+        super().update(novos)
+
+    def clear(self):
+        self.alteradas.update(self.keys())
+        super().clear()
+
+    def regenerar(self):
+        """
+        Troca o ID da sessão (login), mantendo dados e buffers: um ID conhecido antes do login
+        (fixação de sessão) deixa de valer. A sessão é gravada inteira sob o novo ID no fim da requisição.
+        """
+        novo_sid = secrets.token_urlsafe(32)
+        if not self.new:
+            self.backend.trocar_sid(self.sid, novo_sid)
+            self.usou_buffer = True
+        self.sid = novo_sid
+        self.new = True
+        self.modified = True
+
+    def anexar_buffer(self, nome, valor):
+        self.usou_buffer = True
+        self.backend.anexar(self.sid, nome, valor)
+
+    def buffer(self, nome):
+        return self.backend.iterar(self.sid, nome)
+
+    def contar_buffer(self, nome):
+        if self.new and not self.usou_buffer:
+            return 0
+        return self.backend.contar(self.sid, nome)
+
+    def contem_no_buffer(self, nome, valor):
+        if self.new and not self.usou_buffer:
+            return False
+        return self.backend.contem(self.sid, nome, valor)
+
+    def limpar_buffer(self, nome):
+        self.backend.limpar_buffer(self.sid, nome)
+
+    def remover_do_buffer(self, nome, valor):
+        return self.backend.remover_do_buffer(self.sid, nome, valor)
+
+
+class InterfaceSessaoServidor(SessionInterface):
+
+    def __init__(self, backend=None, ttl=SESSAO_TTL):
+        self.backend = backend or criar_backend()
+        self.ttl = ttl
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt="sessao-servidor")
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                dados = self.backend.carregar(sid)
+                if dados is not None:
+                    renovada_em = dados.pop("_renovada_em", 0)
+                    sessao = SessaoServidor(sid, self.backend, dados)
+                    sessao.renovada_em = renovada_em
+                    return sessao
+        return SessaoServidor(secrets.token_urlsafe(32), self.backend, nova=True)
+
+    def save_session(self, app, session, response):
+        nome = self.get_cookie_name(app)
+        dominio = self.get_cookie_domain(app)
+        caminho = self.get_cookie_path(app)
+
+        if not session and not session.usou_buffer:
+            if session.modified and not session.new:
+                self.backend.remover(session.sid)
+                response.delete_cookie(nome, domain=dominio, path=caminho)
+            return
+
+        agora = time.time()
+        if session.new:
+            self.backend.salvar(session.sid, dict(session, _renovada_em=agora), self.ttl)
+        elif session.modified or agora - getattr(session, "renovada_em", 0) > SESSAO_RENOVAR_APOS:
+            alteradas = {chave: session[chave] for chave in session.alteradas if chave in session}
+            removidas = {chave for chave in session.alteradas if chave not in session}
+            self.backend.atualizar(session.sid, dict(alteradas, _renovada_em=agora), removidas, self.ttl)
+        else:
+            return
+
+        response.set_cookie(
+            nome,
+            self._signer(app).sign(session.sid.encode()).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=dominio,
+            path=caminho,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
@@ -0,0 +1,261 @@
+import os
+import re
+import json
+import time
+import queue
+import uuid
+import atexit
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+LOG_PATH = os.environ.get('LOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'historico_terminal.log'))
+LOG_NIVEL = os.environ.get('LOG_NIVEL', 'INFO').upper()
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_ARQUIVOS = int(os.environ.get('LOG_ARQUIVOS', '5'))
+TELEMETRIA_LOG_SPANS = os.environ.get('TELEMETRIA_LOG_SPANS', '1') == '1'
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_correlacao = contextvars.ContextVar("id_correlacao", default="-")
+_span_atual = contextvars.ContextVar("span_atual", default=None)
+_ID_VALIDO = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+
+
+# ---------- Correlação ----------
+def novo_id_correlacao():
+    return uuid.uuid4().hex[:16]
+
+
+def definir_correlacao(id_correlacao=None):
+    """Define o ID de correlação do contexto atual (requisição, job). Retorna o ID usado."""
+    # IDs vindos de fora (X-Request-ID) só são aceitos se curtos e sem caracteres estranhos
+    if not id_correlacao or not _ID_VALIDO.fullmatch(id_correlacao):
+        id_correlacao = novo_id_correlacao()
+    _correlacao.set(id_correlacao)
+    return id_correlacao
+
+
+def correlacao_atual():
+    return _correlacao.get()
+
+
+# ---------- Métricas (formato texto do Prometheus) ----------
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _rotulos_texto(nomes, valores, extra=None):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+class Histograma:
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_SEGUNDOS):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}   # valores dos rótulos -> [contagens por bucket..., soma, total]
+
+    def observar(self, valor, *valores_rotulos):
+        with self._lock:
+            serie = self._series.get(valores_rotulos)
+            if serie is None:
+                serie = self._series[valores_rotulos] = [0] * len(self.buckets) + [0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for valores, serie in sorted(series.items()):
+            for limite, contagem in zip(self.buckets, serie):
+                le = 'le="%s"' % limite
+                linhas.append(f"{self.nome}_bucket{_rotulos_texto(self.rotulos, valores, le)} {contagem}")
+            le = 'le="+Inf"'
+            linhas.append(f"{self.nome}_bucket{_rotulos_texto(self.rotulos, valores, le)} {serie[-1]}")
+            linhas.append(f"{self.nome}_sum{_rotulos_texto(self.rotulos, valores)} {serie[-2]:.6f}")
+            linhas.append(f"{self.nome}_count{_rotulos_texto(self.rotulos, valores)} {serie[-1]}")
+        return linhas
+
+
+class Contador:
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def incrementar(self, *valores_rotulos, valor=1):
+        with self._lock:
+            self._series[valores_rotulos] = self._series.get(valores_rotulos, 0) + valor
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for valores, total in sorted(series.items()):
+            linhas.append(f"{self.nome}{_rotulos_texto(self.rotulos, valores)} {total}")
+        return linhas
+
+
+duracao_spans = Histograma("recebimento_span_duracao_segundos",
+                           "Duração das etapas do recebimento (ODBC, SQLite, impressora).", ("span",))
+erros_spans = Contador("recebimento_span_erros_total", "Etapas encerradas com exceção.", ("span",))
+duracao_requisicoes = Histograma("recebimento_requisicao_duracao_segundos",
+                                 "Duração das requisições HTTP por rota.", ("rota", "metodo"))
+requisicoes = Contador("recebimento_requisicoes_total", "Requisições HTTP por rota e status.",
+                       ("rota", "metodo", "status"))
+
+METRICAS = [duracao_spans, erros_spans, duracao_requisicoes, requisicoes]
+
+
+def exportar_metricas():
+    linhas = []
+    for metrica in METRICAS:
+        linhas.extend(metrica.exportar())
+    return "\n".join(linhas) + "\n"
+
+
+def registrar_requisicao(rota, metodo, status, duracao):
+    duracao_requisicoes.observar(duracao, rota, metodo)
+    requisicoes.incrementar(rota, metodo, str(status))
+
+
+# ---------- Spans ----------
+@contextmanager
+def span(nome, **atributos):
+    """
+    Mede uma etapa: alimenta o histograma do /metrics e registra uma linha
+    estruturada com o ID de correlação, o span pai e os atributos.
+    Atributos podem ser acrescentados dentro do bloco (dict retornado).
+    """
+    pai = _span_atual.get()
+    token = _span_atual.set(nome)
+    inicio = time.perf_counter()
+    status = "ok"
+    try:
+        yield atributos
+    except BaseException:
+        status = "erro"
+        erros_spans.incrementar(nome)
+        raise
+    finally:
+        duracao = time.perf_counter() - inicio
+        _span_atual.reset(token)
+        duracao_spans.observar(duracao, nome)
+        if TELEMETRIA_LOG_SPANS:
+            logging.getLogger("telemetria").info(
+                f"[SPAN] {nome} {duracao * 1000:.1f}ms {status}",
+                extra={"span": nome, "span_pai": pai, "duracao_ms": round(duracao * 1000, 2),
+                       "status": status, "atributos": atributos},
+            )
+
+
+def medir(nome):
+    """Decorador: executa a função dentro de um span com o nome informado."""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            with span(nome):
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+
+# ---------- Logs estruturados em fila ----------
+class FormatoJSON(logging.Formatter):
+    CAMPOS_EXTRA = ("span", "span_pai", "duracao_ms", "status", "atributos")
+
+    def format(self, record):
+        dados = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "nivel": record.levelname,
+            "logger": record.name,
+            "id_correlacao": getattr(record, "id_correlacao", "-"),
+            "processo": record.process,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        for campo in self.CAMPOS_EXTRA:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                dados[campo] = valor
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class _HandlerFila(QueueHandler):
+    """
+    Só enfileira (não bloqueia a requisição em disco); o ID de correlação é lido aqui,
+    na thread que emitiu o log. Recria o listener se o processo foi bifurcado.
+    """
+
+    def prepare(self, record):
+        record.id_correlacao = _correlacao.get()
+        return super().prepare(record)   # mensagem (e traceback) já formatada
+
+    def emit(self, record):
+        if _estado["pid"] != os.getpid():
+            _iniciar_listener()
+        super().emit(record)
+
+
+_estado = {"pid": None, "fila": None, "listener": None, "handlers": None}
+
+
+def _iniciar_listener():
+    fila = queue.SimpleQueue()
+    listener = QueueListener(fila, *_estado["handlers"], respect_handler_level=True)
+    listener.start()
+    _estado.update(pid=os.getpid(), fila=fila, listener=listener)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, _HandlerFila):
+            handler.queue = fila
+
+
+def _parar_listener():
+    if _estado["listener"] is not None and _estado["pid"] == os.getpid():
+        _estado["listener"].stop()
+        _estado["listener"] = None
+
+
+def configurar_logs(nivel=LOG_NIVEL, caminho=LOG_PATH):
+    """
+    Logs do processo em fila: quem loga só enfileira e uma thread (QueueListener)
+    grava no console (texto) e em logs/historico_terminal.log (uma linha JSON por evento).
+    """
+    if _estado["handlers"] is not None:
+        return
+    handlers = []
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+    handlers.append(console)
+    try:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        arquivo = RotatingFileHandler(caminho, maxBytes=LOG_MAX_BYTES, backupCount=LOG_ARQUIVOS, encoding="utf-8")
+        arquivo.setFormatter(FormatoJSON())
+        handlers.append(arquivo)
+    except OSError as e:
+        logging.getLogger(__name__).warning(f"[LOG] Não foi possível abrir {caminho}: {e}")
+    _estado["handlers"] = handlers
+
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    raiz.addHandler(_HandlerFila(queue.SimpleQueue()))
+    raiz.setLevel(nivel)
+    _iniciar_listener()
+    atexit.register(_parar_listener)
@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+
+# As bases e arquivos do sistema são lidos do ambiente na importação dos módulos:
+# aponta tudo para um diretório temporário antes de qualquer import
+_DIRETORIO = tempfile.mkdtemp(prefix="recebimento-testes-")
+os.environ.update({
+    "SQLITE_PATH": os.path.join(_DIRETORIO, "usuarios.db"),
+    "ITENS_DB_PATH": os.path.join(_DIRETORIO, "Itens.db"),
+    "RESERVAS_DB_PATH": os.path.join(_DIRETORIO, "reservas.db"),
+    "SESSAO_DB_PATH": os.path.join(_DIRETORIO, "sessoes.db"),
+    "DIARIO_DB_PATH": os.path.join(_DIRETORIO, "diario_recebimento.db"),
+    "CREDENCIAIS_CHAVE_PATH": os.path.join(_DIRETORIO, "credenciais.key"),
+    "CREDENCIAIS_CRIAR_CHAVE": "1",
+    "OCUPACAO_DIR": os.path.join(_DIRETORIO, "ocupacao"),
+    "CUBAGEM_RELATORIO_DIR": os.path.join(_DIRETORIO, "relatorios"),
+    "MACRO_PATH": os.path.join(_DIRETORIO, "macros"),
+    "LOG_PATH": os.path.join(_DIRETORIO, "logs", "testes.log"),
+    "BPCS_SERVICO_UID": "",
+    "BPCS_SERVICO_PWD": "",
+})
+os.makedirs(os.environ["MACRO_PATH"], exist_ok=True)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,60 @@
+import math
+
+import pytest
+
+import alturas
+from alturas import PerfilAltura, calcular_altura, zonas_por_altura
+
+
+def _zonas_originais(altura_necessaria):
+    # Regras fixas de app.py antes de ZONAS_POR_ALTURA
+    if altura_necessaria <= 1.0:
+        return ["PEQ", "MED", "RUA"]
+    elif altura_necessaria <= 1.35:
+        return ["MED", "GRA", "RUA"]
+    elif altura_necessaria <= 2:
+        return ["GRA", "RUA"]
+    else:
+        return ["RUA"]
+
+
+@pytest.mark.parametrize("altura", [0.0, 0.15, 0.99, 1.0, 1.0001, 1.2, 1.35, 1.3501, 1.99, 2.0, 2.0001, 3.5, 10.0])
+def test_faixas_padrao_iguais_as_regras_originais(altura):
+    assert zonas_por_altura(altura) == _zonas_originais(altura)
+
+
+def test_faixas_padrao_em_todas_as_alturas_arredondadas():
+    for cm in range(0, 400):
+        altura = round(cm / 100, 2)
+        assert zonas_por_altura(altura) == _zonas_originais(altura), altura
+
+
+def test_perfil_usa_o_mesmo_calculo_da_formula():
+    perfil = PerfilAltura(cx_lastro=8, altura_caixa=0.2, camadas=5)
+    for volume in [1, 8, 9, 40, 41, 200]:
+        altura = calcular_altura(volume, 8, 0.2)
+        assert altura == round(math.ceil(volume / 8) * 0.2 + alturas.ALTURA_PALLET, 2)
+        assert perfil.calcular(volume) == (altura, _zonas_originais(altura))
+
+
+def test_zonas_devolvidas_sao_copias():
+    zonas = zonas_por_altura(0.5)
+    zonas.append("XXX")
+    assert zonas_por_altura(0.5) == ["PEQ", "MED", "RUA"]
+
+
+@pytest.mark.parametrize("texto", ["1.0=PEQ", "1.0=;*=RUA", ""])
+def test_faixas_invalidas(texto):
+    with pytest.raises(ValueError):
+        alturas._ler_faixas(texto)
+
+
+def test_faixas_configuradas_fora_de_ordem():
+    faixas = alturas._ler_faixas("*=rua; 2=gra ,rua;1=peq")
+    assert faixas == [(1.0, ["PEQ"]), (2.0, ["GRA", "RUA"]), (math.inf, ["RUA"])]
+
+
+@pytest.mark.parametrize("cx_lastro, altura_caixa", [(0, 0.2), (8, 0), (-1, 0.2)])
+def test_perfil_recusa_cubagem_incompleta(cx_lastro, altura_caixa):
+    with pytest.raises(ValueError):
+        PerfilAltura(cx_lastro, altura_caixa)
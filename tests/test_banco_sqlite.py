@@ -0,0 +1,94 @@
+import logging
+import os
+import sqlite3
+
+import pytest
+
+import banco_sqlite
+from banco_sqlite import BancoSQLite, criar_indice
+
+
+def _criar_tabela(conn):
+    conn.execute("CREATE TABLE itens (item TEXT, valor REAL)")
+
+
+def _versao(caminho):
+    conn = sqlite3.connect(caminho)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_migracoes_aplicadas_uma_vez_e_so_as_novas(tmp_path):
+    caminho = str(tmp_path / "base.db")
+    aplicadas = []
+    v1 = (1, lambda conn: (aplicadas.append(1), _criar_tabela(conn)))
+    v2 = (2, lambda conn: (aplicadas.append(2), conn.execute("ALTER TABLE itens ADD COLUMN zona TEXT")))
+
+    BancoSQLite(caminho, migracoes=[v2, v1]).conexao()
+    assert aplicadas == [1, 2] and _versao(caminho) == 2
+
+    BancoSQLite(caminho, migracoes=[v1, v2]).conexao()
+    v3 = (3, lambda conn: aplicadas.append(3))
+    banco = BancoSQLite(caminho, migracoes=[v1, v2, v3])
+    banco.conexao()
+    assert aplicadas == [1, 2, 3] and _versao(caminho) == 3
+    assert banco.status()["versao_esquema"] == 3
+
+
+def test_migracao_com_erro_desfaz_tudo(tmp_path):
+    caminho = str(tmp_path / "base.db")
+
+    def quebrar(conn):
+        raise sqlite3.OperationalError("falhou")
+
+    with pytest.raises(sqlite3.OperationalError):
+        BancoSQLite(caminho, migracoes=[(1, _criar_tabela), (2, quebrar)]).conexao()
+    assert _versao(caminho) == 0
+    conn = sqlite3.connect(caminho)
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'itens'").fetchone() is None
+    conn.close()
+
+
+def test_conexao_recriada_apos_fork(tmp_path, monkeypatch):
+    aplicadas = []
+    banco = BancoSQLite(str(tmp_path / "base.db"), migracoes=[(1, lambda conn: aplicadas.append(1))])
+    conn = banco.conexao()
+    assert banco.conexao() is conn
+
+    pid = os.getpid()
+    monkeypatch.setattr(banco_sqlite.os, "getpid", lambda: pid + 1)
+    filho = banco.conexao()
+    assert filho is not conn
+    assert banco.stats["conexoes"] == 2
+    # A migração é conferida de novo no processo filho, mas a base já está na versão
+    assert aplicadas == [1]
+
+
+def test_indice_na_chave_primaria_nao_e_criado(tmp_path):
+    conn = BancoSQLite(str(tmp_path / "base.db")).conexao()
+    conn.execute("CREATE TABLE itens (item TEXT PRIMARY KEY)")
+    criar_indice(conn, "itens", "item", "idx_itens_item", unico=True)
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'idx_itens_item'").fetchone() is None
+
+
+def test_indice_unico_com_duplicatas_falha_sem_deduplicar(tmp_path):
+    conn = BancoSQLite(str(tmp_path / "base.db")).conexao()
+    _criar_tabela(conn)
+    conn.executemany("INSERT INTO itens VALUES (?, ?)", [("A1", 1), ("A1", 2)])
+    with pytest.raises(sqlite3.IntegrityError, match="itens.item"):
+        criar_indice(conn, "itens", "item", "idx_itens_item", unico=True)
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'idx_itens_item'").fetchone() is None
+
+
+def test_indice_unico_deduplica_mantendo_a_mais_recente(tmp_path, caplog):
+    conn = BancoSQLite(str(tmp_path / "base.db")).conexao()
+    _criar_tabela(conn)
+    conn.executemany("INSERT INTO itens VALUES (?, ?)", [("A1", 1), ("B2", 5), ("A1", 2), ("A1", 3)])
+    with caplog.at_level(logging.WARNING):
+        criar_indice(conn, "itens", "item", "idx_itens_item", unico=True, deduplicar=True)
+    assert "2 linha(s)" in caplog.text
+
+    conn.execute("INSERT INTO itens VALUES ('A1', 4) ON CONFLICT(item) DO UPDATE SET valor = excluded.valor")
+    assert [tuple(l) for l in conn.execute("SELECT item, valor FROM itens ORDER BY item")] == [("A1", 4), ("B2", 5)]
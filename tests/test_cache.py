@@ -0,0 +1,51 @@
+import pytest
+
+import cache
+from cache import CacheLRU
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    agora = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: agora[0])
+    return agora
+
+
+def test_remove_o_menos_usado_ao_passar_do_limite():
+    lru = CacheLRU(max_itens=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+    assert lru.stats()["removidos"] == 1
+
+
+def test_entrada_expira_pelo_ttl(relogio):
+    lru = CacheLRU(max_itens=10, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2, ttl=5)
+
+    relogio[0] += 10
+    assert lru.get("b", "ausente") == "ausente"
+    assert lru.get("a") == 1
+    relogio[0] += 60
+    assert lru.get("a") is None
+    assert lru.stats()["expirados"] == 2
+
+
+def test_set_com_marca_descartado_apos_escrita():
+    lru = CacheLRU(max_itens=10, ttl=60)
+    marca = lru.marca()
+    lru.set("a", "nova")
+    assert not lru.set("a", "velha", marca=marca)
+    assert lru.get("a") == "nova"
+
+    marca = lru.marca()
+    lru.invalidate("b")
+    assert not lru.set("a", "velha", marca=marca)
+    assert lru.set("a", "lida", marca=lru.marca())
+    assert lru.get("a") == "lida"
+    assert lru.stats()["descartados"] == 2
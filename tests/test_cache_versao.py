@@ -0,0 +1,108 @@
+import pytest
+
+import database
+from banco_sqlite import BancoSQLite
+from credenciais import CofreCredenciais, cifrar_senha
+
+
+@pytest.fixture
+def bancos(monkeypatch, tmp_path):
+    itens = BancoSQLite(str(tmp_path / "Itens.db"), migracoes=database.banco_itens.migracoes, nome="Itens.db")
+    usuarios = BancoSQLite(str(tmp_path / "usuarios.db"), migracoes=database.banco_usuarios.migracoes,
+                           nome="usuarios.db")
+    monkeypatch.setattr(database, "banco_itens", itens)
+    monkeypatch.setattr(database, "banco_usuarios", usuarios)
+    monkeypatch.setattr(database, "_versao_cache_cubagem", None)
+    monkeypatch.setattr(database, "cofre_credenciais", CofreCredenciais(
+        database._carregar_credencial, versao=lambda: database.banco_usuarios.versao("usuarios")))
+    database.cache_cubagem.clear()
+    yield tmp_path
+    database.cache_cubagem.clear()
+
+
+def _outro_worker(tmp_path, nome):
+    # Outra conexão ao mesmo arquivo faz o papel do processo vizinho
+    return BancoSQLite(str(tmp_path / nome), nome=nome)
+
+
+def _cubagem(item, altura=None, lastro=None):
+    return {"Item": item, "Comprimento": 0.5, "Largura": 0.4, "Altura": altura, "Cubagem": 0.1, "Cx_Lastro": lastro}
+
+
+def test_cubagem_incompleta_em_cache_e_completada_por_outro_worker(bancos):
+    database.salvar_ou_atualizar_item_cubagem(_cubagem("A1"))
+    database.salvar_ou_atualizar_item_cubagem(_cubagem("B2", 0.3, 8))
+    assert database.calcular_altura_item("A1", 10) is None
+    assert database.get_item_cubagem("B2")["Altura"] == 0.3
+
+    with _outro_worker(bancos, "Itens.db").transacao() as conn:
+        conn.execute("UPDATE Itens_cubagem SET Altura = 0.25, Cx_Lastro = 4 WHERE Item = 'A1'")
+
+    assert database.get_item_cubagem("A1")["Altura"] == 0.25
+    assert database.calcular_altura_item("A1", 10) is not None
+
+
+def test_gravacao_do_proprio_worker_nao_descarta_o_cache(bancos):
+    database.salvar_ou_atualizar_item_cubagem(_cubagem("A1", 0.3, 8))
+    database.get_item_cubagem("A1")
+    database.salvar_ou_atualizar_item_cubagem(_cubagem("B2", 0.2, 6))
+    database.importar_lote_cubagem([("C3", 0.5, 0.4, 0.1, 0.02, 10)])
+
+    hits = database.cache_cubagem.stats()["hits"]
+    assert database.get_item_cubagem("A1")["Altura"] == 0.3
+    assert database.cache_cubagem.stats()["hits"] == hits + 1
+
+
+def test_importacao_em_outro_worker_descarta_o_cache(bancos):
+    database.salvar_ou_atualizar_item_cubagem(_cubagem("A1", 0.3, 8))
+    database.get_item_cubagem("A1")
+
+    with _outro_worker(bancos, "Itens.db").transacao() as conn:
+        conn.execute("INSERT INTO Itens_cubagem (Item, Altura) VALUES ('Z9', 0.1) "
+                     "ON CONFLICT(Item) DO UPDATE SET Altura = excluded.Altura")
+        conn.execute("UPDATE Itens_cubagem SET Altura = 0.35 WHERE Item = 'A1'")
+
+    assert database.get_item_cubagem("A1")["Altura"] == 0.35
+
+
+def test_senha_trocada_em_outro_worker_chega_ao_cofre(bancos):
+    database.create_usuario("u1", "UPIN1", "antiga", "Operador")
+    assert database.credenciais_usuario("u1") == ("UPIN1", "antiga")
+
+    with _outro_worker(bancos, "usuarios.db").transacao() as conn:
+        conn.execute("UPDATE usuarios SET senha = ? WHERE id = 'u1'", (cifrar_senha("nova"),))
+
+    assert database.credenciais_usuario("u1") == ("UPIN1", "nova")
+    assert database.credenciais_stats()["descartes"] == 1
+
+
+def test_cofre_sem_versao_disponivel_volta_ao_banco():
+    senhas = {"u1": "antiga"}
+
+    def falhar():
+        raise RuntimeError("banco indisponível")
+
+    cofre = CofreCredenciais(lambda uid: {"id": uid, "senha": senhas[uid]}, versao=falhar)
+    assert cofre.obter("u1")["senha"] == "antiga"
+    senhas["u1"] = "nova"
+    assert cofre.obter("u1")["senha"] == "nova"
+
+
+def test_leitor_com_linha_anterior_nao_sobrescreve_o_write_through(bancos, monkeypatch):
+    database.salvar_ou_atualizar_item_cubagem(_cubagem("A1", 0.3, 8))
+    database.cache_cubagem.clear()
+    ler = database._ler_item_cubagem
+    leituras = []
+
+    def ler_enquanto_outro_grava(item):
+        linha = ler(item)
+        if not leituras:
+            # O leitor já tem a linha antiga quando a nova cubagem é gravada
+            leituras.append(linha)
+            database.salvar_ou_atualizar_item_cubagem(_cubagem("A1", 0.45, 8))
+        return linha
+
+    monkeypatch.setattr(database, "_ler_item_cubagem", ler_enquanto_outro_grava)
+    assert database.get_item_cubagem("A1")["Altura"] == 0.3
+    assert database.get_item_cubagem("A1")["Altura"] == 0.45
+    assert database.cache_cubagem.stats()["descartados"] == 1
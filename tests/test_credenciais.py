@@ -0,0 +1,60 @@
+import pytest
+from cryptography.fernet import Fernet
+
+import credenciais
+from credenciais import ChaveCredenciaisInvalida
+
+
+@pytest.fixture
+def configurar(monkeypatch):
+    def _configurar(chave=None, caminho="", criar=False):
+        monkeypatch.setattr(credenciais, "CREDENCIAIS_CHAVE", chave)
+        monkeypatch.setattr(credenciais, "CREDENCIAIS_CHAVE_PATH", caminho)
+        monkeypatch.setattr(credenciais, "CREDENCIAIS_CRIAR_CHAVE", criar)
+        monkeypatch.setattr(credenciais, "_fernet", None)
+    return _configurar
+
+
+def test_sem_chave_configurada_falha(configurar):
+    configurar()
+    with pytest.raises(ChaveCredenciaisInvalida):
+        credenciais.exigir_chave()
+
+
+def test_caminho_relativo_falha(configurar):
+    configurar(caminho="credenciais.key")
+    with pytest.raises(ChaveCredenciaisInvalida, match="absoluto"):
+        credenciais.exigir_chave()
+
+
+def test_arquivo_ausente_nao_cria_chave_sem_flag(configurar, tmp_path):
+    caminho = tmp_path / "credenciais.key"
+    configurar(caminho=str(caminho))
+    with pytest.raises(ChaveCredenciaisInvalida):
+        credenciais.exigir_chave()
+    assert not caminho.exists()
+
+
+def test_flag_de_desenvolvimento_cria_e_reaproveita_a_chave(configurar, tmp_path):
+    caminho = tmp_path / "credenciais.key"
+    configurar(caminho=str(caminho), criar=True)
+    cifrada = credenciais.cifrar_senha("segredo")
+    assert caminho.exists()
+
+    configurar(caminho=str(caminho))
+    assert credenciais.decifrar_senha(cifrada) == "segredo"
+
+
+def test_chave_diferente_e_erro_de_configuracao(configurar, caplog):
+    configurar(chave=Fernet.generate_key().decode())
+    cifrada = credenciais.cifrar_senha("segredo")
+
+    configurar(chave=Fernet.generate_key().decode())
+    with pytest.raises(ChaveCredenciaisInvalida):
+        credenciais.decifrar_senha(cifrada)
+    assert "não corresponde" in caplog.text
+
+
+def test_senha_legada_em_texto_puro_volta_como_esta(configurar):
+    configurar(chave=Fernet.generate_key().decode())
+    assert credenciais.decifrar_senha("antiga") == "antiga"
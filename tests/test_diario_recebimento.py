@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+from diario_recebimento import DiarioRecebimento
+
+
+@pytest.fixture
+def diario(tmp_path):
+    return DiarioRecebimento(str(tmp_path / "diario.db"), lote=10, intervalo=0.05)
+
+
+def _registrar(diario, mov, locacao, evento="recebimento", **campos):
+    diario.registrar(evento, usuario_id="u1", upin="UP1", armazem="01", item="ITEM1", lote="L1", mov=mov,
+                     volume="2", qud="10", locacao=locacao, zona="PEQ", impressora="BRTEMAN01",
+                     job_impressao="job1", macro=f"01[tab]{mov}[tab][enter]{locacao}[enter][pf6]", **campos)
+
+
+def test_registro_volta_igual_na_consulta(diario):
+    _registrar(diario, "W000001", "PEQ001")
+    assert diario.descarregar()
+
+    [linha] = diario.consultar(mov="W000001")
+    assert linha["evento"] == "recebimento"
+    assert (linha["armazem"], linha["item"], linha["locacao"], linha["zona"]) == ("01", "ITEM1", "PEQ001", "PEQ")
+    assert linha["macro"] == "01[tab]W000001[tab][enter]PEQ001[enter][pf6]"
+    assert linha["registrado_em"] <= time.time()
+    assert diario.obter([linha["id"]]) == [linha]
+    assert diario.status()["gravadas"] == 1
+
+
+def test_consulta_filtra_e_ordena_do_mais_recente(diario):
+    for n in range(5):
+        _registrar(diario, f"W00000{n}", f"PEQ00{n}")
+    _registrar(diario, "W000001", "PEQ001", evento="reimpressao", origem_id=2)
+    assert diario.descarregar()
+
+    assert [l["locacao"] for l in diario.consultar(limite=3)] == ["PEQ001", "PEQ004", "PEQ003"]
+    assert [l["evento"] for l in diario.consultar(mov="W000001")] == ["reimpressao", "recebimento"]
+    assert diario.consultar(locacao="PEQ003", usuario_id="outro") == []
+    assert diario.itens_recentes() == ["ITEM1"]
+    assert list(diario.recebimentos_periodo("01", 0)) == [("ITEM1", "2", f"PEQ00{n}", "PEQ") for n in range(5)]
@@ -0,0 +1,48 @@
+import pytest
+
+import database
+
+
+class _IndiceFixo:
+    """Índice em memória com as locações livres fixas do teste."""
+
+    def __init__(self, livres):
+        self.livres = livres
+
+    def listar_livres(self, armazem, zonas):
+        return [l for l in self.livres if l[1] in zonas]
+
+
+@pytest.fixture
+def indice(monkeypatch):
+    livres = [("PEQ-105", "PEQ", 1.05), ("PEQ-110A", "PEQ", 1.10), ("PEQ-110B", "PEQ", 1.10),
+              ("PEQ-098", "PEQ", 0.98), ("MED-150", "MED", 1.50)]
+    monkeypatch.setattr(database, "indice_locacoes", _IndiceFixo(livres))
+    database.cache_candidatas.clear()
+    yield
+    database.cache_candidatas.clear()
+
+
+@pytest.mark.parametrize("altura, faixa", [
+    (1.0, 1.0), (1.01, 1.0), (1.05, 1.0), (1.09, 1.0), (1.10, 1.1), (0.3, 0.3), (0.0, 0.0),
+])
+def test_faixa_altura_arredonda_para_baixo(altura, faixa):
+    assert database._faixa_altura(altura) == faixa
+
+
+def test_locacao_entre_altura_pedida_e_proxima_faixa_e_oferecida(indice):
+    locacoes, _ = database.buscar_locacoes_candidatas("01", "PEQ", 1.01, 3, usuario_id="u1")
+    assert [l[0] for l in locacoes] == ["PEQ-105", "PEQ-110A", "PEQ-110B"]
+
+
+def test_cache_da_faixa_respeita_altura_exata(indice):
+    database.buscar_locacoes_candidatas("01", "PEQ", 1.01, 3, usuario_id="u1")
+    locacoes, do_cache = database.buscar_locacoes_candidatas("01", "PEQ", 1.06, 3, usuario_id="u1")
+    assert do_cache
+    assert [l[0] for l in locacoes] == ["PEQ-110A", "PEQ-110B"]
+    assert all(l[2] >= 1.06 for l in locacoes)
+
+
+def test_altura_igual_a_locacao_e_aceita(indice):
+    locacoes, _ = database.buscar_locacoes_candidatas("01", "PEQ", 1.05, 1, usuario_id="u1")
+    assert locacoes == [("PEQ-105", "PEQ", 1.05)]
@@ -0,0 +1,88 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import etiquetaszpl
+import fila_impressao
+from fila_impressao import FilaImpressao
+
+
+def _porta_fechada():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def impressora_desligada(monkeypatch):
+    monkeypatch.setitem(etiquetaszpl.IMPRESSORAS, "TESTE",
+                        dict(etiquetaszpl.IMPRESSORAS["BRTEMAN01"], ip="127.0.0.1", porta=_porta_fechada()))
+    monkeypatch.setattr(fila_impressao, "IMPRESSAO_PRAZO", 1.0)
+    return "TESTE"
+
+
+def _esperar(spooler, job_id, timeout=10):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        job = spooler.status_job(job_id)
+        if job["status"] in ("concluido", "erro"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} não terminou")
+
+
+def test_job_falha_dentro_do_prazo_e_chama_ao_falhar(impressora_desligada):
+    spooler = FilaImpressao()
+    falhas = []
+    avisado = threading.Event()
+
+    def ao_falhar(job_id, erro):
+        falhas.append((job_id, erro))
+        avisado.set()
+
+    inicio = time.monotonic()
+    job_id = spooler.enfileirar(["PEQ001"], zona="PEQ", movimentacao="W1", impressora=impressora_desligada,
+                                ao_falhar=ao_falhar)
+    job = _esperar(spooler, job_id)
+    assert avisado.wait(2)
+
+    assert time.monotonic() - inicio < fila_impressao.IMPRESSAO_PRAZO + 1
+    assert job["status"] == "erro" and job["erro"] == fila_impressao.ERRO_IMPRESSORA
+    assert falhas == [(job_id, fila_impressao.ERRO_IMPRESSORA)]
+
+
+def test_impressora_que_ja_falhou_recebe_uma_tentativa_so(impressora_desligada, monkeypatch):
+    monkeypatch.setattr(fila_impressao, "IMPRESSAO_PRAZO", 30.0)
+    monkeypatch.setattr(fila_impressao, "IMPRESSAO_MAX_TENTATIVAS", 2)
+    spooler = FilaImpressao()
+    _esperar(spooler, spooler.enfileirar(["PEQ001"], impressora=impressora_desligada))
+
+    inicio = time.monotonic()
+    job = _esperar(spooler, spooler.enfileirar(["PEQ002"], impressora=impressora_desligada))
+    assert job["status"] == "erro"
+    assert time.monotonic() - inicio < fila_impressao.IMPRESSAO_BACKOFF_INICIAL
+
+
+def test_job_concluido_nao_chama_ao_falhar(monkeypatch):
+    servidor = socket.socket()
+    servidor.bind(("127.0.0.1", 0))
+    servidor.listen()
+    recebido = []
+
+    def aceitar():
+        conexao, _ = servidor.accept()
+        with conexao:
+            recebido.append(conexao.recv(65536))
+
+    threading.Thread(target=aceitar, daemon=True).start()
+    monkeypatch.setitem(etiquetaszpl.IMPRESSORAS, "TESTE",
+                        dict(etiquetaszpl.IMPRESSORAS["BRTEMAN01"], ip="127.0.0.1", porta=servidor.getsockname()[1]))
+    spooler = FilaImpressao()
+    falhas = []
+    job = _esperar(spooler, spooler.enfileirar(["PEQ001"], impressora="TESTE", ao_falhar=lambda *a: falhas.append(a)))
+    servidor.close()
+
+    assert job["status"] == "concluido"
+    assert falhas == []
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+import gravador_macro
+from gravador_macro import CABECALHO_MACRO, RODAPE_MACRO, gravar_macros
+
+
+def _ler(diretorio, nome):
+    with open(os.path.join(diretorio, nome), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_macro_unica_com_nome_do_upin(tmp_path):
+    [nome] = gravar_macros(["01[tab]W1[enter]", 'A"1'], str(tmp_path), usuario="UP/IN1")
+    assert nome.startswith("macro_UPIN1_") and nome.endswith(".mac")
+    assert _ler(tmp_path, nome) == CABECALHO_MACRO + "01[tab]W1[enter]A&quot;1" + RODAPE_MACRO
+    assert os.listdir(tmp_path) == [nome]
+
+
+def test_divide_em_partes_a_cada_max_acoes(tmp_path):
+    nomes = gravar_macros([f"m{i}" for i in range(5)], str(tmp_path), usuario="UPIN1", max_acoes=2)
+    assert [n.rsplit("_", 1)[1] for n in nomes] == ["parte01.mac", "parte02.mac", "parte03.mac"]
+    assert [_ler(tmp_path, n) for n in nomes] == [
+        CABECALHO_MACRO + "m0m1" + RODAPE_MACRO,
+        CABECALHO_MACRO + "m2m3" + RODAPE_MACRO,
+        CABECALHO_MACRO + "m4" + RODAPE_MACRO,
+    ]
+
+
+def test_sem_entradas_nao_grava_nada(tmp_path):
+    assert gravar_macros(iter(()), str(tmp_path)) == []
+    assert os.listdir(tmp_path) == []
+
+
+def test_arquivo_final_so_aparece_pelo_rename(tmp_path, monkeypatch):
+    renomeados = []
+    replace = os.replace
+
+    def registrar(origem, destino):
+        # No momento do rename, o temporário já está completo e o .mac ainda não existe
+        assert os.path.basename(origem).startswith(".macro_") and origem.endswith(".tmp")
+        assert open(origem, encoding="utf-8").read().endswith(RODAPE_MACRO)
+        assert not os.path.exists(destino)
+        renomeados.append(destino)
+        replace(origem, destino)
+
+    monkeypatch.setattr(gravador_macro.os, "replace", registrar)
+    nomes = gravar_macros(["m1", "m2"], str(tmp_path), usuario="UPIN1", max_acoes=1)
+    assert renomeados == [os.path.join(str(tmp_path), n) for n in nomes]
+    assert sorted(os.listdir(tmp_path)) == sorted(nomes)
+
+
+def test_falha_na_escrita_remove_os_temporarios(tmp_path):
+    def entradas():
+        yield "m1"
+        yield "m2"
+        raise OSError("disco cheio")
+
+    with pytest.raises(OSError):
+        gravar_macros(entradas(), str(tmp_path), usuario="UPIN1", max_acoes=1)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,91 @@
+import csv
+
+import pytest
+
+import database
+from banco_sqlite import BancoSQLite
+from importador_cubagem import LinhaInvalida, importar_arquivo, ler_registros, validar_registro
+
+
+@pytest.fixture(autouse=True)
+def banco_itens(monkeypatch, tmp_path):
+    banco = BancoSQLite(str(tmp_path / "Itens.db"), migracoes=database.banco_itens.migracoes, nome="Itens.db")
+    monkeypatch.setattr(database, "banco_itens", banco)
+    monkeypatch.setattr(database, "_versao_cache_cubagem", None)
+    return banco
+
+
+def _csv(caminho, linhas, separador=";"):
+    with open(caminho, "w", newline="", encoding="utf-8-sig") as f:
+        csv.writer(f, delimiter=separador).writerows(linhas)
+    return str(caminho)
+
+
+def test_cabecalho_com_sinonimos_acentos_e_separador(tmp_path):
+    caminho = _csv(tmp_path / "cadastro.csv", [
+        ["Código", "Comp.", "Larg", "Altura", "Cx Lastro", "Descrição"],
+        ["A1", "0,5", "0,4", "0,3", "8", "ignorada"],
+        ["", "", "", "", "", ""],
+        ["A2", "1.234,5", "", "", "", ""],
+    ], separador=",")
+    assert list(ler_registros(caminho)) == [
+        (2, {"Item": "A1", "Comprimento": "0,5", "Largura": "0,4", "Altura": "0,3", "Cx_Lastro": "8"}),
+        (4, {"Item": "A2", "Comprimento": "1.234,5", "Largura": "", "Altura": "", "Cx_Lastro": ""}),
+    ]
+
+
+def test_arquivo_sem_coluna_item_ou_formato_desconhecido(tmp_path):
+    with pytest.raises(ValueError, match="coluna Item"):
+        list(ler_registros(_csv(tmp_path / "cadastro.csv", [["Altura", "Largura"], ["1", "2"]])))
+    with pytest.raises(ValueError, match="Formato não suportado"):
+        list(ler_registros(str(tmp_path / "cadastro.txt")))
+
+
+def test_validacao_converte_como_o_modal():
+    registro = {"Item": 123.0, "Comprimento": "0,5", "Largura": 0.4, "Altura": "0.3", "Cx_Lastro": "8"}
+    assert validar_registro(registro) == ("123", 0.5, 0.4, 0.3, 0.06, 8)
+    assert validar_registro({"Item": " B1 ", "Cubagem": ""}) == ("B1", None, None, None, None, None)
+
+
+@pytest.mark.parametrize("registro, motivo", [
+    ({"Item": ""}, "Item vazio"),
+    ({"Item": "X", "Altura": "abc"}, "Altura não numérico"),
+    ({"Item": "X", "Largura": "-1"}, "Largura inválido"),
+    ({"Item": "X", "Cx_Lastro": "2,5"}, "Cx_Lastro deve ser inteiro"),
+])
+def test_linhas_invalidas(registro, motivo):
+    with pytest.raises(LinhaInvalida, match=motivo):
+        validar_registro(registro)
+
+
+def test_importacao_grava_em_lotes_e_relata_pendencias(tmp_path, banco_itens):
+    caminho = _csv(tmp_path / "cadastro.csv", [
+        ["Item", "Comprimento", "Largura", "Altura", "Cubagem", "Cx_Lastro"],
+        ["A1", "0,5", "0,4", "0,3", "", "8"],
+        ["A2", "abc", "", "", "", ""],
+        ["A3", "1", "1", "", "", ""],
+        ["A4", "1", "1", "1", "1", "4"],
+    ])
+    relatorio = tmp_path / "relatorios" / "faltantes.csv"
+    progresso = []
+
+    resumo = importar_arquivo(caminho, lote=2, relatorio=str(relatorio), progresso=progresso.append)
+
+    assert (resumo["lidas"], resumo["gravadas"], resumo["invalidas"], resumo["incompletos"]) == (4, 3, 1, 1)
+    assert resumo["erros"] == [{"linha": 3, "item": "A2", "motivo": "Comprimento não numérico: 'abc'"}]
+    assert resumo["amostra_incompletos"] == [{"item": "A3", "faltando": ["Altura", "Cubagem", "Cx_Lastro"]}]
+    assert [p["gravadas"] for p in progresso] == [2, 3]
+    assert tuple(banco_itens.consultar_um("SELECT Cubagem, Cx_Lastro FROM Itens_cubagem WHERE Item = 'A1'")) == (0.06, 8)
+
+    with open(relatorio, encoding="utf-8-sig") as f:
+        assert list(csv.reader(f, delimiter=";")) == [
+            ["Item", "Situacao", "Detalhe"],
+            ["A2", "linha_invalida", "linha 3: Comprimento não numérico: 'abc'"],
+            ["A3", "incompleto", "Altura,Cubagem,Cx_Lastro"],
+        ]
+
+
+def test_campo_vazio_nao_apaga_valor_cadastrado(tmp_path, banco_itens):
+    importar_arquivo(_csv(tmp_path / "a.csv", [["Item", "Altura", "Cx_Lastro"], ["A1", "0,3", "8"]]))
+    importar_arquivo(_csv(tmp_path / "b.csv", [["Item", "Altura", "Cx_Lastro"], ["A1", "", "10"]]))
+    assert tuple(banco_itens.consultar_um("SELECT Altura, Cx_Lastro FROM Itens_cubagem WHERE Item = 'A1'")) == (0.3, 10)
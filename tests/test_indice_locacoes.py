@@ -0,0 +1,44 @@
+import pytest
+
+from indice_locacoes import IndiceLocacoes
+
+
+CADASTRO = {"01": [("PEQ001", "PEQ", 1.20), ("PEQ002", "PEQ", 1.50)]}
+
+
+@pytest.fixture
+def criar_indice(monkeypatch):
+    def _criar(armazens=None):
+        indice = IndiceLocacoes(lambda armazem: CADASTRO.get(armazem, []), lambda armazem: ["PEQ002"],
+                                armazens=armazens)
+        monkeypatch.setattr(indice, "iniciar", lambda: None)
+        return indice
+    return _criar
+
+
+def test_armazens_configurados_nao_recebem_codigos_das_consultas(criar_indice):
+    indice = criar_indice(armazens=["01"])
+    for armazem in ["02", "XYZ", "01"]:
+        assert indice.buscar(armazem, ["PEQ"], 1.0) is None
+    assert indice._pendentes == set()
+    assert sorted(indice.status()["armazens"]) == ["01"]
+
+
+def test_codigo_consultado_so_entra_se_existir_na_ile(criar_indice):
+    indice = criar_indice()
+    for armazem in ["01", "99", "../x", "01"]:
+        indice.listar_livres(armazem, ["PEQ"])
+    assert indice._pendentes == {"01", "99"}
+
+    indice._validar_pendentes()
+    assert sorted(indice.status()["armazens"]) == ["01"]
+    assert indice.buscar("01", ["PEQ"], 1.0) == ("PEQ001", "PEQ", 1.20)
+    assert indice.buscar("99", ["PEQ"], 1.0) is None
+    assert "99" not in indice._mestre and indice._pendentes == set()
+
+
+def test_fila_de_validacao_e_limitada(criar_indice):
+    indice = criar_indice()
+    for n in range(50):
+        indice.registrar_armazem(f"A{n}")
+    assert len(indice._pendentes) == 8
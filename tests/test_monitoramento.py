@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+import app as aplicacao
+from diario_recebimento import DiarioRecebimento
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    monkeypatch.setattr(aplicacao, "MONITORAMENTO_TOKEN", "segredo-coletor")
+    return aplicacao.app.test_client()
+
+
+@pytest.mark.parametrize("rota", ["/status", "/metrics"])
+def test_monitoramento_sem_login_nem_token_e_recusado(cliente, rota):
+    assert cliente.get(rota).status_code == 401
+    assert cliente.get(rota, headers={"Authorization": "Bearer outro"}).status_code == 401
+
+
+@pytest.mark.parametrize("rota", ["/status", "/metrics"])
+def test_monitoramento_com_token_do_coletor(cliente, rota):
+    assert cliente.get(rota, headers={"Authorization": "Bearer segredo-coletor"}).status_code == 200
+
+
+def test_monitoramento_sem_token_configurado_nao_aceita_bearer_vazio(cliente, monkeypatch):
+    monkeypatch.setattr(aplicacao, "MONITORAMENTO_TOKEN", "")
+    assert cliente.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 401
+
+
+def test_status_com_usuario_logado(cliente):
+    with cliente.session_transaction() as sessao:
+        sessao["usuario_id"] = "u1"
+    assert cliente.get("/status").status_code == 200
+
+
+def test_status_da_impressao_exige_login(cliente):
+    assert cliente.get("/impressao/abc").status_code == 302
+    with cliente.session_transaction() as sessao:
+        sessao["usuario_id"] = "u1"
+    assert cliente.get("/impressao/abc").status_code == 404
+
+
+def test_job_de_outro_worker_nao_vira_404(cliente, monkeypatch, tmp_path):
+    diario = DiarioRecebimento(str(tmp_path / "diario.db"), lote=10, intervalo=0.05)
+    monkeypatch.setattr(aplicacao, "diario_recebimento", diario)
+    with cliente.session_transaction() as sessao:
+        sessao["usuario_id"] = "u1"
+        sessao["impressoes_pendentes"] = [{"job": "job-outro", "criado_em": time.time()},
+                                          {"job": "job-falhou", "criado_em": time.time()}]
+    diario.registrar("falha_impressao", usuario_id="u1", job_impressao="job-falhou")
+    assert diario.descarregar()
+
+    assert cliente.get("/impressao/job-outro").get_json()["status"] == "desconhecido"
+    assert cliente.get("/impressao/job-falhou").get_json()["status"] == "erro"
+    assert cliente.get("/impressao/job-alheio").status_code == 404
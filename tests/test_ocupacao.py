@@ -0,0 +1,15 @@
+import app as aplicacao
+from ocupacao import analise_ocupacao
+
+
+def test_painel_nao_inicia_a_captura(monkeypatch):
+    iniciadas = []
+    monkeypatch.setattr(analise_ocupacao, "iniciar", lambda: iniciadas.append(1))
+    monkeypatch.setattr(analise_ocupacao, "painel", lambda armazem, janela: {"armazem": armazem})
+    cliente = aplicacao.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao["usuario_id"] = "u1"
+
+    for _ in range(3):
+        assert cliente.get("/ocupacao?armazem=01").status_code == 200
+    assert iniciadas == []
@@ -0,0 +1,32 @@
+from alturas import calcular_altura, zonas_por_altura
+from planejador import calcular_alturas, planejar
+
+
+def test_alturas_vetorizadas_iguais_a_busca_unitaria():
+    volumes = [1, 7, 8, 9, 33, 120]
+    esperado = [calcular_altura(v, 8, 0.23) for v in volumes]
+    assert calcular_alturas(volumes, 8, 0.23).tolist() == esperado
+
+
+def test_pallets_altos_escolhem_primeiro_e_ficam_com_a_menor_locacao():
+    locacoes = [("PEQ1", "PEQ", 1.0), ("MED1", "MED", 1.35), ("MED2", "MED", 1.2), ("RUA1", "rua", 3.0)]
+    alturas = [0.9, 1.3, 1.15, 2.5]
+    plano = planejar(alturas, [zonas_por_altura(a) for a in alturas], locacoes)
+    assert plano == [("PEQ1", "PEQ", 1.0), ("MED1", "MED", 1.35), ("MED2", "MED", 1.2), ("RUA1", "RUA", 3.0)]
+
+
+def test_locacao_recusada_passa_para_a_proxima():
+    locacoes = [("PEQ1", "PEQ", 1.0), ("PEQ2", "PEQ", 1.0)]
+    tentadas = []
+
+    def tomar(loc):
+        tentadas.append(loc)
+        return loc != "PEQ1"
+
+    assert planejar([0.5, 0.5], [["PEQ"], ["PEQ"]], locacoes, tomar) == [("PEQ2", "PEQ", 1.0), None]
+    assert tentadas == ["PEQ1", "PEQ2"]
+
+
+def test_sem_locacao_que_comporte_o_pallet():
+    assert planejar([1.5], [["PEQ", "MED"]], [("PEQ1", "PEQ", 1.0)]) == [None]
+    assert planejar([], [], [("PEQ1", "PEQ", 1.0)]) == []
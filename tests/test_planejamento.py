@@ -0,0 +1,100 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app as aplicacao
+import database
+from reservas import ReservasLocacao
+
+CUBAGEM = {"Item": "ITEM1", "Comprimento": 1.0, "Largura": 1.0, "Altura": 0.2, "Cubagem": 0.2, "Cx_Lastro": 8}
+LIVRES = [("PEQ001", "PEQ", 1.0), ("PEQ002", "PEQ", 1.0), ("MED001", "MED", 1.35)]
+
+
+@pytest.fixture
+def reservas(monkeypatch, tmp_path):
+    reservas = ReservasLocacao(str(tmp_path / "reservas.db"), ttl=14400)
+    monkeypatch.setattr(database, "reservas", reservas)
+    monkeypatch.setattr(database, "indice_locacoes", None)
+    return reservas
+
+
+@pytest.fixture
+def cliente(monkeypatch, reservas):
+    monkeypatch.setattr(aplicacao, "get_item_cubagem", lambda item: dict(CUBAGEM, Item=item))
+    monkeypatch.setattr(aplicacao, "carregar_locacoes_livres",
+                        lambda armazem, zonas, altura_min, usuario_id: [l for l in LIVRES if l[1] in zonas])
+    monkeypatch.setattr(aplicacao, "fetch_data", lambda *a, **k: SimpleNamespace(classe="1"))
+    monkeypatch.setattr(aplicacao, "enfileirar_etiqueta", lambda *a, **k: None)
+    monkeypatch.setattr(aplicacao, "PLANEJAMENTO_RESERVA_TTL", 600)
+    cliente = aplicacao.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao["usuario_id"] = "u1"
+        sessao["upin"] = "UP1"
+    return cliente
+
+
+def _planejar(cliente, volumes, reservar=True):
+    resposta = cliente.post("/planejar_recebimento", json={
+        "armazem": "01", "reservar": reservar, "paletes": [{"item": "ITEM1", "volume": v} for v in volumes]})
+    assert resposta.status_code == 200
+    return resposta.get_json()
+
+
+def _expira_em(reservas, locacao):
+    return reservas.banco.consultar_um("SELECT expira_em FROM reservas_locacao WHERE locacao = ?", (locacao,))[0]
+
+
+def _plano(cliente):
+    with cliente.session_transaction() as sessao:
+        return sessao.get("plano_recebimento")
+
+
+def test_plano_reservado_tem_validade_curta_e_fica_na_sessao(cliente, reservas):
+    resposta = _planejar(cliente, [8, 16])
+    assert resposta["alocados"] == 2
+    assert reservas.reservadas("01") == {"PEQ001", "PEQ002"}
+    assert _expira_em(reservas, "PEQ001") <= time.time() + 600
+    assert sorted(p["locacao"] for p in _plano(cliente)["locacoes"]) == ["PEQ001", "PEQ002"]
+
+
+def test_plano_sem_reserva_nao_vai_para_a_sessao(cliente, reservas):
+    _planejar(cliente, [8], reservar=False)
+    assert reservas.reservadas("01") == set()
+    assert _plano(cliente) is None
+
+
+def test_consultar_usa_a_locacao_planejada(cliente, reservas, monkeypatch):
+    _planejar(cliente, [8, 16])
+    buscas = []
+    monkeypatch.setattr(aplicacao, "fetch_locacao_zonas", lambda **k: buscas.append(k) or (None, None))
+
+    resposta = cliente.post("/", data={"action": "consultar", "item": "ITEM1", "lote": "L1", "Mov": "W000001",
+                                       "Armazem": "01", "Volume": "8", "QUD": "10", "Impressora": "BRTEMAN01"})
+    assert resposta.status_code == 200 and buscas == []
+
+    [restante] = _plano(cliente)["locacoes"]
+    usada = ({"PEQ001", "PEQ002"} - {restante["locacao"]}).pop()
+    assert _expira_em(reservas, usada) > time.time() + 3600
+    with cliente.session_transaction() as sessao:
+        assert list(sessao.buffer("locacoes_buffer")) == [f"01\t{usada}"]
+
+
+def test_novo_plano_libera_o_anterior(cliente, reservas):
+    _planejar(cliente, [8, 16])
+    _planejar(cliente, [8])
+    assert len(reservas.reservadas("01")) == 1
+    assert len(_plano(cliente)["locacoes"]) == 1
+
+
+def test_liberar_planejamento(cliente, reservas):
+    _planejar(cliente, [8, 16])
+    resposta = cliente.post("/liberar_planejamento")
+    assert resposta.get_json() == {"success": True, "liberadas": 2}
+    assert reservas.reservadas("01") == set()
+    assert _plano(cliente) is None
+    assert cliente.post("/liberar_planejamento").get_json()["liberadas"] == 0
+
+
+def test_liberar_planejamento_exige_login():
+    assert aplicacao.app.test_client().post("/liberar_planejamento").status_code == 401
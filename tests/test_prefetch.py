@@ -0,0 +1,91 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app as aplicacao
+import database
+from reservas import ReservasLocacao
+
+
+@pytest.fixture
+def reservas(monkeypatch, tmp_path):
+    reservas = ReservasLocacao(str(tmp_path / "reservas.db"), ttl=14400)
+    monkeypatch.setattr(database, "reservas", reservas)
+    monkeypatch.setattr(database, "indice_locacoes", None)
+    return reservas
+
+
+@pytest.fixture
+def cliente(monkeypatch, reservas):
+    livres = ["PEQ001", "PEQ002", "PEQ003"]
+
+    def buscar(armazem, item, volume, dono=None, usuario_id=None, ttl=None):
+        for loc in livres:
+            if database.reservar_locacao(armazem, loc, dono, ttl):
+                return loc, "PEQ"
+        return None, None
+
+    monkeypatch.setattr(aplicacao, "get_item_cubagem", lambda item: {"Altura": 0.2, "Cx_Lastro": 8})
+    monkeypatch.setattr(aplicacao, "buscar_locacao_com_fallback", buscar)
+    monkeypatch.setattr(aplicacao, "fetch_data", lambda *a, **k: SimpleNamespace(classe="1"))
+    cliente = aplicacao.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao["usuario_id"] = "u1"
+    return cliente
+
+
+def _prefetch(cliente, volume):
+    return cliente.post("/prefetch_consulta", json={"Armazem": "01", "item": "ITEM1", "Volume": volume}).get_json()
+
+
+def _consultado_com_prefetch_atrasado(cliente, reservas):
+    """Estado deixado por um prefetch que terminou depois do "Consultar" que usou a locação dele."""
+    assert _prefetch(cliente, "8")["locacao"] == "PEQ001"
+    assert database.confirmar_reserva_locacao("01", "PEQ001", "u1")
+    with cliente.session_transaction() as sessao:
+        sessao.anexar_buffer("locacoes_buffer", "01\tPEQ001")
+
+
+def test_prefetch_com_outros_dados_nao_libera_locacao_ja_confirmada(cliente, reservas):
+    _prefetch(cliente, "8")
+    assert database.confirmar_reserva_locacao("01", "PEQ001", "u1")
+    assert _prefetch(cliente, "16")["locacao"] == "PEQ002"
+    assert reservas.reservada("01", "PEQ001")
+
+
+def test_prefetch_provisorio_trocado_e_liberado(cliente, reservas):
+    _prefetch(cliente, "8")
+    assert _prefetch(cliente, "")["success"] is False
+    assert reservas.reservadas("01") == set()
+
+
+def test_prefetch_com_locacao_ja_na_macro_e_descartado(cliente, reservas):
+    _consultado_com_prefetch_atrasado(cliente, reservas)
+    # Mesmo pallet de novo: o prefetch antigo não é reaproveitado nem liberado
+    assert _prefetch(cliente, "8")["locacao"] == "PEQ002"
+    assert reservas.reservadas("01") == {"PEQ001", "PEQ002"}
+
+
+def test_consultar_nao_reaproveita_prefetch_com_locacao_da_macro(cliente, reservas, monkeypatch):
+    _consultado_com_prefetch_atrasado(cliente, reservas)
+    monkeypatch.setattr(aplicacao, "enfileirar_etiqueta", lambda *a, **k: None)
+    monkeypatch.setattr(aplicacao, "get_item_cubagem", lambda item: {
+        "Comprimento": 1, "Largura": 1, "Altura": 0.2, "Cubagem": 0.2, "Cx_Lastro": 8})
+
+    cliente.post("/", data={"action": "consultar", "item": "ITEM1", "lote": "L1", "Mov": "W000002",
+                            "Armazem": "01", "Volume": "8", "QUD": "10", "Impressora": "BRTEMAN01"})
+    with cliente.session_transaction() as sessao:
+        assert list(sessao.buffer("locacoes_buffer")) == ["01\tPEQ001", "01\tPEQ002"]
+    assert reservas.reservadas("01") == {"PEQ001", "PEQ002"}
+
+
+def test_liberar_reserva_provisoria_respeita_confirmacao(reservas):
+    assert database.reservar_locacao("01", "A01", "u1", ttl=120)
+    assert database.reservar_locacao("01", "A02", "u1", ttl=120)
+    assert database.confirmar_reserva_locacao("01", "A02", "u1")
+
+    database.liberar_reserva_provisoria("01", "A01", "u1", 120)
+    database.liberar_reserva_provisoria("01", "A02", "u1", 120)
+    assert reservas.reservadas("01") == {"A02"}
+    assert reservas.banco.consultar_um("SELECT expira_em FROM reservas_locacao")[0] > time.time() + 3600
@@ -0,0 +1,136 @@
+import re
+import time
+from contextlib import contextmanager
+
+import pytest
+
+import database
+from reservas import ReservasLocacao
+
+
+@pytest.fixture
+def reservas(tmp_path):
+    return ReservasLocacao(str(tmp_path / "reservas.db"), ttl=60)
+
+
+def test_reivindicar_locacao_livre(reservas):
+    assert reservas.reivindicar("01", "A01", "u1")
+    assert reservas.reservada("01", "A01")
+    assert reservas.reservadas("01") == {"A01"}
+    assert reservas.reservadas("02") == set()
+
+
+def test_outro_dono_nao_toma_reserva_valida(reservas):
+    assert reservas.reivindicar("01", "A01", "u1")
+    assert not reservas.reivindicar("01", "A01", "u2")
+
+
+def test_mesmo_dono_nao_recebe_a_mesma_locacao_de_novo(reservas):
+    assert reservas.reivindicar("01", "A01", "u1")
+    assert not reservas.reivindicar("01", "A01", "u1")
+
+
+def test_reserva_expirada_pode_ser_tomada(reservas):
+    assert reservas.reivindicar("01", "A01", "u1", ttl=-1)
+    assert not reservas.reservada("01", "A01")
+    assert reservas.reivindicar("01", "A01", "u2")
+    assert reservas.reservadas("01") == {"A01"}
+
+
+def test_confirmar_renova_so_a_reserva_valida_do_dono(reservas):
+    assert reservas.reivindicar("01", "A01", "u1", ttl=5)
+    assert not reservas.confirmar("01", "A01", "u2")
+    assert reservas.confirmar("01", "A01", "u1", ttl=120)
+    expira_em = reservas.banco.consultar_um("SELECT expira_em FROM reservas_locacao")[0]
+    assert expira_em > time.time() + 100
+
+    assert reservas.reivindicar("01", "A02", "u1", ttl=-1)
+    assert not reservas.confirmar("01", "A02", "u1")
+
+
+def test_liberar_respeita_o_dono(reservas):
+    reservas.reivindicar("01", "A01", "u1")
+    reservas.liberar("01", "A01", "u2")
+    assert reservas.reservada("01", "A01")
+    reservas.liberar("01", "A01", "u1")
+    assert not reservas.reservada("01", "A01")
+    assert reservas.status()["ativas"] == 0
+
+
+class _CursorILE:
+    """Cursor que devolve as linhas da ILE respeitando OFFSET/FETCH FIRST da consulta."""
+
+    def __init__(self, linhas, consultas):
+        self.linhas = linhas
+        self.consultas = consultas
+        self.resultado = []
+
+    def execute(self, query, params):
+        offset, quantidade = map(int, re.search(r"OFFSET (\d+) ROWS FETCH FIRST (\d+) ROWS", query).groups())
+        self.consultas.append((offset, quantidade))
+        self.resultado = self.linhas[offset:offset + quantidade]
+
+    def fetchall(self):
+        return self.resultado
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def ile(monkeypatch, reservas):
+    linhas = [(f"PEQ{i:04d}", 1.20, "PEQ") for i in range(300)]
+    consultas = []
+
+    @contextmanager
+    def conexao_pool(uid, pwd):
+        class _Conexao:
+            def cursor(self):
+                return _CursorILE(linhas, consultas)
+        yield _Conexao()
+
+    monkeypatch.setattr(database, "reservas", reservas)
+    monkeypatch.setattr(database, "indice_locacoes", None)
+    monkeypatch.setattr(database, "conexao_pool", conexao_pool)
+    monkeypatch.setattr(database, "credenciais_usuario", lambda usuario_id: ("UID", "PWD"))
+    monkeypatch.setattr(database, "calcular_altura_item", lambda item, volume: (1.0, None))
+    return linhas, consultas
+
+
+def test_busca_passa_das_locacoes_reservadas(ile, reservas):
+    linhas, consultas = ile
+    for loc, _, _ in linhas[:150]:
+        reservas.reivindicar("01", loc, "outro")
+
+    endereco, zona = database.fetch_locacao_zonas(["PEQ"], "01", 1, "ITEM", dono="u1", usuario_id="u1")
+    assert (endereco, zona) == ("PEQ0150", "PEQ")
+    assert reservas.reservada("01", "PEQ0150")
+    assert len(consultas) == 1
+
+
+def test_busca_pagina_ate_acabar_o_resultado(ile, reservas, monkeypatch):
+    linhas, consultas = ile
+    monkeypatch.setattr(database, "LOCACAO_CANDIDATOS_POR_PAGINA", 5)
+    monkeypatch.setattr(reservas, "reservadas", lambda armazem: set())
+    # Reservas que a consulta não enxerga (ex.: outro processo reservando entre a leitura e a tomada)
+    for loc, _, _ in linhas[:297]:
+        reservas.reivindicar("01", loc, "outro")
+
+    assert database.fetch_locacao_zonas(["PEQ"], "01", 1, "ITEM", dono="u1", usuario_id="u1") == ("PEQ0297", "PEQ")
+    assert len(consultas) == 60
+
+
+def test_reservas_da_macro_gravada_ficam_curtas(monkeypatch, reservas):
+    monkeypatch.setattr(database, "reservas", reservas)
+    monkeypatch.setattr(database, "indice_locacoes", None)
+    reservas.reivindicar("01", "A01", "u1")
+    reservas.reivindicar("01", "A02", "u1")
+
+    monkeypatch.setattr(database, "RESERVA_TTL_GRAVADA", 10)
+    database.encerrar_reservas_gravadas([("01", "A01")], "u1")
+    expira_em = reservas.banco.consultar_um("SELECT expira_em FROM reservas_locacao WHERE locacao = 'A01'")[0]
+    assert expira_em <= time.time() + 10
+
+    monkeypatch.setattr(database, "RESERVA_TTL_GRAVADA", 0)
+    database.encerrar_reservas_gravadas([("01", "A02")], "u1")
+    assert reservas.reservadas("01") == {"A01"}
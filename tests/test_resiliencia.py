@@ -0,0 +1,132 @@
+import pytest
+
+import resiliencia
+from resiliencia import BPCSIndisponivel, Disjuntor, executar_bpcs
+
+
+class ErroODBC(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def sem_espera(monkeypatch):
+    monkeypatch.setattr(resiliencia, "_espera_backoff", lambda tentativa: 0)
+
+
+def _abrir(disjuntor):
+    for _ in range(disjuntor.limite_falhas):
+        assert disjuntor.permitir()
+        disjuntor.registrar_falha()
+
+
+def test_abre_apos_o_limite_de_falhas_seguidas():
+    disjuntor = Disjuntor(limite_falhas=3, tempo_aberto=60)
+    disjuntor.registrar_falha()
+    disjuntor.registrar_sucesso()
+    disjuntor.registrar_falha()
+    disjuntor.registrar_falha()
+    assert disjuntor.estado == Disjuntor.FECHADO
+
+    disjuntor.registrar_falha()
+    assert disjuntor.estado == Disjuntor.ABERTO
+    assert not disjuntor.permitir()
+    assert disjuntor.status()["aberturas"] == 1 and disjuntor.status()["rejeitadas"] == 1
+
+
+def test_meio_aberto_libera_uma_chamada_de_teste():
+    disjuntor = Disjuntor(limite_falhas=2, tempo_aberto=0)
+    _abrir(disjuntor)
+
+    assert disjuntor.permitir()
+    assert disjuntor.estado == Disjuntor.MEIO_ABERTO
+    assert not disjuntor.permitir()
+
+    disjuntor.registrar_sucesso()
+    assert disjuntor.estado == Disjuntor.FECHADO and disjuntor.falhas_seguidas == 0
+    assert disjuntor.permitir() and disjuntor.permitir()
+
+
+def test_falha_no_teste_reabre():
+    disjuntor = Disjuntor(limite_falhas=2, tempo_aberto=0)
+    _abrir(disjuntor)
+    assert disjuntor.permitir()
+    disjuntor.registrar_falha()
+    assert disjuntor.estado == Disjuntor.ABERTO
+    assert disjuntor.status()["aberturas"] == 2
+
+
+def test_teste_sem_resposta_libera_nova_tentativa():
+    disjuntor = Disjuntor(limite_falhas=1, tempo_aberto=0)
+    _abrir(disjuntor)
+    assert disjuntor.permitir()
+    disjuntor.liberar_teste()
+    assert disjuntor.estado == Disjuntor.MEIO_ABERTO
+    assert disjuntor.permitir()
+
+
+def test_executar_repete_erro_transitorio_e_abre_o_disjuntor():
+    disjuntor = Disjuntor(limite_falhas=3, tempo_aberto=60)
+    chamadas = []
+
+    def operacao():
+        chamadas.append(1)
+        raise ErroODBC("08S01", "Communication link failure")
+
+    with pytest.raises(BPCSIndisponivel):
+        executar_bpcs(operacao, tentativas=3, disjuntor=disjuntor)
+    assert len(chamadas) == 3 and disjuntor.estado == Disjuntor.ABERTO
+
+    with pytest.raises(BPCSIndisponivel):
+        executar_bpcs(operacao, tentativas=3, disjuntor=disjuntor)
+    assert len(chamadas) == 3
+
+
+def test_executar_recupera_na_retentativa():
+    disjuntor = Disjuntor(limite_falhas=5, tempo_aberto=60)
+    respostas = iter([ErroODBC("08S01", "timeout"), "ok"])
+
+    def operacao():
+        resposta = next(respostas)
+        if isinstance(resposta, Exception):
+            raise resposta
+        return resposta
+
+    assert executar_bpcs(operacao, disjuntor=disjuntor) == "ok"
+    assert disjuntor.falhas_seguidas == 0 and disjuntor.contadores["retentativas"] == 1
+
+
+def test_executar_nao_repete_autenticacao_nem_erro_de_comando():
+    disjuntor = Disjuntor(limite_falhas=1, tempo_aberto=60)
+    chamadas = []
+
+    def senha_errada():
+        chamadas.append(1)
+        raise ErroODBC("28000", "[IBM] CWBSY0002 - Password for user is not correct")
+
+    def sql_invalido():
+        chamadas.append(1)
+        raise ErroODBC("42S02", "Table not found")
+
+    with pytest.raises(ValueError, match="Senha do BPCS incorreta"):
+        executar_bpcs(senha_errada, disjuntor=disjuntor)
+    with pytest.raises(ErroODBC):
+        executar_bpcs(sql_invalido, disjuntor=disjuntor)
+    assert len(chamadas) == 2
+    assert disjuntor.estado == Disjuntor.FECHADO
+
+
+def test_esperas_da_retentativa_limitadas_ao_total(monkeypatch):
+    esperas = []
+    monkeypatch.setattr(resiliencia, "_espera_backoff", lambda tentativa: 1.0)
+    monkeypatch.setattr(resiliencia, "ESPERA_TOTAL_MAXIMA", 1.5)
+    monkeypatch.setattr(resiliencia.time, "sleep", esperas.append)
+    disjuntor = Disjuntor(limite_falhas=10, tempo_aberto=60)
+    chamadas = []
+
+    def operacao():
+        chamadas.append(1)
+        raise ErroODBC("08S01", "Communication link failure")
+
+    with pytest.raises(BPCSIndisponivel):
+        executar_bpcs(operacao, tentativas=10, disjuntor=disjuntor)
+    assert esperas == [1.0, 0.5] and len(chamadas) == 3
@@ -0,0 +1,146 @@
+import pytest
+from flask import Flask
+from itsdangerous import Signer
+
+from sessao_servidor import BackendMemoria, BackendSQLite, InterfaceSessaoServidor
+
+
+@pytest.fixture(params=["memoria", "sqlite"])
+def backend(request, tmp_path):
+    return BackendMemoria() if request.param == "memoria" else BackendSQLite(str(tmp_path / "sessoes.db"))
+
+
+@pytest.fixture
+def app(backend):
+    app = Flask(__name__)
+    app.secret_key = "teste"
+    app.session_interface = InterfaceSessaoServidor(backend)
+    return app
+
+
+def _abrir(app, cookie=None):
+    interface = app.session_interface
+    with app.test_request_context(headers={"Cookie": f"session={cookie}"} if cookie else {}):
+        from flask import request
+        return interface.open_session(app, request)
+
+
+def _salvar(app, sessao):
+    resposta = app.response_class()
+    app.session_interface.save_session(app, sessao, resposta)
+    return resposta
+
+
+def _cookie(resposta):
+    return resposta.headers["Set-Cookie"].split(";", 1)[0].split("=", 1)[1]
+
+
+def test_requisicoes_simultaneas_gravam_so_as_proprias_chaves(app, backend):
+    sessao = _abrir(app)
+    sessao.update(usuario_id="u1", prefetch={"locacao": "A01"})
+    cookie = _cookie(_salvar(app, sessao))
+
+    consultar = _abrir(app, cookie)
+    prefetch = _abrir(app, cookie)
+    consultar.pop("prefetch")
+    consultar["impressoes_pendentes"] = [{"job": "j1"}]
+    prefetch["prefetch"] = {"locacao": "A02"}
+    _salvar(app, consultar)
+    _salvar(app, prefetch)
+
+    dados = backend.carregar(consultar.sid)
+    assert dados["impressoes_pendentes"] == [{"job": "j1"}]
+    assert dados["prefetch"] == {"locacao": "A02"}
+    assert dados["usuario_id"] == "u1"
+
+
+def test_cookie_leva_so_o_id_assinado(app, backend):
+    sessao = _abrir(app)
+    sessao.update(usuario_id="u1", upin="UPIN1")
+    cookie = _cookie(_salvar(app, sessao))
+
+    assert "u1" not in cookie and "UPIN1" not in cookie
+    assert Signer("teste", salt="sessao-servidor").unsign(cookie).decode() == sessao.sid
+    assert _abrir(app, cookie)["usuario_id"] == "u1"
+    assert _abrir(app, cookie[:-2] + "xx").new
+
+
+def test_buffer_anexar_contar_iterar_e_remover(app):
+    sessao = _abrir(app)
+    sessao["usuario_id"] = "u1"
+    assert sessao.contar_buffer("macro_buffer") == 0
+    for macro in ("m1", "m2", "m1"):
+        sessao.anexar_buffer("macro_buffer", macro)
+    cookie = _cookie(_salvar(app, sessao))
+
+    sessao = _abrir(app, cookie)
+    assert sessao.contar_buffer("macro_buffer") == 3
+    assert list(sessao.buffer("macro_buffer")) == ["m1", "m2", "m1"]
+    assert sessao.contem_no_buffer("macro_buffer", "m2")
+    assert sessao.remover_do_buffer("macro_buffer", "m1")
+    assert not sessao.remover_do_buffer("macro_buffer", "m3")
+    assert list(sessao.buffer("macro_buffer")) == ["m1", "m2"]
+    sessao.limpar_buffer("macro_buffer")
+    assert sessao.contar_buffer("macro_buffer") == 0
+
+
+def test_varredura_remove_sessoes_expiradas_e_buffers(app, backend):
+    app.session_interface.ttl = -1
+    sessao = _abrir(app)
+    sessao["usuario_id"] = "u1"
+    sessao.anexar_buffer("macro_buffer", "m1")
+    cookie = _cookie(_salvar(app, sessao))
+
+    backend.limpar_expiradas()
+    assert backend.carregar(sessao.sid) is None
+    assert backend.contar(sessao.sid, "macro_buffer") == 0
+    assert _abrir(app, cookie).new
+
+
+def test_logout_remove_sessao_e_cookie(app, backend):
+    sessao = _abrir(app)
+    sessao["usuario_id"] = "u1"
+    sessao.anexar_buffer("macro_buffer", "m1")
+    cookie = _cookie(_salvar(app, sessao))
+
+    sessao = _abrir(app, cookie)
+    sessao.clear()
+    resposta = _salvar(app, sessao)
+    assert "Expires=Thu, 01 Jan 1970" in resposta.headers["Set-Cookie"]
+    assert backend.carregar(sessao.sid) is None
+    assert backend.contar(sessao.sid, "macro_buffer") == 0
+
+
+def test_login_troca_o_id_e_mantem_os_buffers(app, backend):
+    sessao = _abrir(app)
+    sessao["impressora"] = "BRTEMAN01"
+    sessao.anexar_buffer("macro_buffer", "m1")
+    cookie_fixado = _cookie(_salvar(app, sessao))
+    sid_anterior = sessao.sid
+
+    sessao = _abrir(app, cookie_fixado)
+    sessao.regenerar()
+    sessao["usuario_id"] = "u1"
+    assert sessao.contar_buffer("macro_buffer") == 1
+    cookie = _cookie(_salvar(app, sessao))
+
+    assert sessao.sid != sid_anterior
+    assert _abrir(app, cookie_fixado).new
+    assert backend.carregar(sid_anterior) is None
+    novo = _abrir(app, cookie)
+    assert (novo["usuario_id"], novo["impressora"]) == ("u1", "BRTEMAN01")
+    assert list(novo.buffer("macro_buffer")) == ["m1"]
+
+
+def test_rota_de_login_emite_novo_id(monkeypatch):
+    import app as aplicacao
+    monkeypatch.setattr(aplicacao, "autenticar_usuario", lambda uid: {"id": uid, "upin": "UPIN1"})
+    cliente = aplicacao.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao["impressora"] = "BRTEMAN01"
+        sid_anterior = sessao.sid
+
+    assert cliente.post("/login", json={"id": "u1"}).get_json()["success"]
+    with cliente.session_transaction() as sessao:
+        assert sessao.sid != sid_anterior
+        assert (sessao["usuario_id"], sessao["impressora"]) == ("u1", "BRTEMAN01")